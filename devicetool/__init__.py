@@ -3,11 +3,21 @@ isort:skip_file
 """
 
 from .devicetool import add_partition_number_to_device as add_partition_number_to_device
+from .devicetool import backup_file_name as backup_file_name
 from .devicetool import block_devices as block_devices
+from .devicetool import device_is_block_special_or_image as device_is_block_special_or_image
 from .devicetool import device_is_not_a_partition as device_is_not_a_partition
+from .devicetool import device_is_not_in_use as device_is_not_in_use
+from .devicetool import get_block_device_facts as get_block_device_facts
+from .devicetool import get_block_device_identity as get_block_device_identity
 from .devicetool import get_block_device_size as get_block_device_size
+from .devicetool import get_block_device_transport as get_block_device_transport
+from .devicetool import get_device_size as get_device_size
 from .devicetool import get_partuuid_for_partition as get_partuuid_for_partition
 from .devicetool import get_root_device as get_root_device
+from .devicetool import parse_backup_file_range as parse_backup_file_range
 from .devicetool import path_is_block_special as path_is_block_special
+from .devicetool import path_is_image_file as path_is_image_file
+from .devicetool import safety_check_clone as safety_check_clone
 from .devicetool import safety_check_devices as safety_check_devices
 from .devicetool import write_output as write_output
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+from collections.abc import Callable
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from .bufferpool import get_buffer_pool
+from .catalog import find_backup
+from .catalog import record_backup
+from .devicetool import backup_file_name
+from .devicetool import parse_backup_file_range
+from .devicetool import path_is_image_file
+from .rangeio import Flusher
+from .rangeio import buffers_equal
+from .rangeio import fill_from_source
+from .rangeio import iter_chunks
+from .rangeio import merge_extents
+from .rangeio import pread_into
+from .rangeio import pwrite_all
+from .rangeio import zero_range_sparse
+from .tuning import get_tuned_parameters
+
+DEFAULT_MAX_WORKERS = 64
+
+_executor: None | ThreadPoolExecutor = None
+
+
+def get_executor(max_workers: int = DEFAULT_MAX_WORKERS) -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="devicetool-aio",
+        )
+    return _executor
+
+
+def _tuned(
+    device: Path,
+    *,
+    chunk_size: None | int,
+    queue_depth: None | int,
+) -> tuple[int, int]:
+    if not (chunk_size and queue_depth):
+        tuned_chunk_size, tuned_queue_depth = get_tuned_parameters(device)
+        chunk_size = chunk_size or tuned_chunk_size
+        queue_depth = queue_depth or tuned_queue_depth
+    # compare borrows two chunks at a time
+    return get_buffer_pool().fit(chunk_size, 2), queue_depth
+
+
+async def _drive(
+    chunks: Iterable[tuple[int, int]],
+    *,
+    operation: Callable[[int, int], None | tuple[int, int]],
+    queue_depth: int,
+    executor: None | ThreadPoolExecutor,
+    progress: None | Callable[[int], None] = None,
+) -> list[tuple[int, int]]:
+    # queue_depth coroutines pull from one shared iterator, so at most
+    # queue_depth pread/pwrite calls are outstanding for this device; the
+    # first failure stops handing out chunks, and nothing returns (or
+    # raises) before every executor call is finished, the callers close
+    # their fds right after and a late pwrite must not hit a reused fd
+    assert queue_depth > 0
+    loop = asyncio.get_running_loop()
+    if executor is None:
+        executor = get_executor()
+    chunks = iter(chunks)
+    results: list[tuple[int, int]] = []
+    failed = False
+
+    async def _worker() -> None:
+        nonlocal failed
+        for offset, length in chunks:
+            if failed:
+                return
+            future = loop.run_in_executor(executor, operation, offset, length)
+            try:
+                result = await asyncio.shield(future)
+            except asyncio.CancelledError:
+                failed = True
+                # the thread cannot be cancelled, wait for it to let go
+                await asyncio.wait([future])
+                raise
+            except BaseException:
+                failed = True
+                raise
+            if result is not None:
+                results.append(result)
+            if progress is not None:
+                progress(length)
+
+    outcomes = await asyncio.gather(
+        *(_worker() for _ in range(queue_depth)),
+        return_exceptions=True,
+    )
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            raise outcome
+    return results
+
+
+async def backup(
+    device: Path,
+    *,
+    start: int,
+    end: int,
+    note: None | str = None,
+    backup_dir: Path = Path("."),
+    catalog_dir: None | Path = None,
+    no_catalog: bool = False,
+    queue_depth: None | int = None,
+    chunk_size: None | int = None,
+    executor: None | ThreadPoolExecutor = None,
+    progress: None | Callable[[int], None] = None,
+) -> Path:
+    device = Path(device)
+    chunk_size, queue_depth = _tuned(
+        device,
+        chunk_size=chunk_size,
+        queue_depth=queue_depth,
+    )
+    assert start >= 0
+    assert start < end
+    backup_file = Path(backup_dir) / backup_file_name(
+        device=device,
+        start=start,
+        end=end,
+        note=note,
+    )
+    dfd = os.open(device, os.O_RDONLY)
+    try:
+        bfd = os.open(backup_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+
+            def _copy(offset: int, length: int) -> None:
+                with get_buffer_pool().borrow(length) as buf:
+                    pread_into(dfd, buf, offset)
+                    pwrite_all(bfd, buf, offset - start)
+
+            await _drive(
+                iter_chunks(start=start, end=end, chunk_size=chunk_size),
+                operation=_copy,
+                queue_depth=queue_depth,
+                executor=executor,
+                progress=progress,
+            )
+        except BaseException:
+            os.unlink(backup_file)
+            raise
+        finally:
+            os.close(bfd)
+    finally:
+        os.close(dfd)
+    if not no_catalog:
+        await asyncio.get_running_loop().run_in_executor(
+            executor or get_executor(),
+            partial(
+                record_backup,
+                backup_file=backup_file,
+                device=device,
+                start=start,
+                end=end,
+                note=note,
+                catalog_dir=catalog_dir,
+            ),
+        )
+    return backup_file
+
+
+async def destroy_range(
+    device: Path,
+    *,
+    start: int,
+    end: int,
+    source: str,
+    no_backup: bool = False,
+    sparse: bool = False,
+    note: None | str = None,
+    backup_dir: Path = Path("."),
+    catalog_dir: None | Path = None,
+    flusher: None | Flusher = None,
+    queue_depth: None | int = None,
+    chunk_size: None | int = None,
+    executor: None | ThreadPoolExecutor = None,
+    progress: None | Callable[[int], None] = None,
+) -> None | Path:
+    device = Path(device)
+    if flusher is None:
+        flusher = Flusher()
+    chunk_size, queue_depth = _tuned(
+        device,
+        chunk_size=chunk_size,
+        queue_depth=queue_depth,
+    )
+    assert source in ("zero", "urandom"), f"source must be zero or urandom, not {source!r}"
+    assert start >= 0
+    assert start < end
+    backup_file = None
+    if not no_backup:
+        backup_file = await backup(
+            device,
+            start=start,
+            end=end,
+            note=note,
+            backup_dir=backup_dir,
+            catalog_dir=catalog_dir,
+            queue_depth=queue_depth,
+            chunk_size=chunk_size,
+            executor=executor,
+            progress=progress,
+        )
+    loop = asyncio.get_running_loop()
+    if source == "zero" and (sparse or path_is_image_file(device)):
+        dfd = os.open(device, os.O_RDWR)
+        try:
+            await loop.run_in_executor(
+                executor or get_executor(),
+                partial(
+                    zero_range_sparse,
+                    dfd,
+                    start=start,
+                    end=end,
+                    chunk_size=chunk_size,
+                    flusher=flusher,
+                ),
+            )
+            await loop.run_in_executor(executor or get_executor(), flusher.finish, dfd)
+        finally:
+            os.close(dfd)
+        if progress is not None:
+            progress(end - start)
+        return backup_file
+    dfd = os.open(device, os.O_WRONLY)
+    try:
+
+        def _wipe(offset: int, length: int) -> None:
+            with get_buffer_pool().borrow(length) as buf:
+                fill_from_source(buf, source)
+                pwrite_all(dfd, buf, offset)
+            flusher.wrote(dfd, length)
+
+        await _drive(
+            iter_chunks(start=start, end=end, chunk_size=chunk_size),
+            operation=_wipe,
+            queue_depth=queue_depth,
+            executor=executor,
+            progress=progress,
+        )
+        await loop.run_in_executor(executor or get_executor(), flusher.finish, dfd)
+    finally:
+        os.close(dfd)
+    return backup_file
+
+
+async def compare(
+    device: Path,
+    *,
+    backup_file: Path,
+    start: None | int = None,
+    end: None | int = None,
+    catalog_dir: None | Path = None,
+    queue_depth: None | int = None,
+    chunk_size: None | int = None,
+    executor: None | ThreadPoolExecutor = None,
+    progress: None | Callable[[int], None] = None,
+) -> list[tuple[int, int]]:
+    device = Path(device)
+    chunk_size, queue_depth = _tuned(
+        device,
+        chunk_size=chunk_size,
+        queue_depth=queue_depth,
+    )
+    if start is None or end is None:
+        entry = find_backup(backup_file=backup_file, catalog_dir=catalog_dir)
+        if entry:
+            _start, _end = entry["start"], entry["end"]
+        else:
+            _start, _end = parse_backup_file_range(Path(backup_file).as_posix())
+        start = _start if start is None else start
+        end = _end if end is None else end
+    assert start < end
+    dfd = os.open(device, os.O_RDONLY)
+    try:
+        bfd = os.open(backup_file, os.O_RDONLY)
+        try:
+
+            def _compare(offset: int, length: int) -> None | tuple[int, int]:
+                with get_buffer_pool().borrow_many(length, 2) as (current, saved):
+                    pread_into(dfd, current, offset)
+                    pread_into(bfd, saved, offset - start)
+                    if not buffers_equal(current, saved):
+                        return offset, offset + length
+                return None
+
+            differing = await _drive(
+                iter_chunks(start=start, end=end, chunk_size=chunk_size),
+                operation=_compare,
+                queue_depth=queue_depth,
+                executor=executor,
+                progress=progress,
+            )
+        finally:
+            os.close(bfd)
+    finally:
+        os.close(dfd)
+    return merge_extents(differing)
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import socket
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .bufferpool import get_buffer_pool
+from .devicetool import get_block_device_identity
+from .devicetool import get_device_size
+from .rangeio import DEFAULT_CHUNK_SIZE
+from .rangeio import Flusher
+from .rangeio import iter_chunks
+from .rangeio import pread_into
+from .rangeio import preadv_into
+from .rangeio import pwrite_all
+from .rangeio import pwritev_all
+from .trace import traced
+
+# layout: ARCHIVE_MAGIC, the range payloads back to back, a JSON index,
+# then a fixed size footer holding the offset and length of the index
+ARCHIVE_MAGIC = b"DTARCH01"
+FOOTER_MAGIC = b"DTINDEX1"
+FOOTER = struct.Struct("<8sQQ")
+ARCHIVE_VERSION = 1
+MEMBER_IOVECS = 4
+
+
+def _backup_member(
+    *,
+    device: Path,
+    start: int,
+    end: int,
+    archive_fd: int,
+    offset: int,
+    chunk_size: int,
+) -> str:
+    # each preadv fills MEMBER_IOVECS pool buffers and one pwritev puts
+    # them into the member's slot, a quarter of the syscalls of one buffer
+    digest = hashlib.sha256()
+    chunk_size = get_buffer_pool().fit(min(chunk_size, end - start), MEMBER_IOVECS)
+    span = chunk_size * MEMBER_IOVECS
+    dfd = os.open(device, os.O_RDONLY)
+    try:
+        with get_buffer_pool().borrow_many(chunk_size, MEMBER_IOVECS) as bufs:
+            for span_start, length in iter_chunks(start=start, end=end, chunk_size=span):
+                views = [
+                    buf[: max(0, min(chunk_size, length - index * chunk_size))]
+                    for index, buf in enumerate(bufs)
+                ]
+                preadv_into(dfd, views, span_start)
+                for view in views:
+                    digest.update(view)
+                pwritev_all(archive_fd, views, offset + span_start - start)
+    finally:
+        os.close(dfd)
+    return digest.hexdigest()
+
+
+@traced()
+def write_archive(
+    archive: Path,
+    *,
+    ranges: list[tuple[Path, int, int]],
+    note: None | str = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_workers: int = 16,
+) -> dict:
+    # every member gets its archive offset up front, so the device reads
+    # run in parallel and each one writes straight into its own slot
+    assert ranges
+    identities = {}
+    members = []
+    offset = len(ARCHIVE_MAGIC)
+    for device, start, end in ranges:
+        device = Path(device)
+        if device not in identities:
+            identities[device] = get_block_device_identity(device)
+        device_size = get_device_size(device)
+        assert 0 <= start < end <= device_size, (device, start, end, device_size)
+        members.append(
+            {
+                "device": device.as_posix(),
+                "start": start,
+                "end": end,
+                "offset": offset,
+                "length": end - start,
+                "identity": identities[device],
+            }
+        )
+        offset += end - start
+    index_offset = offset
+
+    fd = os.open(archive, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        pwrite_all(fd, memoryview(ARCHIVE_MAGIC), 0)
+        with ThreadPoolExecutor(
+            max_workers=min(max_workers, len(members)),
+            thread_name_prefix="devicetool-archive",
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _backup_member,
+                    device=Path(member["device"]),
+                    start=member["start"],
+                    end=member["end"],
+                    archive_fd=fd,
+                    offset=member["offset"],
+                    chunk_size=chunk_size,
+                )
+                for member in members
+            ]
+            for member, future in zip(members, futures):
+                member["sha256"] = future.result()
+        index = {
+            "version": ARCHIVE_VERSION,
+            "host": socket.gethostname(),
+            "timestamp": time.time(),
+            "note": note,
+            "members": members,
+        }
+        index_bytes = json.dumps(index, sort_keys=True).encode()
+        pwrite_all(fd, memoryview(index_bytes), index_offset)
+        footer = FOOTER.pack(FOOTER_MAGIC, index_offset, len(index_bytes))
+        pwrite_all(fd, memoryview(footer), index_offset + len(index_bytes))
+        Flusher().finish(fd)
+    except BaseException:
+        os.unlink(archive)
+        raise
+    finally:
+        os.close(fd)
+    return index
+
+
+def read_archive_index(archive: Path) -> dict:
+    with open(archive, "rb") as fh:
+        header = fh.read(len(ARCHIVE_MAGIC))
+        if header != ARCHIVE_MAGIC:
+            raise ValueError(f"{archive} is not a devicetool archive")
+        fh.seek(-FOOTER.size, os.SEEK_END)
+        magic, index_offset, index_length = FOOTER.unpack(fh.read(FOOTER.size))
+        if magic != FOOTER_MAGIC:
+            raise ValueError(f"{archive} has no index footer, it was not finished")
+        fh.seek(index_offset)
+        index = json.loads(fh.read(index_length))
+    if index["version"] != ARCHIVE_VERSION:
+        raise ValueError(f"{archive} is archive version {index['version']}")
+    return index
+
+
+def find_archive_members(
+    index: dict,
+    *,
+    device: None | Path = None,
+    start: None | int = None,
+    end: None | int = None,
+) -> list[dict]:
+    members = index["members"]
+    if device is not None:
+        members = [_ for _ in members if _["device"] == Path(device).as_posix()]
+    if start is not None:
+        members = [_ for _ in members if _["start"] == start]
+    if end is not None:
+        members = [_ for _ in members if _["end"] == end]
+    return members
+
+
+@traced()
+def extract_member(
+    archive: Path,
+    *,
+    member: dict,
+    output: Path,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> None:
+    # reads only the member's own slot and checks it against the index
+    digest = hashlib.sha256()
+    chunk_size = get_buffer_pool().fit(chunk_size)
+    afd = os.open(archive, os.O_RDONLY)
+    try:
+        ofd = os.open(output, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            with get_buffer_pool().borrow(min(chunk_size, member["length"])) as buf:
+                for offset, length in iter_chunks(
+                    start=0,
+                    end=member["length"],
+                    chunk_size=chunk_size,
+                ):
+                    view = buf[:length]
+                    pread_into(afd, view, member["offset"] + offset)
+                    digest.update(view)
+                    pwrite_all(ofd, view, offset)
+            if digest.hexdigest() != member["sha256"]:
+                raise ValueError(
+                    f"{archive}: {member['device']} {member['start']}-{member['end']}"
+                    " does not match its sha256"
+                )
+        except BaseException:
+            os.unlink(output)
+            raise
+        finally:
+            os.close(ofd)
+    finally:
+        os.close(afd)
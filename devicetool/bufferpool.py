@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+DEFAULT_BUFFER_BUDGET = 256 * 1024 * 1024
+# enough for the fixed 64 KiB scan blocks and one default sized chunk
+MIN_BUFFER_BUDGET = 1024 * 1024
+
+
+class BufferPool:
+    # buffers are anonymous mmaps, so they are page aligned (O_DIRECT safe)
+    # and handed back to the kernel when dropped; borrowers block while the
+    # budget is spent instead of allocating past it
+    def __init__(self, *, budget: int = DEFAULT_BUFFER_BUDGET) -> None:
+        assert budget >= MIN_BUFFER_BUDGET, f"buffer budget must be at least {MIN_BUFFER_BUDGET}"
+        self.budget = budget
+        self.condition = threading.Condition()
+        self.free: dict[int, list[mmap.mmap]] = defaultdict(list)
+        self.allocated = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.allocations = 0
+        self.borrows = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    def fit(self, size: int, count: int = 1, *, align: int = mmap.PAGESIZE) -> int:
+        # the chunk size to use so that count buffers of it fit the budget;
+        # a small budget costs chunk size instead of failing the borrow
+        limit = self.budget // count // mmap.PAGESIZE * mmap.PAGESIZE
+        if size <= limit:
+            return size
+        fitting = limit // align * align
+        assert fitting > 0, f"{count} buffers of {align} bytes exceed the {self.budget} byte budget"
+        return fitting
+
+    def _evict(self, needed: int, *, keep: int) -> bool:
+        # idle buffers of other sizes are dropped, but only when that
+        # actually makes enough room; they are not closed, a stray slice
+        # may still export them, the mapping goes when the last one does
+        idle = sum(size * len(bufs) for size, bufs in self.free.items() if size != keep)
+        if idle < needed:
+            return False
+        for size, bufs in self.free.items():
+            while bufs and needed > 0 and size != keep:
+                bufs.pop()
+                self.allocated -= size
+                needed -= size
+        return True
+
+    def _acquire(self, size: int, count: int) -> list[mmap.mmap]:
+        assert size * count <= self.budget, (
+            f"{count} buffers of {size} bytes exceed the {self.budget} byte buffer budget"
+        )
+        waited = None
+        with self.condition:
+            while True:
+                reused = min(count, len(self.free[size]))
+                needed = self.allocated + (count - reused) * size - self.budget
+                if needed <= 0 or self._evict(needed, keep=size):
+                    break
+                if waited is None:
+                    waited = time.monotonic()
+                    self.waits += 1
+                self.condition.wait()
+            if waited is not None:
+                self.wait_seconds += time.monotonic() - waited
+            bufs = [self.free[size].pop() for _ in range(reused)]
+            bufs += [mmap.mmap(-1, size) for _ in range(count - reused)]
+            self.allocated += (count - reused) * size
+            self.allocations += count - reused
+            self.borrows += count
+            self.in_use += size * count
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return bufs
+
+    def _release(self, bufs: list[mmap.mmap], size: int) -> None:
+        with self.condition:
+            self.free[size].extend(bufs)
+            self.in_use -= size * len(bufs)
+            self.condition.notify_all()
+
+    @contextmanager
+    def borrow_many(self, size: int, count: int) -> Iterator[list[memoryview]]:
+        # all count buffers are taken at once, so two borrowers that each
+        # need several can never deadlock holding half of what they need
+        assert size > 0
+        assert count > 0
+        rounded = -(-size // mmap.PAGESIZE) * mmap.PAGESIZE
+        bufs = self._acquire(rounded, count)
+        views = [memoryview(_)[:size] for _ in bufs]
+        try:
+            yield views
+        finally:
+            for view in views:
+                view.release()
+            self._release(bufs, rounded)
+
+    @contextmanager
+    def borrow(self, size: int) -> Iterator[memoryview]:
+        with self.borrow_many(size, 1) as views:
+            yield views[0]
+
+    @property
+    def stats(self) -> dict:
+        with self.condition:
+            return {
+                "budget": self.budget,
+                "allocated": self.allocated,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "allocations": self.allocations,
+                "borrows": self.borrows,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 6),
+            }
+
+
+_buffer_pool: None | BufferPool = None
+_buffer_pool_lock = threading.Lock()
+
+
+def get_buffer_budget() -> int:
+    if os.environ.get("DEVICETOOL_BUFFER_BUDGET"):
+        return int(os.environ["DEVICETOOL_BUFFER_BUDGET"])
+    return DEFAULT_BUFFER_BUDGET
+
+
+def get_buffer_pool() -> BufferPool:
+    # executor threads borrow concurrently, two pools would double the budget
+    global _buffer_pool
+    with _buffer_pool_lock:
+        if _buffer_pool is None:
+            _buffer_pool = BufferPool(budget=get_buffer_budget())
+        return _buffer_pool
+
+
+def set_buffer_budget(budget: int) -> BufferPool:
+    # only before any buffer is borrowed, a pool cannot shrink under borrowers
+    global _buffer_pool
+    with _buffer_pool_lock:
+        assert _buffer_pool is None or not _buffer_pool.in_use
+        _buffer_pool = BufferPool(budget=budget)
+        return _buffer_pool
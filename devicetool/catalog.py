@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import hashlib
+import os
+import sqlite3
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from .bufferpool import get_buffer_pool
+from .devicetool import get_block_device_identity
+
+CATALOG_NAME = "backups.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    device TEXT NOT NULL,
+    serial TEXT,
+    wwn TEXT,
+    model TEXT,
+    device_size INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    note TEXT,
+    host TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS backups_serial ON backups (serial, start, end, timestamp);
+CREATE INDEX IF NOT EXISTS backups_wwn ON backups (wwn, start, end, timestamp);
+CREATE INDEX IF NOT EXISTS backups_device ON backups (device, device_size, start, end, timestamp);
+"""
+
+
+def get_catalog_dir(catalog_dir: None | Path = None) -> Path:
+    if catalog_dir:
+        return Path(catalog_dir)
+    if os.environ.get("DEVICETOOL_CATALOG_DIR"):
+        return Path(os.environ["DEVICETOOL_CATALOG_DIR"])
+    data_home = os.environ.get("XDG_DATA_HOME") or Path.home() / ".local" / "share"
+    return Path(data_home) / "devicetool"
+
+
+@contextmanager
+def open_catalog(catalog_dir: None | Path = None) -> Iterator[sqlite3.Connection]:
+    catalog_dir = get_catalog_dir(catalog_dir)
+    catalog_dir.mkdir(parents=True, exist_ok=True)
+    connection = sqlite3.connect(catalog_dir / CATALOG_NAME)
+    try:
+        connection.row_factory = sqlite3.Row
+        connection.executescript(_SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def file_sha256(path: Path, *, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with get_buffer_pool().borrow(chunk_size) as view, open(path, "rb", buffering=0) as fh:
+        while count := fh.readinto(view):
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+
+def record_backup(
+    *,
+    backup_file: Path,
+    device: Path,
+    start: int,
+    end: int,
+    note: None | str,
+    sha256: None | str = None,
+    catalog_dir: None | Path = None,
+) -> dict:
+    identity = get_block_device_identity(device)
+    if sha256 is None:
+        sha256 = file_sha256(backup_file)
+    entry = {
+        "path": Path(backup_file).resolve().as_posix(),
+        # relative names and by-id symlinks would miss the path fallback later
+        "device": Path(device).resolve().as_posix(),
+        "serial": identity["serial"],
+        "wwn": identity["wwn"],
+        "model": identity["model"],
+        "device_size": identity["size"],
+        "start": start,
+        "end": end,
+        "note": note,
+        "host": os.uname()[1],
+        "timestamp": time.time(),
+        "sha256": sha256,
+    }
+    with open_catalog(catalog_dir) as connection:
+        connection.execute(
+            f"INSERT OR REPLACE INTO backups ({', '.join(entry)}) "
+            f"VALUES ({', '.join('?' for _ in entry)})",
+            tuple(entry.values()),
+        )
+    return entry
+
+
+def find_backup(
+    *,
+    backup_file: Path,
+    catalog_dir: None | Path = None,
+) -> None | dict:
+    with open_catalog(catalog_dir) as connection:
+        row = connection.execute(
+            "SELECT * FROM backups WHERE path = ?",
+            (Path(backup_file).resolve().as_posix(),),
+        ).fetchone()
+    return dict(row) if row else None
+
+
+def _identity_clause(identity: dict) -> tuple[str, tuple]:
+    # serial and wwn survive renumbering of /dev names, the path is the fallback
+    if identity["serial"]:
+        return "serial = ?", (identity["serial"],)
+    if identity["wwn"]:
+        return "wwn = ?", (identity["wwn"],)
+    device = Path(identity["device"]).resolve().as_posix()
+    return "device = ? AND device_size = ?", (device, identity["size"])
+
+
+def list_backups(
+    *,
+    device: None | Path = None,
+    start: None | int = None,
+    end: None | int = None,
+    region: None | str = None,
+    limit: None | int = None,
+    catalog_dir: None | Path = None,
+) -> list[dict]:
+    assert region in (None, "head", "tail"), f"region must be head or tail, not {region!r}"
+    clauses: list[str] = []
+    parameters: list = []
+    if device:
+        clause, values = _identity_clause(get_block_device_identity(device))
+        clauses.append(clause)
+        parameters.extend(values)
+    if start is not None:
+        clauses.append("start = ?")
+        parameters.append(start)
+    if end is not None:
+        clauses.append("end = ?")
+        parameters.append(end)
+    if region == "head":
+        clauses.append("start = 0")
+    elif region == "tail":
+        clauses.append("end = device_size")
+    query = "SELECT * FROM backups"
+    if clauses:
+        query += " WHERE " + " AND ".join(clauses)
+    query += " ORDER BY timestamp DESC"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    with open_catalog(catalog_dir) as connection:
+        return [dict(_) for _ in connection.execute(query, parameters)]
+
+
+def latest_backup(
+    *,
+    device: Path,
+    start: None | int = None,
+    end: None | int = None,
+    region: None | str = None,
+    catalog_dir: None | Path = None,
+) -> None | dict:
+    found = list_backups(
+        device=device,
+        start=start,
+        end=end,
+        region=region,
+        limit=1,
+        catalog_dir=catalog_dir,
+    )
+    return found[0] if found else None
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 
+import asyncio
+import cProfile
+import json
 import os
 import sys
 import time
+from functools import partial
 from pathlib import Path
 
 import click
@@ -18,18 +22,102 @@ from globalverbose import gvd
 from mounttool import block_special_path_is_mounted
 from pathtool import path_is_block_special
 from pathtool import wait_for_block_special_device_to_exist
-from timestamptool import get_timestamp
 from warntool import warn
 
 from devicetool import add_partition_number_to_device
+from devicetool import backup_file_name
+from devicetool import device_is_block_special_or_image
 from devicetool import device_is_not_a_partition
-from devicetool import get_block_device_size
+from devicetool import device_is_not_in_use
+from devicetool import get_block_device_identity
+from devicetool import get_device_size
 from devicetool import get_partuuid_for_partition
 from devicetool import get_root_device
+from devicetool import parse_backup_file_range
+from devicetool import path_is_image_file
+from devicetool import safety_check_clone
 from devicetool import write_output
-
-_parted = hs.Command("parted")
-_cryptsetup = hs.Command("cryptsetup")
+from devicetool.archive import extract_member
+from devicetool.archive import find_archive_members
+from devicetool.archive import read_archive_index
+from devicetool.archive import write_archive
+from devicetool.bufferpool import MIN_BUFFER_BUDGET
+from devicetool.bufferpool import get_buffer_pool
+from devicetool.bufferpool import set_buffer_budget
+from devicetool.catalog import file_sha256
+from devicetool.catalog import find_backup
+from devicetool.catalog import latest_backup
+from devicetool.catalog import list_backups as _list_backups
+from devicetool.catalog import record_backup
+from devicetool.clone import clone_device as _clone_device
+from devicetool.clone import verify_clone
+from devicetool.consistency import COMPARE_BLOCK_SIZE
+from devicetool.consistency import compare_devices as _compare_devices
+from devicetool.daemon import DeviceToolDaemon
+from devicetool.daemon import default_socket_path
+from devicetool.daemon import submit_job
+from devicetool.rangeio import DEFAULT_FLUSH_BYTES
+from devicetool.rangeio import DURABILITY_POLICIES
+from devicetool.rangeio import Flusher
+from devicetool.rangeio import backup_then_wipe_range
+from devicetool.rangeio import copy_range
+from devicetool.rangeio import fill_from_source
+from devicetool.rangeio import flush_device
+from devicetool.rangeio import iter_chunks
+from devicetool.rangeio import pwrite_all
+from devicetool.rangeio import zero_range_sparse
+from devicetool.readscan import DEFAULT_REGIONS
+from devicetool.readscan import DEFAULT_SLOW_MS
+from devicetool.readscan import read_scan as _read_scan
+from devicetool.scanmap import BLOCK_CLASSES
+from devicetool.scanmap import SCAN_BLOCK_SIZE
+from devicetool.scanmap import map_extents
+from devicetool.scanmap import scan_map as _scan_map
+from devicetool.signatures import candidate_signatures
+from devicetool.signatures import find_signatures
+from devicetool.signatures import scan_signatures as _scan_signatures
+from devicetool.signatures import signature_extents
+from devicetool.trace import TracedCommand
+from devicetool.trace import enable_tracing
+from devicetool.trace import phase
+from devicetool.trace import trace_commands
+from devicetool.trace import traced
+from devicetool.trace import write_trace
+from devicetool.tuning import PROBE_BLOCK_SIZES
+from devicetool.tuning import PROBE_BYTES
+from devicetool.tuning import PROBE_QUEUE_DEPTHS
+from devicetool.tuning import get_tuned_parameters
+from devicetool.tuning import probe_throughput as _probe_throughput
+from devicetool.tuning import store_tuned_parameters
+from devicetool.usage import get_device_usage_index
+from devicetool.watch import POLL_INTERVAL
+from devicetool.watch import DeviceEvent
+from devicetool.watch import Watcher
+from devicetool.watch import load_rules
+from devicetool.watch import open_event_source
+
+_parted = TracedCommand(hs.Command("parted"))
+_cryptsetup = TracedCommand(hs.Command("cryptsetup"))
+_dd_rescue = TracedCommand(hs.Command("dd_rescue"))
+_vbindiff = TracedCommand(hs.Command("vbindiff"))
+
+click_durability_options = [
+    click.option(
+        "--durability",
+        is_flag=False,
+        type=click.Choice(DURABILITY_POLICIES),
+        default="end",
+    ),
+    click.option("--flush-bytes", is_flag=False, type=int, default=DEFAULT_FLUSH_BYTES),
+]
+
+warn = traced("warn")(warn)
+block_special_path_is_mounted = traced("block_special_path_is_mounted")(
+    block_special_path_is_mounted
+)
+wait_for_block_special_device_to_exist = traced("wait_for_block_special_device_to_exist")(
+    wait_for_block_special_device_to_exist
+)
 
 
 def _ask(command) -> None:
@@ -40,10 +128,18 @@ def _ask(command) -> None:
 
 
 @click.group(no_args_is_help=True, cls=AHGroup)
+@click.option("--trace", "trace_file", is_flag=False, type=click.Path(path_type=Path))
+@click.option("--profile", "profile_file", is_flag=False, type=click.Path(path_type=Path))
+@click.option("--buffer-budget", is_flag=False, type=click.IntRange(min=MIN_BUFFER_BUDGET))
+@click.option("--buffer-stats", is_flag=True, required=False)
 @click_add_options(click_global_options)
 @click.pass_context
 def cli(
     ctx: click.Context,
+    trace_file: None | Path,
+    profile_file: None | Path,
+    buffer_budget: None | int,
+    buffer_stats: bool,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -55,6 +151,27 @@ def cli(
         ic=ic,
         gvd=gvd,
     )
+    if trace_file:
+        enable_tracing()
+        ctx.call_on_close(partial(write_trace, trace_file))
+    if profile_file:
+        profiler = cProfile.Profile()
+
+        def _dump_profile() -> None:
+            profiler.disable()
+            profiler.dump_stats(profile_file)
+
+        ctx.call_on_close(_dump_profile)
+        profiler.enable()
+    # one pool bounds the data buffers of every operation in this process
+    if buffer_budget:
+        set_buffer_budget(buffer_budget)
+    if buffer_stats:
+
+        def _print_buffer_stats() -> None:
+            eprint("buffer pool:", get_buffer_pool().stats)
+
+        ctx.call_on_close(_print_buffer_stats)
 
 
 @cli.command()
@@ -77,6 +194,8 @@ def cli(
     type=int,
 )
 @click.option("--note", is_flag=False, type=str)
+@click.option("--catalog-dir", is_flag=False, type=click.Path(path_type=Path))
+@click.option("--no-catalog", is_flag=True, required=False)
 @click_add_options(click_global_options)
 @click.pass_context
 def backup_byte_range(
@@ -86,6 +205,8 @@ def backup_byte_range(
     start: int,
     end: int,
     note: str,
+    catalog_dir: None | Path,
+    no_catalog: bool,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -99,26 +220,42 @@ def backup_byte_range(
     )
 
     device = Path(device)
-    with open(device, "rb") as dfh:
-        bytes_to_read = end - start
-        assert bytes_to_read > 0
-        dfh.seek(start)
-        bytes_read = dfh.read(bytes_to_read)
-        assert len(bytes_read) == bytes_to_read
-
-    time_stamp = str(get_timestamp())
-    running_on_hostname = os.uname()[1]
-    device_string = device.as_posix().replace("/", "_")
-    backup_file_tail = (
-        f"_.{device_string}.{time_stamp}.{running_on_hostname}"
-        f"_start_{start}_end_{end}.bak"
-    )
-    if note:
-        backup_file = f"_backup_{note}{backup_file_tail}"
-    else:
-        backup_file = f"_backup__.{backup_file_tail}"
-    with open(backup_file, "xb") as bfh:
-        bfh.write(bytes_read)
+    bytes_to_read = end - start
+    assert bytes_to_read > 0
+    backup_file = backup_file_name(device=device, start=start, end=end, note=note)
+    # the data moves device -> backup file inside the kernel when it can,
+    # copy_range falls back to a reused buffer otherwise
+    dfd = os.open(device, os.O_RDONLY)
+    try:
+        bfd = os.open(backup_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            method = copy_range(
+                src_fd=dfd,
+                src_offset=start,
+                dst_fd=bfd,
+                dst_offset=0,
+                length=bytes_to_read,
+                chunk_size=get_tuned_parameters(device)[0],
+            )
+        except BaseException:
+            os.unlink(backup_file)
+            raise
+        finally:
+            os.close(bfd)
+    finally:
+        os.close(dfd)
+    ic(method)
+    assert Path(backup_file).stat().st_size == bytes_to_read
+
+    if not no_catalog:
+        record_backup(
+            backup_file=Path(backup_file),
+            device=device,
+            start=start,
+            end=end,
+            note=note,
+            catalog_dir=catalog_dir,
+        )
     print(backup_file)
     return backup_file
 
@@ -130,18 +267,22 @@ def backup_byte_range(
     required=True,
     type=click.Path(exists=True, path_type=Path),
 )
-@click.option("--backup-file", is_flag=False, required=True)
+@click.option("--backup-file", is_flag=False, type=str)
 @click.option("--start", is_flag=False, type=int)
 @click.option("--end", is_flag=False, type=int)
+@click.option("--region", is_flag=False, type=click.Choice(["head", "tail"]))
+@click.option("--catalog-dir", is_flag=False, type=click.Path(path_type=Path))
 @click_add_options(click_global_options)
 @click.pass_context
 def compare_byte_range(
     ctx: click.Context,
     *,
     device: Path,
-    backup_file: str,
+    backup_file: None | str,
     start: None | int,
     end: None | int,
+    region: None | str,
+    catalog_dir: None | Path,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -155,18 +296,360 @@ def compare_byte_range(
     )
 
     device = Path(device)
-    if not start:
-        start = int(backup_file.split("start_")[1].split("_")[0])
-    if not end:
-        end = int(backup_file.split("end_")[1].split("_")[0].split(".")[0])
+    if backup_file:
+        entry = find_backup(backup_file=Path(backup_file), catalog_dir=catalog_dir)
+    else:
+        entry = latest_backup(
+            device=device,
+            start=start,
+            end=end,
+            region=region,
+            catalog_dir=catalog_dir,
+        )
+        assert entry, f"no catalogued backup of {device} matches"
+        backup_file = entry["path"]
+    ic(entry)
+    if entry:
+        start = entry["start"] if start is None else start
+        end = entry["end"] if end is None else end
+    if start is None or end is None:
+        _start, _end = parse_backup_file_range(backup_file)
+        start = _start if start is None else start
+        end = _end if end is None else end
     current_copy = ctx.invoke(
         backup_byte_range,
         device=device,
         start=start,
         end=end,
         note="current",
+        no_catalog=True,
+    )
+    _vbindiff(current_copy, backup_file, _fg=True)
+
+
+@cli.command()
+@click.option(
+    "--device",
+    is_flag=False,
+    required=True,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--backup-file", is_flag=False, type=click.Path(exists=True, path_type=Path))
+@click.option("--region", is_flag=False, type=click.Choice(["head", "tail"]))
+@click.option("--catalog-dir", is_flag=False, type=click.Path(path_type=Path))
+@click.option("--force", is_flag=True, required=False)
+@click.option("--no-backup", is_flag=True, required=False)
+@click_add_options(click_durability_options)
+@click_add_options(click_global_options)
+@click.pass_context
+def restore_byte_range(
+    ctx: click.Context,
+    *,
+    device: Path,
+    backup_file: None | Path,
+    region: None | str,
+    catalog_dir: None | Path,
+    force: bool,
+    no_backup: bool,
+    durability: str,
+    flush_bytes: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    device = Path(device)
+    assert device_is_block_special_or_image(device=device)
+    assert device_is_not_in_use(device=device)
+    if backup_file:
+        entry = find_backup(backup_file=backup_file, catalog_dir=catalog_dir)
+        assert entry, f"{backup_file} is not in the backup catalog"
+    else:
+        entry = latest_backup(device=device, region=region, catalog_dir=catalog_dir)
+        assert entry, f"no catalogued backup of {device} matches"
+    ic(entry)
+    identity = get_block_device_identity(device)
+    assert identity["size"] == entry["device_size"], (identity, entry)
+    for key in ("serial", "wwn"):
+        if entry[key]:
+            assert identity[key] == entry[key], (identity, entry)
+    start, end = entry["start"], entry["end"]
+    assert Path(entry["path"]).stat().st_size == end - start
+    assert (
+        file_sha256(entry["path"]) == entry["sha256"]
+    ), f"{entry['path']} does not match its catalogued sha256"
+    eprint("restoring:", entry["path"], "to:", device, start, end)
+    if not force:
+        warn(
+            (device,),
+            symlink_ok=True,
+        )
+    if not no_backup:
+        # kept out of the catalog, or it would become the latest backup of
+        # the range and a later compare or restore would pick it
+        ctx.invoke(
+            backup_byte_range,
+            device=device,
+            start=start,
+            end=end,
+            note="prerestore",
+            no_catalog=True,
+        )
+    flusher = Flusher(durability, flush_bytes=flush_bytes)
+    started = time.monotonic()
+    bfd = os.open(entry["path"], os.O_RDONLY)
+    try:
+        dfd = os.open(device, os.O_WRONLY)
+        try:
+            copy_range(
+                src_fd=bfd,
+                src_offset=0,
+                dst_fd=dfd,
+                dst_offset=start,
+                length=end - start,
+                chunk_size=get_tuned_parameters(device)[0],
+                flusher=flusher,
+            )
+            flusher.finish(dfd)
+        finally:
+            os.close(dfd)
+    finally:
+        os.close(bfd)
+    eprint("restored:", {**flusher.stats, "total_seconds": round(time.monotonic() - started, 6)})
+
+
+@cli.command()
+@click.option(
+    "--device",
+    is_flag=False,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--region", is_flag=False, type=click.Choice(["head", "tail"]))
+@click.option("--limit", is_flag=False, type=int)
+@click.option("--catalog-dir", is_flag=False, type=click.Path(path_type=Path))
+@click_add_options(click_global_options)
+@click.pass_context
+def list_backups(
+    ctx: click.Context,
+    *,
+    device: None | Path,
+    region: None | str,
+    limit: None | int,
+    catalog_dir: None | Path,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    entries = _list_backups(
+        device=device,
+        region=region,
+        limit=limit,
+        catalog_dir=catalog_dir,
+    )
+    print(json.dumps(entries, indent=2))
+
+
+def _parse_byte_range(byte_range: str) -> tuple[int, int]:
+    start, _, end = byte_range.partition(":")
+    return int(start), int(end)
+
+
+@cli.command()
+@click.argument(
+    "devices",
+    required=True,
+    nargs=-1,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--archive", is_flag=False, required=True, type=click.Path(path_type=Path))
+@click.option("--head", "head_size", is_flag=False, type=int)
+@click.option("--tail", "tail_size", is_flag=False, type=int)
+@click.option("--range", "byte_ranges", is_flag=False, multiple=True, type=str)
+@click.option("--note", is_flag=False, type=str)
+@click.option("--max-workers", is_flag=False, type=int, default=16)
+@click_add_options(click_global_options)
+@click.pass_context
+def backup_devices(
+    ctx: click.Context,
+    *,
+    devices: tuple[Path, ...],
+    archive: Path,
+    head_size: None | int,
+    tail_size: None | int,
+    byte_ranges: tuple[str, ...],
+    note: None | str,
+    max_workers: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> Path:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    assert head_size or tail_size or byte_ranges, "give --head, --tail or --range"
+    ranges = []
+    for device in devices:
+        device = Path(device)
+        assert device_is_block_special_or_image(device=device)
+        device_size = get_device_size(device)
+        if head_size:
+            ranges.append((device, 0, min(head_size, device_size)))
+        if tail_size:
+            ranges.append((device, max(0, device_size - tail_size), device_size))
+        for byte_range in byte_ranges:
+            ranges.append((device, *_parse_byte_range(byte_range)))
+    chunk_size = min(get_tuned_parameters(Path(device))[0] for device in devices)
+    started = time.monotonic()
+    index = write_archive(
+        archive,
+        ranges=ranges,
+        note=note,
+        chunk_size=chunk_size,
+        max_workers=max_workers,
+    )
+    total = sum(member["length"] for member in index["members"])
+    elapsed = time.monotonic() - started
+    eprint(
+        "archived:",
+        len(index["members"]),
+        "ranges,",
+        total,
+        "bytes in",
+        round(elapsed, 3),
+        "seconds to:",
+        archive,
+    )
+    return Path(archive)
+
+
+@cli.command()
+@click.argument(
+    "devices",
+    required=True,
+    nargs=-1,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--head", "head_size", is_flag=False, type=int)
+@click.option("--tail", "tail_size", is_flag=False, type=int)
+@click.option("--range", "byte_ranges", is_flag=False, multiple=True, type=str)
+@click.option("--chunk-size", is_flag=False, type=int)
+@click.option("--block-size", is_flag=False, type=int, default=COMPARE_BLOCK_SIZE)
+@click_add_options(click_global_options)
+@click.pass_context
+def compare_devices(
+    ctx: click.Context,
+    *,
+    devices: tuple[Path, ...],
+    head_size: None | int,
+    tail_size: None | int,
+    byte_ranges: tuple[str, ...],
+    chunk_size: None | int,
+    block_size: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    for device in devices:
+        assert device_is_block_special_or_image(device=device)
+    device_size = min(get_device_size(device) for device in devices)
+    ranges = [_parse_byte_range(byte_range) for byte_range in byte_ranges]
+    if head_size:
+        ranges.append((0, min(head_size, device_size)))
+    if tail_size:
+        ranges.append((max(0, device_size - tail_size), device_size))
+    if not ranges:
+        ranges.append((0, device_size))
+    if not chunk_size:
+        chunk_size = min(get_tuned_parameters(Path(device))[0] for device in devices)
+    result = _compare_devices(
+        list(devices),
+        ranges=ranges,
+        chunk_size=chunk_size,
+        block_size=block_size,
+    )
+    print(json.dumps(result, indent=2))
+    if not result["identical"]:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument(
+    "archive",
+    required=True,
+    nargs=1,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--list", "list_members", is_flag=True, required=False)
+@click.option("--device", is_flag=False, type=click.Path(path_type=Path))
+@click.option("--start", is_flag=False, type=int)
+@click.option("--end", is_flag=False, type=int)
+@click.option("--output-dir", is_flag=False, type=click.Path(path_type=Path), default=Path("."))
+@click_add_options(click_global_options)
+@click.pass_context
+def extract_archive(
+    ctx: click.Context,
+    *,
+    archive: Path,
+    list_members: bool,
+    device: None | Path,
+    start: None | int,
+    end: None | int,
+    output_dir: Path,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
     )
-    hs.Command("vbindiff")(current_copy, backup_file, _fg=True)
+
+    index = read_archive_index(archive)
+    members = find_archive_members(index, device=device, start=start, end=end)
+    if list_members:
+        print(json.dumps({**index, "members": members}, indent=2))
+        return
+    assert members, f"no member of {archive} matches"
+    for member in members:
+        output = Path(output_dir) / backup_file_name(
+            device=Path(member["device"]),
+            start=member["start"],
+            end=member["end"],
+            note=index["note"],
+        )
+        extract_member(archive, member=member, output=output)
+        print(output)
 
 
 @cli.command()
@@ -179,6 +662,7 @@ def compare_byte_range(
 @click.option("--force", is_flag=True, required=False)
 @click.option("--no-wipe", is_flag=True, required=False)
 @click.option("--no-backup", is_flag=True, required=False)
+@click_add_options(click_durability_options)
 @click_add_options(click_global_options)
 @click.pass_context
 def write_mbr(
@@ -188,6 +672,8 @@ def write_mbr(
     force: bool,
     no_wipe: bool,
     no_backup: bool,
+    durability: str,
+    flush_bytes: int,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -204,7 +690,7 @@ def write_mbr(
     eprint("writing MBR to:", device)
     assert device_is_not_a_partition(device=device)
     assert path_is_block_special(device, symlink_ok=True)
-    assert not block_special_path_is_mounted(device)
+    assert device_is_not_in_use(device=device)
     if not force:
         warn(
             (device,),
@@ -222,6 +708,7 @@ def write_mbr(
         _out=sys.stdout,
         _err=sys.stderr,
     )
+    eprint("flushed:", flush_device(device, policy=durability))
 
 
 @cli.command()
@@ -250,6 +737,7 @@ def write_mbr(
     type=int,
 )
 @click.option("--force", is_flag=True, required=False)
+@click_add_options(click_durability_options)
 @click_add_options(click_global_options)
 @click.pass_context
 def write_efi_partition(
@@ -260,6 +748,8 @@ def write_efi_partition(
     end: str,
     partition_number: int,
     force: bool,
+    durability: str,
+    flush_bytes: int,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -276,7 +766,7 @@ def write_efi_partition(
     ic("creating efi partition on:", device, partition_number, start, end)
     assert device_is_not_a_partition(device=device)
     assert path_is_block_special(device, symlink_ok=True)
-    assert not block_special_path_is_mounted(device)
+    assert device_is_not_in_use(device=device)
     assert partition_number
 
     if not force:
@@ -319,6 +809,7 @@ def write_efi_partition(
         _out=sys.stdout,
         _err=sys.stderr,
     )
+    eprint("flushed:", flush_device(device, policy=durability))
 
     fat16_partition_device = add_partition_number_to_device(
         device=device,
@@ -326,12 +817,13 @@ def write_efi_partition(
     )
     wait_for_block_special_device_to_exist(device=fat16_partition_device)
 
-    ctx.invoke(
-        create_filesystem,
-        device=fat16_partition_device,
-        filesystem="fat16",
-        force=True,
-    )
+    with phase("create_filesystem", device=fat16_partition_device, filesystem="fat16"):
+        ctx.invoke(
+            create_filesystem,
+            device=fat16_partition_device,
+            filesystem="fat16",
+            force=True,
+        )
 
 
 @cli.command()
@@ -360,6 +852,7 @@ def write_efi_partition(
     type=int,
 )
 @click.option("--force", is_flag=True, required=False)
+@click_add_options(click_durability_options)
 @click_add_options(click_global_options)
 @click.pass_context
 def write_grub_bios_partition(
@@ -370,6 +863,8 @@ def write_grub_bios_partition(
     end: str,
     force: bool,
     partition_number: int,
+    durability: str,
+    flush_bytes: int,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -386,7 +881,7 @@ def write_grub_bios_partition(
     ic("creating grub_bios partition on:", device, partition_number, start, end)
     assert device_is_not_a_partition(device=device)
     assert path_is_block_special(device, symlink_ok=True)
-    assert not block_special_path_is_mounted(device)
+    assert device_is_not_in_use(device=device)
     assert partition_number
 
     if not force:
@@ -429,6 +924,7 @@ def write_grub_bios_partition(
         _out=sys.stdout,
         _err=sys.stderr,
     )
+    eprint("flushed:", flush_device(device, policy=durability))
     grub_bios_partition_device = add_partition_number_to_device(
         device=device,
         partition_number=partition_number,
@@ -446,6 +942,7 @@ def write_grub_bios_partition(
     "--ask",
     is_flag=True,
 )
+@click_add_options(click_durability_options)
 @click_add_options(click_global_options)
 @click.pass_context
 def destroy_block_device(
@@ -454,6 +951,8 @@ def destroy_block_device(
     device: Path,
     force: bool,
     ask: bool,
+    durability: str,
+    flush_bytes: int,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -469,10 +968,36 @@ def destroy_block_device(
     device = Path(device)
     assert not device.name.endswith("/")
     assert device_is_not_a_partition(device=device)
+    device_size = get_device_size(device)
+    if device_size == 0:
+        eprint(f"{device} is empty (0 bytes), there is nothing to destroy")
+        sys.exit(1)
+    if path_is_image_file(device):
+        # there is no dm-crypt layer for a file; deallocating every block
+        # sanitizes it without inflating it on the host filesystem
+        ic("destroying image file:", device)
+        assert device_is_not_in_use(device=device)
+        if not force:
+            warn(
+                (device,),
+                symlink_ok=True,
+            )
+        ctx.invoke(
+            destroy_byte_range,
+            device=device,
+            start=0,
+            end=device_size,
+            source="zero",
+            no_backup=True,
+            sparse=True,
+            durability=durability,
+            flush_bytes=flush_bytes,
+        )
+        return
     assert device.as_posix().startswith("/dev/")
     ic("destroying device:", device)
     assert path_is_block_special(device, symlink_ok=True)
-    assert not block_special_path_is_mounted(device)
+    assert device_is_not_in_use(device=device)
     if not force:
         warn(
             (device,),
@@ -493,6 +1018,8 @@ def destroy_block_device(
         device=device,
         source="zero",
         size=16387,
+        durability=durability,
+        flush_bytes=flush_bytes,
         verbose=True,
     )
 
@@ -514,8 +1041,10 @@ def destroy_block_device(
     assert not block_special_path_is_mounted(luks_mapper)
 
     # sys-fs/dd-rescue; --abort_we: abort on any write error; exit 21: device full
-    hs.Command("dd_rescue")(
+    _dd_rescue(
         "--verbose",
+        "-b",
+        str(get_tuned_parameters(device)[0]),
         "--color=1",
         "--abort_we",
         "/dev/zero",
@@ -526,6 +1055,8 @@ def destroy_block_device(
         _err_bufsize=1,
         _ok_code=[21],
     )
+    # dd_rescue leaves the tail of the wipe in the page cache of the mapping
+    eprint("durability:", flush_device(luks_mapper, policy=durability))
 
     time.sleep(1)  # so "cryptsetup close" doesnt throw an error
 
@@ -558,6 +1089,8 @@ def destroy_block_device(
 @click.option("--no-backup", is_flag=True, required=False)
 @click.option("--note", is_flag=False, type=str)
 @click.option("--ask", is_flag=True, required=False)
+@click.option("--sparse", is_flag=True, required=False)
+@click_add_options(click_durability_options)
 @click_add_options(click_global_options)
 @click.pass_context
 def destroy_block_device_head(
@@ -569,6 +1102,9 @@ def destroy_block_device_head(
     ask: bool,
     no_backup: bool,
     note: str,
+    sparse: bool,
+    durability: str,
+    flush_bytes: int,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -585,8 +1121,8 @@ def destroy_block_device_head(
     # click enforces required only when parsing a command line; ctx.invoke
     # substitutes the option default, so an omitting caller arrives with None
     assert source in ("zero", "urandom"), f"source must be zero or urandom, not {source!r}"
-    assert path_is_block_special(device, symlink_ok=True)
-    assert not block_special_path_is_mounted(device)
+    assert device_is_block_special_or_image(device=device)
+    assert device_is_not_in_use(device=device)
     ic(device, size, source)
     ctx.invoke(
         destroy_byte_range,
@@ -596,6 +1132,9 @@ def destroy_block_device_head(
         source=source,
         no_backup=no_backup,
         note=note,
+        sparse=sparse,
+        durability=durability,
+        flush_bytes=flush_bytes,
     )
 
 
@@ -621,6 +1160,8 @@ def destroy_block_device_head(
 @click.option("--ask", is_flag=True, required=False)
 @click.option("--no-backup", is_flag=True, required=False)
 @click.option("--note", is_flag=False, type=str)
+@click.option("--sparse", is_flag=True, required=False)
+@click_add_options(click_durability_options)
 @click_add_options(click_global_options)
 @click.pass_context
 def destroy_block_device_tail(
@@ -632,6 +1173,9 @@ def destroy_block_device_tail(
     no_backup: bool,
     ask: bool,
     note: str,
+    sparse: bool,
+    durability: str,
+    flush_bytes: int,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -649,7 +1193,8 @@ def destroy_block_device_tail(
     # substitutes the option default, so an omitting caller arrives with None
     assert source in ("zero", "urandom"), f"source must be zero or urandom, not {source!r}"
     assert size > 0
-    device_size = get_block_device_size(device=device)
+    assert device_is_block_special_or_image(device=device)
+    device_size = get_device_size(device=device)
     assert size <= device_size
     start = device_size - size
     assert start > 0
@@ -663,6 +1208,9 @@ def destroy_block_device_tail(
         source=source,
         no_backup=no_backup,
         note=note,
+        sparse=sparse,
+        durability=durability,
+        flush_bytes=flush_bytes,
     )
 
 
@@ -704,6 +1252,15 @@ def destroy_block_device_tail(
     is_flag=False,
     type=str,
 )
+@click.option(
+    "--sparse",
+    is_flag=True,
+)
+@click.option(
+    "--pipelined",
+    is_flag=True,
+)
+@click_add_options(click_durability_options)
 @click_add_options(click_global_options)
 @click.pass_context
 def destroy_byte_range(
@@ -716,6 +1273,10 @@ def destroy_byte_range(
     ask: bool,
     no_backup: bool,
     note: str,
+    sparse: bool,
+    pipelined: bool,
+    durability: str,
+    flush_bytes: int,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -733,6 +1294,46 @@ def destroy_byte_range(
     assert end > 0
     assert start < end
     eprint("source:", source)
+    bytes_to_zero = end - start
+    assert bytes_to_zero > 0
+    chunk_size = get_buffer_pool().fit(get_tuned_parameters(device)[0])
+    flusher = Flusher(durability, flush_bytes=flush_bytes)
+    started = time.monotonic()
+    if pipelined and not no_backup:
+        backup_file = backup_file_name(device=device, start=start, end=end, note=note)
+        dfd = os.open(device, os.O_RDWR)
+        try:
+            # a partial backup is kept on failure, it holds the only copy
+            # of every chunk that was already overwritten
+            bfd = os.open(backup_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            try:
+                stats = backup_then_wipe_range(
+                    dfd,
+                    bfd,
+                    start=start,
+                    end=end,
+                    source=source,
+                    chunk_size=chunk_size,
+                    sparse=sparse or path_is_image_file(device),
+                    flusher=flusher,
+                )
+            finally:
+                os.close(bfd)
+            flusher.finish(dfd)
+        finally:
+            os.close(dfd)
+        record_backup(
+            backup_file=Path(backup_file),
+            device=device,
+            start=start,
+            end=end,
+            note=note,
+            sha256=stats.pop("sha256"),
+        )
+        print(backup_file)
+        eprint("pipelined:", stats)
+        eprint("durability:", {**flusher.stats, "total_seconds": round(time.monotonic() - started, 6)})
+        return
     if not no_backup:
         ctx.invoke(
             backup_byte_range,
@@ -741,18 +1342,39 @@ def destroy_byte_range(
             end=end,
             note=note,
         )
-    bytes_to_zero = end - start
-    assert bytes_to_zero > 0
-    with open(device, "wb") as dfh:
-        dfh.seek(start)
-        if source == "zero":
-            dfh.write(bytearray(bytes_to_zero))
-        elif source == "urandom":
-            urandom_bytes = os.urandom(bytes_to_zero)
-            assert len(urandom_bytes) == bytes_to_zero
-            dfh.write(urandom_bytes)
-        else:
-            raise ValueError(f"unknown source: {source}")
+    # image files are always wiped sparse; block devices (thin LVs) opt in,
+    # a punched range on a physical disk is discarded rather than overwritten
+    if source == "zero" and (sparse or path_is_image_file(device)):
+        dfd = os.open(device, os.O_RDWR)
+        try:
+            stats = zero_range_sparse(
+                dfd,
+                start=start,
+                end=end,
+                chunk_size=chunk_size,
+                flusher=flusher,
+            )
+            flusher.finish(dfd)
+        finally:
+            os.close(dfd)
+        eprint("sparse zero:", stats)
+    else:
+        dfd = os.open(device, os.O_WRONLY)
+        try:
+            with get_buffer_pool().borrow(min(chunk_size, bytes_to_zero)) as buf:
+                if source == "zero":
+                    fill_from_source(buf, source)
+                with phase("write range", device=device, start=start, end=end, source=source):
+                    for offset, length in iter_chunks(start=start, end=end, chunk_size=chunk_size):
+                        if source != "zero":
+                            fill_from_source(buf[:length], source)
+                        pwrite_all(dfd, buf[:length], offset)
+                        flusher.wrote(dfd, length)
+            with phase("flush", device=device, policy=durability):
+                flusher.finish(dfd)
+        finally:
+            os.close(dfd)
+    eprint("durability:", {**flusher.stats, "total_seconds": round(time.monotonic() - started, 6)})
 
 
 @cli.command()
@@ -778,6 +1400,8 @@ def destroy_byte_range(
 @click.option("--ask", is_flag=True, required=False)
 @click.option("--force", is_flag=True, required=False)
 @click.option("--no-backup", is_flag=True, required=False)
+@click.option("--sparse", is_flag=True, required=False)
+@click_add_options(click_durability_options)
 @click_add_options(click_global_options)
 @click.pass_context
 def destroy_block_device_head_and_tail(
@@ -790,6 +1414,9 @@ def destroy_block_device_head_and_tail(
     ask: bool,
     force: bool,
     no_backup: bool,
+    sparse: bool,
+    durability: str,
+    flush_bytes: int,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -808,8 +1435,8 @@ def destroy_block_device_head_and_tail(
     assert source in ("zero", "urandom"), f"source must be zero or urandom, not {source!r}"
     assert device_is_not_a_partition(device=device)
     eprint("destroying device:", device)
-    assert path_is_block_special(device, symlink_ok=True)
-    assert not block_special_path_is_mounted(device)
+    assert device_is_block_special_or_image(device=device)
+    assert device_is_not_in_use(device=device)
     if not force:
         warn(
             (device,),
@@ -827,6 +1454,9 @@ def destroy_block_device_head_and_tail(
         note=note,
         ask=ask,
         no_backup=no_backup,
+        sparse=sparse,
+        durability=durability,
+        flush_bytes=flush_bytes,
     )
     ctx.invoke(
         destroy_block_device_tail,
@@ -836,6 +1466,9 @@ def destroy_block_device_head_and_tail(
         note=note,
         ask=ask,
         no_backup=no_backup,
+        sparse=sparse,
+        durability=durability,
+        flush_bytes=flush_bytes,
     )
 
 
@@ -852,10 +1485,19 @@ def destroy_block_device_head_and_tail(
     type=int,
     default=1024 * 1024 * 128,
 )
+@click.option(
+    "--source",
+    is_flag=False,
+    required=True,
+    type=click.Choice(["urandom", "zero"]),
+)
 @click.option("--note", is_flag=False, type=str)
 @click.option("--force", is_flag=True, required=False)
 @click.option("--ask", is_flag=True, required=False)
 @click.option("--no-backup", is_flag=True, required=False)
+@click.option("--archive", is_flag=False, type=click.Path(path_type=Path))
+@click.option("--sparse", is_flag=True, required=False)
+@click_add_options(click_durability_options)
 @click_add_options(click_global_options)
 @click.pass_context
 def destroy_block_devices_head_and_tail(
@@ -863,10 +1505,15 @@ def destroy_block_devices_head_and_tail(
     *,
     devices: tuple[Path, ...],
     size: int,
+    source: str,
     note: str,
     ask: bool,
     force: bool,
     no_backup: bool,
+    archive: None | Path,
+    sparse: bool,
+    durability: str,
+    flush_bytes: int,
     verbose_inf: bool,
     dict_output: bool,
     verbose: bool = False,
@@ -880,12 +1527,13 @@ def destroy_block_devices_head_and_tail(
     )
 
     assert isinstance(devices, tuple)
+    get_device_usage_index(refresh=True)
     for device in devices:
         device = Path(device)
         assert device_is_not_a_partition(device=device)
         eprint("destroying device:", device)
-        assert path_is_block_special(device, symlink_ok=True)
-        assert not block_special_path_is_mounted(device)
+        assert device_is_block_special_or_image(device=device)
+        assert device_is_not_in_use(device=device)
 
     if not force:
         warn(
@@ -893,16 +1541,563 @@ def destroy_block_devices_head_and_tail(
             symlink_ok=True,
         )
 
+    # one concurrent pass over every head and tail instead of two loose
+    # backup files per device, taken before any device is touched
+    if archive and not no_backup:
+        ctx.invoke(
+            backup_devices,
+            devices=devices,
+            archive=archive,
+            head_size=size,
+            tail_size=size,
+            note=note,
+        )
+        no_backup = True
+
     for device in devices:
         ctx.invoke(
             destroy_block_device_head_and_tail,
             device=device,
             size=size,
+            source=source,
             note=note,
             ask=ask,
             force=force,
             no_backup=no_backup,
+            sparse=sparse,
+            durability=durability,
+            flush_bytes=flush_bytes,
+        )
+
+
+@cli.command()
+@click.argument(
+    "device",
+    required=True,
+    nargs=1,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option(
+    "--source",
+    is_flag=False,
+    type=click.Choice(["urandom", "zero"]),
+    default="zero",
+)
+@click.option("--all-candidates", is_flag=True, required=False)
+@click.option("--note", is_flag=False, type=str)
+@click.option("--force", is_flag=True, required=False)
+@click.option("--no-backup", is_flag=True, required=False)
+@click.option("--sparse", is_flag=True, required=False)
+@click_add_options(click_durability_options)
+@click_add_options(click_global_options)
+@click.pass_context
+def destroy_signatures(
+    ctx: click.Context,
+    *,
+    device: Path,
+    source: str,
+    all_candidates: bool,
+    note: str,
+    force: bool,
+    no_backup: bool,
+    sparse: bool,
+    durability: str,
+    flush_bytes: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    device = Path(device)
+    assert source in ("zero", "urandom"), f"source must be zero or urandom, not {source!r}"
+    assert device_is_block_special_or_image(device=device)
+    assert device_is_not_in_use(device=device)
+    device_size = get_device_size(device)
+    signatures = find_signatures(device, device_size=device_size)
+    for signature in signatures:
+        eprint("found:", signature.name, signature.start, signature.end)
+    if all_candidates:
+        signatures += candidate_signatures(device_size=device_size)
+    extents = signature_extents(signatures)
+    if not extents:
+        eprint("no signatures found on:", device)
+        return
+    if not force:
+        warn(
+            (device,),
+            symlink_ok=True,
+        )
+    if not note:
+        note = f"signatures_{device.as_posix().replace('/', '_')}"
+
+    # back up every extent before the first write so a failed wipe
+    # never leaves a partly destroyed device without its backups
+    if not no_backup:
+        for start, end in extents:
+            ctx.invoke(
+                backup_byte_range,
+                device=device,
+                start=start,
+                end=end,
+                note=note,
+            )
+    for start, end in extents:
+        ctx.invoke(
+            destroy_byte_range,
+            device=device,
+            start=start,
+            end=end,
+            source=source,
+            no_backup=True,
+            note=note,
+            sparse=sparse,
+            durability=durability,
+            flush_bytes=flush_bytes,
+        )
+
+
+@cli.command()
+@click.argument(
+    "devices",
+    required=True,
+    nargs=-1,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--max-workers", is_flag=False, type=int, default=16)
+@click_add_options(click_global_options)
+@click.pass_context
+def scan_signatures(
+    ctx: click.Context,
+    *,
+    devices: tuple[Path, ...],
+    max_workers: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    found = _scan_signatures(devices, max_workers=max_workers)
+    result = {
+        device.as_posix(): [
+            {
+                "name": signature.name,
+                "start": signature.start,
+                "end": signature.end,
+                "magic_offset": signature.magic_offset,
+            }
+            for signature in signatures
+        ]
+        for device, signatures in found.items()
+    }
+    print(json.dumps(result, indent=2))
+
+
+@cli.command()
+@click.argument(
+    "device",
+    required=True,
+    nargs=1,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--block-size", is_flag=False, type=int, default=SCAN_BLOCK_SIZE)
+@click.option("--stride", is_flag=False, type=int, default=1)
+@click.option("--max-workers", is_flag=False, type=int, default=8)
+@click.option("--expect", is_flag=False, type=click.Choice(BLOCK_CLASSES))
+@click_add_options(click_global_options)
+@click.pass_context
+def scan_map(
+    ctx: click.Context,
+    *,
+    device: Path,
+    block_size: int,
+    stride: int,
+    max_workers: int,
+    expect: None | str,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    device = Path(device)
+    assert device_is_not_a_partition(device=device)
+    assert device_is_block_special_or_image(device=device)
+    chunk_size = max(block_size, get_tuned_parameters(device)[0] // block_size * block_size)
+    result = _scan_map(
+        device,
+        block_size=block_size,
+        stride=stride,
+        chunk_size=chunk_size,
+        max_workers=max_workers,
+    )
+    print(json.dumps(result, indent=2))
+    # --expect high-entropy confirms a urandom wipe, --expect zero a zero wipe
+    if expect:
+        unexpected = [_ for _ in BLOCK_CLASSES if _ != expect and map_extents(result, _)]
+        if unexpected:
+            eprint("unexpected blocks:", unexpected)
+            sys.exit(1)
+
+
+@cli.command()
+@click.argument(
+    "device",
+    required=True,
+    nargs=1,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--chunk-size", is_flag=False, type=int)
+@click.option("--queue-depth", is_flag=False, type=int)
+@click.option("--regions", is_flag=False, type=int, default=DEFAULT_REGIONS)
+@click.option("--slow-ms", is_flag=False, type=float, default=DEFAULT_SLOW_MS)
+@click.option("--stripe-every", is_flag=False, type=int, default=1)
+@click_add_options(click_global_options)
+@click.pass_context
+def read_scan(
+    ctx: click.Context,
+    *,
+    device: Path,
+    chunk_size: None | int,
+    queue_depth: None | int,
+    regions: int,
+    slow_ms: float,
+    stripe_every: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    device = Path(device)
+    assert device_is_not_a_partition(device=device)
+    assert device_is_block_special_or_image(device=device)
+    tuned_chunk_size, tuned_queue_depth = get_tuned_parameters(device)
+    result = _read_scan(
+        device,
+        chunk_size=chunk_size or tuned_chunk_size,
+        queue_depth=queue_depth or tuned_queue_depth,
+        regions=regions,
+        slow_ms=slow_ms,
+        stripe_every=stripe_every,
+    )
+    print(json.dumps(result, indent=2))
+    eprint(
+        "read:",
+        result["bytes_read"],
+        "bytes at",
+        result["mb_s"],
+        "MB/s, slow:",
+        len(result["slow"]),
+        "errors:",
+        len(result["errors"]),
+    )
+    if result["errors"]:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument(
+    "source",
+    required=True,
+    nargs=1,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.argument(
+    "target",
+    required=True,
+    nargs=1,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--checkpoint", is_flag=False, type=click.Path(path_type=Path))
+@click.option("--chunk-size", is_flag=False, type=int)
+@click.option("--queue-depth", is_flag=False, type=int)
+@click.option("--verify", is_flag=True, required=False)
+@click.option("--force", is_flag=True, required=False)
+@click_add_options(click_durability_options)
+@click_add_options(click_global_options)
+@click.pass_context
+def clone_device(
+    ctx: click.Context,
+    *,
+    source: Path,
+    target: Path,
+    checkpoint: None | Path,
+    chunk_size: None | int,
+    queue_depth: None | int,
+    verify: bool,
+    force: bool,
+    durability: str,
+    flush_bytes: int,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    source = Path(source)
+    target = Path(target)
+    safety_check_clone(
+        source=source,
+        target=target,
+        force=force,
+        resuming=bool(checkpoint and checkpoint.exists()),
+    )
+    tuned_chunk_size, tuned_queue_depth = get_tuned_parameters(source)
+    chunk_size = chunk_size or tuned_chunk_size
+    flusher = Flusher(durability, flush_bytes=flush_bytes)
+    started = time.monotonic()
+    result = _clone_device(
+        source,
+        target,
+        chunk_size=chunk_size,
+        queue_depth=queue_depth or tuned_queue_depth,
+        checkpoint=checkpoint,
+        flusher=flusher,
+    )
+    elapsed = time.monotonic() - started
+    result["seconds"] = round(elapsed, 6)
+    result["durability"] = flusher.stats
+    if verify:
+        result.update(
+            verify_clone(
+                source,
+                target,
+                length=get_device_size(source),
+                chunk_size=chunk_size,
+            )
+        )
+    print(json.dumps(result, indent=2))
+    if verify and not result["verified"]:
+        sys.exit(1)
+
+
+@cli.command()
+@click.option(
+    "--rules",
+    "rules_file",
+    is_flag=False,
+    required=True,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--max-workers", is_flag=False, type=int, default=4)
+@click.option("--poll", is_flag=True, required=False)
+@click.option("--poll-interval", is_flag=False, type=float, default=POLL_INTERVAL)
+@click.option(
+    "--inject",
+    "injected",
+    is_flag=False,
+    multiple=True,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--force", is_flag=True, required=False)
+@click_add_options(click_global_options)
+@click.pass_context
+def watch(
+    ctx: click.Context,
+    *,
+    rules_file: Path,
+    max_workers: int,
+    poll: bool,
+    poll_interval: float,
+    injected: tuple[Path, ...],
+    force: bool,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    watcher = Watcher(
+        rules=load_rules(rules_file),
+        max_workers=max_workers,
+        force=force,
+    )
+    try:
+        # injected devices (image files in tests) are handled as add events
+        # and the command exits once their pipelines finish
+        if injected:
+            watcher.run(
+                DeviceEvent(action="add", device=Path(device), synthetic=True)
+                for device in injected
+            )
+            return
+        watcher.run(open_event_source(poll=poll, interval=poll_interval))
+    finally:
+        watcher.close()
+
+
+@cli.command()
+@click.option("--socket", "socket_path", is_flag=False, type=click.Path(path_type=Path))
+@click.option("--max-jobs", is_flag=False, type=int, default=4)
+@click.option("--queue-depth", is_flag=False, type=int)
+@click.option("--backup-dir", is_flag=False, type=click.Path(path_type=Path), default=".")
+@click.option("--catalog-dir", is_flag=False, type=click.Path(path_type=Path))
+@click_add_options(click_global_options)
+@click.pass_context
+def serve(
+    ctx: click.Context,
+    *,
+    socket_path: None | Path,
+    max_jobs: int,
+    queue_depth: None | int,
+    backup_dir: Path,
+    catalog_dir: None | Path,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    daemon = DeviceToolDaemon(
+        socket_path=socket_path or default_socket_path(),
+        max_jobs=max_jobs,
+        queue_depth=queue_depth,
+        backup_dir=backup_dir,
+        catalog_dir=catalog_dir,
+    )
+    try:
+        asyncio.run(daemon.serve_forever())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+@cli.command()
+@click.argument("job", required=True, nargs=1, type=str)
+@click.option("--socket", "socket_path", is_flag=False, type=click.Path(path_type=Path))
+@click_add_options(click_global_options)
+@click.pass_context
+def submit(
+    ctx: click.Context,
+    *,
+    job: str,
+    socket_path: None | Path,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    failed = False
+    for event in submit_job(json.loads(job), socket_path=socket_path):
+        print(json.dumps(event), flush=True)
+        failed = failed or event["event"] == "error"
+    if failed:
+        sys.exit(1)
+
+
+@cli.command()
+@click.argument(
+    "device",
+    required=True,
+    nargs=1,
+    type=click.Path(exists=True, path_type=Path),
+)
+@click.option("--block-size", "block_sizes", is_flag=False, type=int, multiple=True)
+@click.option("--queue-depth", "queue_depths", is_flag=False, type=int, multiple=True)
+@click.option("--probe-bytes", is_flag=False, type=int, default=PROBE_BYTES)
+@click.option("--write", is_flag=True, required=False)
+@click.option("--force", is_flag=True, required=False)
+@click.option("--no-save", is_flag=True, required=False)
+@click_add_options(click_global_options)
+@click.pass_context
+def probe_throughput(
+    ctx: click.Context,
+    *,
+    device: Path,
+    block_sizes: tuple[int, ...],
+    queue_depths: tuple[int, ...],
+    probe_bytes: int,
+    write: bool,
+    force: bool,
+    no_save: bool,
+    verbose_inf: bool,
+    dict_output: bool,
+    verbose: bool = False,
+) -> None:
+    tty, verbose = tvicgvd(
+        ctx=ctx,
+        verbose=verbose,
+        verbose_inf=verbose_inf,
+        ic=ic,
+        gvd=gvd,
+    )
+
+    device = Path(device)
+    if write:
+        # the write probe rewrites data in place, nothing else may use the device
+        assert device_is_not_in_use(device=device)
+        if not force:
+            warn(
+                (device,),
+                symlink_ok=True,
+            )
+    result = _probe_throughput(
+        device,
+        block_sizes=block_sizes or PROBE_BLOCK_SIZES,
+        queue_depths=queue_depths or PROBE_QUEUE_DEPTHS,
+        probe_bytes=probe_bytes,
+        rewrite=write,
+    )
+    best = result["best"]
+    if not no_save:
+        store_tuned_parameters(
+            device,
+            chunk_size=best["block_size"],
+            queue_depth=best["queue_depth"],
+            read_mb_s=best["read_mb_s"],
+            rewrite_mb_s=best.get("rewrite_mb_s"),
         )
+    print(json.dumps(result, indent=2))
 
 
 @cli.command("partuuid")
@@ -952,3 +2147,6 @@ def _get_root_device(
     )
 
     print(get_root_device())
+
+
+trace_commands(cli)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .bufferpool import get_buffer_pool
+from .devicetool import get_block_device_identity
+from .rangeio import DEFAULT_CHUNK_SIZE
+from .rangeio import DEFAULT_QUEUE_DEPTH
+from .rangeio import Flusher
+from .rangeio import is_all_zero
+from .rangeio import iter_chunks
+from .rangeio import pread_into
+from .rangeio import pwrite_all
+from .rangeio import zero_range_sparse
+from .trace import traced
+
+CHECKPOINT_INTERVAL = 5.0
+
+
+def _load_checkpoint(checkpoint: Path, *, expected: dict) -> int:
+    try:
+        saved = json.loads(Path(checkpoint).read_text())
+    except FileNotFoundError:
+        return 0
+    for key, value in expected.items():
+        if saved.get(key) != value:
+            raise ValueError(
+                f"{checkpoint} is for a different clone: {key} {saved.get(key)!r} != {value!r}"
+            )
+    return saved["done"]
+
+
+def _save_checkpoint(checkpoint: Path, *, expected: dict, done: int) -> None:
+    tmp_path = Path(checkpoint).with_suffix(".tmp")
+    tmp_path.write_text(json.dumps({**expected, "done": done}, indent=2, sort_keys=True))
+    tmp_path.replace(checkpoint)
+
+
+def _sha256_range(device: Path, *, end: int, chunk_size: int) -> str:
+    digest = hashlib.sha256()
+    chunk_size = get_buffer_pool().fit(chunk_size)
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, end, os.POSIX_FADV_SEQUENTIAL)
+        with get_buffer_pool().borrow(min(chunk_size, end)) as buf:
+            for offset, length in iter_chunks(start=0, end=end, chunk_size=chunk_size):
+                pread_into(fd, buf[:length], offset)
+                digest.update(buf[:length])
+    finally:
+        os.close(fd)
+    return digest.hexdigest()
+
+
+@traced()
+def verify_clone(
+    source: Path,
+    target: Path,
+    *,
+    length: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> dict:
+    # both devices are hashed at the same time, sha256 releases the GIL
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="devicetool-verify") as executor:
+        source_future = executor.submit(_sha256_range, source, end=length, chunk_size=chunk_size)
+        target_future = executor.submit(_sha256_range, target, end=length, chunk_size=chunk_size)
+        source_sha256 = source_future.result()
+        target_sha256 = target_future.result()
+    return {
+        "verified": source_sha256 == target_sha256,
+        "source_sha256": source_sha256,
+        "target_sha256": target_sha256,
+    }
+
+
+@traced()
+def clone_device(
+    source: Path,
+    target: Path,
+    *,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    queue_depth: int = DEFAULT_QUEUE_DEPTH,
+    checkpoint: None | Path = None,
+    flusher: None | Flusher = None,
+) -> dict:
+    # chunks are copied out of order by queue_depth workers; the checkpoint
+    # records the end of the leading run of finished chunks, and only
+    # after the target has been flushed up to it
+    source = Path(source)
+    target = Path(target)
+    if flusher is None:
+        flusher = Flusher()
+    chunk_size = get_buffer_pool().fit(chunk_size)
+    identity = get_block_device_identity(source)
+    length = identity["size"]
+    expected = {
+        "source": source.resolve().as_posix(),
+        "source_serial": identity["serial"],
+        "source_size": length,
+        "target": target.resolve().as_posix(),
+        "chunk_size": chunk_size,
+    }
+    resume_from = _load_checkpoint(checkpoint, expected=expected) if checkpoint else 0
+    # a finished clone removes its checkpoint, one left at the end is stale
+    # and the source may have changed since, so it starts over
+    if resume_from >= length:
+        resume_from = 0
+    assert resume_from % chunk_size == 0
+    stats = {"copied": 0, "zero": 0, "resumed_from": resume_from}
+
+    pending = iter(iter_chunks(start=resume_from, end=length, chunk_size=chunk_size))
+    lock = threading.Lock()
+    failed = threading.Event()
+    finished: set[int] = set()
+    done = resume_from
+    last_saved = time.monotonic()
+
+    sfd = os.open(source, os.O_RDONLY)
+    try:
+        tfd = os.open(target, os.O_RDWR)
+        try:
+
+            def _advance(offset: int) -> None:
+                nonlocal done, last_saved
+                finished.add(offset)
+                while done in finished:
+                    finished.remove(done)
+                    done = min(done + chunk_size, length)
+                if checkpoint and time.monotonic() - last_saved >= CHECKPOINT_INTERVAL:
+                    os.fdatasync(tfd)
+                    _save_checkpoint(checkpoint, expected=expected, done=done)
+                    last_saved = time.monotonic()
+
+            def _worker() -> None:
+                with get_buffer_pool().borrow(chunk_size) as buf:
+                    while not failed.is_set():
+                        with lock:
+                            chunk = next(pending, None)
+                        if chunk is None:
+                            return
+                        offset, count = chunk
+                        view = buf[:count]
+                        try:
+                            pread_into(sfd, view, offset)
+                            if is_all_zero(view):
+                                # discarded, or left alone when the target already reads as zero
+                                zero_range_sparse(
+                                    tfd,
+                                    start=offset,
+                                    end=offset + count,
+                                    chunk_size=chunk_size,
+                                    flusher=flusher,
+                                    buf=buf,
+                                )
+                                key = "zero"
+                            else:
+                                pwrite_all(tfd, view, offset)
+                                flusher.wrote(tfd, count)
+                                key = "copied"
+                        except BaseException:
+                            failed.set()
+                            raise
+                        with lock:
+                            stats[key] += count
+                            _advance(offset)
+
+            try:
+                with ThreadPoolExecutor(
+                    max_workers=queue_depth,
+                    thread_name_prefix="devicetool-clone",
+                ) as executor:
+                    futures = [executor.submit(_worker) for _ in range(queue_depth)]
+                    try:
+                        for future in futures:
+                            future.result()
+                    except BaseException:
+                        failed.set()
+                        raise
+                flusher.finish(tfd)
+            except BaseException:
+                # a failed or interrupted clone resumes after the last flushed run
+                if checkpoint:
+                    os.fdatasync(tfd)
+                    _save_checkpoint(checkpoint, expected=expected, done=done)
+                raise
+        finally:
+            os.close(tfd)
+    finally:
+        os.close(sfd)
+    if checkpoint:
+        Path(checkpoint).unlink(missing_ok=True)
+    return stats
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+import queue
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterable
+from pathlib import Path
+
+from .bufferpool import get_buffer_pool
+from .devicetool import get_device_size
+from .rangeio import DEFAULT_CHUNK_SIZE
+from .rangeio import buffers_equal
+from .rangeio import iter_chunks
+from .rangeio import merge_extents
+from .rangeio import pread_into
+from .trace import traced
+
+COMPARE_BLOCK_SIZE = 4096
+# buffers per device: one being compared, one being filled, one spare
+READ_AHEAD = 3
+
+
+def _iter_range_chunks(
+    ranges: Iterable[tuple[int, int]],
+    *,
+    chunk_size: int,
+) -> Iterable[tuple[int, int]]:
+    for start, end in ranges:
+        yield from iter_chunks(start=start, end=end, chunk_size=chunk_size)
+
+
+def _reader(
+    fd: int,
+    chunks: Iterable[tuple[int, int]],
+    *,
+    filled: queue.Queue,
+    free: queue.Queue,
+) -> None:
+    try:
+        for offset, length in chunks:
+            buf = free.get()
+            if buf is None:
+                return
+            pread_into(fd, buf[:length], offset)
+            filled.put((buf, length))
+    except BaseException as exc:
+        filled.put(exc)
+
+
+def _divergent_members(blocks: list[bytes]) -> list[int]:
+    # the largest group of identical copies is taken as correct; without
+    # a strict majority every member is reported
+    groups: dict[bytes, list[int]] = defaultdict(list)
+    for index, block in enumerate(blocks):
+        groups[block].append(index)
+    if len(groups) == 1:
+        return []
+    sizes = sorted((len(_) for _ in groups.values()), reverse=True)
+    if sizes[0] == sizes[1]:
+        return list(range(len(blocks)))
+    majority = max(groups.values(), key=len)
+    return [_ for _ in range(len(blocks)) if _ not in majority]
+
+
+@traced()
+def compare_devices(
+    devices: list[Path],
+    *,
+    ranges: list[tuple[int, int]],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    block_size: int = COMPARE_BLOCK_SIZE,
+) -> dict:
+    # one reader thread per device keeps every member busy, the chunks are
+    # compared in lock-step as soon as all members have delivered them
+    devices = [Path(_) for _ in devices]
+    assert len(devices) >= 2, "compare-devices needs at least two devices"
+    assert ranges
+    sizes = {device: get_device_size(device) for device in devices}
+    assert len(set(sizes.values())) == 1, f"devices differ in size: {sizes}"
+    device_size = sizes[devices[0]]
+    ranges = merge_extents(list(ranges))
+    for start, end in ranges:
+        assert 0 <= start < end <= device_size, (start, end, device_size)
+    pool = get_buffer_pool()
+    # a tight buffer budget costs read-ahead, then chunk size, rather than
+    # failing the compare; one block per device (in whole pages, as the
+    # pool hands them out) is as far as it shrinks
+    minimum = -(-block_size // mmap.PAGESIZE) * mmap.PAGESIZE * len(devices)
+    if minimum > pool.budget:
+        raise ValueError(
+            f"comparing {len(devices)} devices needs a buffer budget of at least "
+            f"{minimum} bytes, it is {pool.budget}"
+        )
+    chunk_size = pool.fit(chunk_size, len(devices), align=block_size)
+    assert chunk_size % block_size == 0
+
+    fds = [os.open(device, os.O_RDONLY) for device in devices]
+    filled_queues: list[queue.Queue] = [queue.Queue() for _ in devices]
+    free_queues: list[queue.Queue] = [queue.Queue() for _ in devices]
+    threads = [
+        threading.Thread(
+            target=_reader,
+            args=(fd, _iter_range_chunks(ranges, chunk_size=chunk_size)),
+            kwargs={"filled": filled, "free": free},
+            name=f"devicetool-compare-{device.name}",
+            daemon=True,
+        )
+        for device, fd, filled, free in zip(devices, fds, filled_queues, free_queues)
+    ]
+    divergent: dict[int, list[tuple[int, int]]] = defaultdict(list)
+    compared = 0
+    started = time.monotonic()
+    read_ahead = max(1, min(READ_AHEAD, pool.budget // (chunk_size * len(devices))))
+    try:
+        with pool.borrow_many(chunk_size, len(devices) * read_ahead) as bufs:
+            for index, free in enumerate(free_queues):
+                for buf in bufs[index * read_ahead : (index + 1) * read_ahead]:
+                    free.put(buf)
+            for thread in threads:
+                thread.start()
+            try:
+                for offset, length in _iter_range_chunks(ranges, chunk_size=chunk_size):
+                    views = []
+                    for filled in filled_queues:
+                        item = filled.get()
+                        if isinstance(item, BaseException):
+                            raise item
+                        views.append(item[0])
+                    members = [_[:length] for _ in views]
+                    if not all(buffers_equal(members[0], _) for _ in members[1:]):
+                        for block_offset in range(0, length, block_size):
+                            blocks = [
+                                bytes(_[block_offset : block_offset + block_size])
+                                for _ in members
+                            ]
+                            block_start = offset + block_offset
+                            block_end = min(block_start + block_size, offset + length)
+                            for index in _divergent_members(blocks):
+                                divergent[index].append((block_start, block_end))
+                    for free, buf in zip(free_queues, views):
+                        free.put(buf)
+                    compared += length
+            finally:
+                # the readers are done with the buffers before they go back
+                for free in free_queues:
+                    free.put(None)
+                for thread in threads:
+                    if thread.ident is not None:
+                        thread.join()
+    finally:
+        for fd in fds:
+            os.close(fd)
+    elapsed = time.monotonic() - started
+    return {
+        "devices": [_.as_posix() for _ in devices],
+        "ranges": ranges,
+        "bytes_compared": compared,
+        "seconds": round(elapsed, 6),
+        "combined_mb_s": round(compared * len(devices) / elapsed / (1024 * 1024), 1),
+        "identical": not divergent,
+        "divergent": {
+            devices[index].as_posix(): merge_extents(extents)
+            for index, extents in sorted(divergent.items())
+        },
+    }
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+import asyncio
+import itertools
+import json
+import os
+import signal
+import socket
+import stat
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import hs
+from eprint import eprint
+
+from . import aio
+from .bufferpool import get_buffer_pool
+from .devicetool import device_is_block_special_or_image
+from .devicetool import device_is_not_a_partition
+from .devicetool import get_block_device_identity
+from .rangeio import DEFAULT_FLUSH_BYTES
+from .rangeio import Flusher
+from .rangeio import flush_device
+from .trace import TracedCommand
+from .usage import get_device_usage_index
+
+DESTRUCTIVE_OPS = (
+    "destroy-range",
+    "destroy-head",
+    "destroy-tail",
+    "destroy-full",
+    "partition",
+)
+PROGRESS_INTERVAL = 0.5
+
+
+def default_socket_path() -> Path:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/run"
+    return Path(runtime_dir) / "devicetool.sock"
+
+
+class _Progress:
+    # aio calls this once per chunk; only forward an event every
+    # PROGRESS_INTERVAL seconds so full-device jobs stay cheap to watch
+    def __init__(self, emit: Callable[[dict], None], total: int) -> None:
+        self.emit = emit
+        self.total = total
+        self.done = 0
+        self.last = 0.0
+
+    def __call__(self, count: int) -> None:
+        self.done += count
+        now = time.monotonic()
+        if self.done >= self.total or now - self.last >= PROGRESS_INTERVAL:
+            self.last = now
+            self.emit({"event": "progress", "done": self.done, "total": self.total})
+
+
+class DeviceToolDaemon:
+    def __init__(
+        self,
+        *,
+        socket_path: Path,
+        max_jobs: int = 4,
+        max_workers: int = aio.DEFAULT_MAX_WORKERS,
+        queue_depth: None | int = None,
+        chunk_size: None | int = None,
+        backup_dir: Path = Path("."),
+        catalog_dir: None | Path = None,
+    ) -> None:
+        assert max_jobs > 0
+        self.socket_path = Path(socket_path)
+        self.max_jobs = max_jobs
+        self.queue_depth = queue_depth
+        self.chunk_size = chunk_size
+        self.backup_dir = Path(backup_dir)
+        self.catalog_dir = catalog_dir
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="devicetool-daemon",
+        )
+        self.job_ids = itertools.count(1)
+        self.device_locks: dict[Path, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self.device_cache: dict[Path, tuple[tuple[int, int, int], dict]] = {}
+        self.ops = {
+            "identify": self._identify,
+            "buffer-pool": self._buffer_pool,
+            "backup": self._backup,
+            "compare": self._compare,
+            "destroy-range": self._destroy_range,
+            "destroy-head": self._destroy_range,
+            "destroy-tail": self._destroy_range,
+            "destroy-full": self._destroy_range,
+            "partition": self._partition,
+        }
+
+    def device_metadata(self, device: Path) -> dict:
+        device = Path(device).resolve()
+        st = os.stat(device)
+        key = (st.st_dev, st.st_ino, st.st_rdev)
+        cached = self.device_cache.get(device)
+        if cached and cached[0] == key:
+            return cached[1]
+        identity = get_block_device_identity(device)
+        self.device_cache[device] = (key, identity)
+        return identity
+
+    async def _run(self, function: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(function, *args, **kwargs))
+
+    async def serve_forever(self) -> None:
+        if self.socket_path.exists() and stat.S_ISSOCK(self.socket_path.stat().st_mode):
+            self.socket_path.unlink()
+        self.jobs = asyncio.Semaphore(self.max_jobs)
+        server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel
+        )
+        eprint("devicetool listening on:", self.socket_path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(wait=False)
+            if self.socket_path.exists():
+                self.socket_path.unlink()
+
+    async def _handle(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        job_id = next(self.job_ids)
+
+        def emit(event: dict) -> None:
+            writer.write(json.dumps({"job": job_id, **event}).encode() + b"\n")
+
+        try:
+            job = json.loads(await reader.readline())
+            emit({"event": "queued", "op": job.get("op")})
+            result = await self._run_job(job, emit)
+            emit({"event": "done", "result": result})
+        except Exception as exc:
+            emit({"event": "error", "error": f"{type(exc).__name__}: {exc}"})
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    async def _run_job(self, job: dict, emit: Callable[[dict], None]):
+        op = job.get("op")
+        if op not in self.ops:
+            raise ValueError(f"unknown op: {op!r}, expected one of {sorted(self.ops)}")
+        if op == "identify":
+            return await self._identify(job, emit)
+        if op == "buffer-pool":
+            return await self._buffer_pool(job, emit)
+        device = Path(job["device"]).resolve()
+        if op in DESTRUCTIVE_OPS:
+            if not job.get("force"):
+                raise ValueError(f"{op} requires force, the daemon cannot prompt")
+            assert device_is_not_a_partition(device=device)
+            assert device_is_block_special_or_image(device=device)
+        # the device lock is taken before a job slot, so jobs queued behind
+        # a busy disk do not hold the slots jobs for idle disks need
+        lock = self.device_locks[device]
+        if lock.locked():
+            emit({"event": "waiting", "device": device.as_posix()})
+        async with lock:
+            async with self.jobs:
+                emit({"event": "started", "device": device.as_posix()})
+                if op in DESTRUCTIVE_OPS:
+                    usage = await self._run(get_device_usage_index, refresh=True)
+                    users = usage.users(device)
+                    if users:
+                        raise ValueError(f"{device} is in use: {users}")
+                return await self.ops[op](job, emit)
+
+    def _io_options(self, job: dict) -> dict:
+        return {
+            "queue_depth": job.get("queue_depth", self.queue_depth),
+            "chunk_size": job.get("chunk_size", self.chunk_size),
+            "executor": self.executor,
+        }
+
+    async def _identify(self, job: dict, emit: Callable[[dict], None]) -> dict:
+        return await self._run(self.device_metadata, Path(job["device"]))
+
+    async def _buffer_pool(self, job: dict, emit: Callable[[dict], None]) -> dict:
+        # every job shares the one pool, this is what sizes a host for max_jobs
+        return get_buffer_pool().stats
+
+    async def _backup(self, job: dict, emit: Callable[[dict], None]) -> str:
+        start, end = int(job["start"]), int(job["end"])
+        backup_file = await aio.backup(
+            Path(job["device"]),
+            start=start,
+            end=end,
+            note=job.get("note"),
+            backup_dir=self.backup_dir,
+            catalog_dir=self.catalog_dir,
+            progress=_Progress(emit, end - start),
+            **self._io_options(job),
+        )
+        return backup_file.as_posix()
+
+    async def _compare(self, job: dict, emit: Callable[[dict], None]) -> list:
+        backup_file = Path(job["backup_file"])
+        return await aio.compare(
+            Path(job["device"]),
+            backup_file=backup_file,
+            start=job.get("start"),
+            end=job.get("end"),
+            catalog_dir=self.catalog_dir,
+            progress=_Progress(emit, backup_file.stat().st_size),
+            **self._io_options(job),
+        )
+
+    async def _destroy_range(self, job: dict, emit: Callable[[dict], None]) -> None | str:
+        device = Path(job["device"])
+        op = job["op"]
+        device_size = (await self._run(self.device_metadata, device))["size"]
+        no_backup = bool(job.get("no_backup"))
+        if op == "destroy-range":
+            start, end = int(job["start"]), int(job["end"])
+        elif op == "destroy-head":
+            start, end = 0, int(job["size"])
+        elif op == "destroy-tail":
+            start, end = device_size - int(job["size"]), device_size
+        else:
+            start, end = 0, device_size
+            # a whole-device backup is never what a full wipe wants
+            no_backup = True
+        assert 0 <= start < end <= device_size, (start, end, device_size)
+        total = (end - start) * (1 if no_backup else 2)
+        flusher = Flusher(
+            job.get("durability", "end"),
+            flush_bytes=int(job.get("flush_bytes", DEFAULT_FLUSH_BYTES)),
+        )
+        backup_file = await aio.destroy_range(
+            device,
+            start=start,
+            end=end,
+            source=job.get("source", "zero"),
+            no_backup=no_backup,
+            sparse=bool(job.get("sparse")),
+            note=job.get("note"),
+            backup_dir=self.backup_dir,
+            catalog_dir=self.catalog_dir,
+            flusher=flusher,
+            progress=_Progress(emit, total),
+            **self._io_options(job),
+        )
+        emit({"event": "flushed", **flusher.stats})
+        return backup_file.as_posix() if backup_file else None
+
+    async def _partition(self, job: dict, emit: Callable[[dict], None]) -> None:
+        device = Path(job["device"])
+        table = job.get("table", "gpt")
+        assert table in ("gpt", "msdos"), f"table must be gpt or msdos, not {table!r}"
+        steps = [("mklabel", table)]
+        for number, partition in enumerate(job.get("partitions", ()), start=1):
+            steps.append(("mkpart", "primary", str(partition["start"]), str(partition["end"])))
+            if partition.get("name"):
+                steps.append(("name", str(number), partition["name"]))
+            for flag in partition.get("flags", ()):
+                steps.append(("set", str(number), flag, "on"))
+        parted = TracedCommand(hs.Command("parted"))
+        for step in steps:
+            emit({"event": "progress", "step": list(step)})
+            await self._run(
+                parted, "--align", "minimal", device.as_posix(), "--script", "--", *step
+            )
+        stats = await self._run(flush_device, device, policy=job.get("durability", "end"))
+        emit({"event": "flushed", **stats})
+        self.device_cache.pop(device.resolve(), None)
+
+
+def submit_job(
+    job: dict,
+    *,
+    socket_path: None | Path = None,
+) -> Iterator[dict]:
+    if socket_path is None:
+        socket_path = default_socket_path()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(Path(socket_path).as_posix())
+        sock.sendall(json.dumps(job).encode() + b"\n")
+        with sock.makefile("r") as fh:
+            for line in fh:
+                yield json.loads(line)
@@ -7,22 +7,60 @@ from pathlib import Path
 import hs
 from asserttool import ic
 from eprint import eprint
-from mounttool import block_special_path_is_mounted
 from pathtool import path_is_block_special
+from timestamptool import get_timestamp
 from warntool import warn
 
+from .signatures import PARTITION_TABLE_SIGNATURES
+from .signatures import scan_signatures
+from .trace import TracedCommand
+from .trace import traced
+from .usage import get_device_usage_index
+
+warn = traced("warn")(warn)
+
 
 def write_output(buf) -> None:
     sys.stderr.write(buf)
 
 
 def block_devices() -> set[Path]:
-    _devices = str(hs.Command("lsblk")("-d", "-n", "-p", "-o", "NAME")).strip().split("\n")
+    _devices = str(TracedCommand(hs.Command("lsblk"))("-d", "-n", "-p", "-o", "NAME")).strip().split("\n")
     return {Path(_).resolve() for _ in _devices}
 
 
+def backup_file_name(
+    *,
+    device: Path,
+    start: int,
+    end: int,
+    note: None | str,
+) -> str:
+    time_stamp = str(get_timestamp())
+    running_on_hostname = os.uname()[1]
+    device_string = Path(device).as_posix().replace("/", "_")
+    backup_file_tail = (
+        f"_.{device_string}.{time_stamp}.{running_on_hostname}"
+        f"_start_{start}_end_{end}.bak"
+    )
+    if note:
+        return f"_backup_{note}{backup_file_tail}"
+    return f"_backup__.{backup_file_tail}"
+
+
+def parse_backup_file_range(backup_file: str) -> tuple[int, int]:
+    backup_file = Path(backup_file).name
+    start = int(backup_file.split("start_")[1].split("_")[0])
+    end = int(backup_file.split("end_")[1].split("_")[0].split(".")[0])
+    return start, end
+
+
 def get_block_device_size(device: Path) -> int:
     assert Path(device).is_block_device()
+    return get_device_size(device)
+
+
+def get_device_size(device: Path) -> int:
     fd = os.open(device, os.O_RDONLY)
     try:
         return os.lseek(fd, 0, os.SEEK_END)
@@ -30,6 +68,86 @@ def get_block_device_size(device: Path) -> int:
         os.close(fd)
 
 
+def path_is_image_file(device: Path) -> bool:
+    return Path(device).is_file()
+
+
+def device_is_block_special_or_image(*, device: Path) -> bool:
+    assert path_is_block_special(device, symlink_ok=True) or path_is_image_file(
+        device
+    ), f"{device} is neither a block device nor a regular image file"
+    return True
+
+
+def _read_sysfs_attribute(path: Path) -> None | str:
+    try:
+        value = path.read_bytes()
+    except OSError:
+        return None
+    if path.name.startswith("vpd_pg"):
+        # VPD pages carry a 4 byte header before the identifier
+        value = value[4:]
+    value = value.strip(b"\x00 \n").decode("ascii", errors="replace")
+    return value or None
+
+
+def get_block_device_identity(device: Path) -> dict[str, None | str | int]:
+    device = Path(device)
+    size = get_device_size(device)
+    sysfs = Path("/sys/class/block") / device.resolve().name
+    serial = (
+        _read_sysfs_attribute(sysfs / "device" / "serial")
+        or _read_sysfs_attribute(sysfs / "device" / "vpd_pg80")
+        or _read_sysfs_attribute(sysfs / "serial")
+    )
+    wwn = _read_sysfs_attribute(sysfs / "wwid") or _read_sysfs_attribute(
+        sysfs / "device" / "wwid"
+    )
+    return {
+        "device": device.as_posix(),
+        "serial": serial,
+        "wwn": wwn,
+        "model": _read_sysfs_attribute(sysfs / "device" / "model"),
+        "firmware": _read_sysfs_attribute(sysfs / "device" / "firmware_rev")
+        or _read_sysfs_attribute(sysfs / "device" / "rev"),
+        "size": size,
+    }
+
+
+def get_block_device_transport(device: Path) -> None | str:
+    if path_is_image_file(device):
+        return "file"
+    sysfs = Path("/sys/class/block") / Path(device).resolve().name
+    try:
+        parts = sysfs.resolve(strict=True).parts
+    except OSError:
+        return None
+    # usb disks also sit below a scsi host, so usb is checked first
+    for transport, marker in (
+        ("usb", "usb"),
+        ("nvme", "nvme"),
+        ("mmc", "mmc_host"),
+        ("virtio", "virtio"),
+        ("sata", "ata"),
+        ("scsi", "host"),
+    ):
+        if any(_.startswith(marker) for _ in parts):
+            return transport
+    return None
+
+
+def get_block_device_facts(device: Path) -> dict[str, None | bool | str | int]:
+    device = Path(device)
+    sysfs = Path("/sys/class/block") / device.resolve().name
+    rotational = _read_sysfs_attribute(sysfs / "queue" / "rotational")
+    return {
+        **get_block_device_identity(device),
+        "rotational": None if rotational is None else rotational == "1",
+        "transport": get_block_device_transport(device),
+    }
+
+
+@traced()
 def safety_check_devices(
     boot_device: Path,
     root_devices: tuple[Path, ...],
@@ -47,12 +165,15 @@ def safety_check_devices(
     for device in root_devices:
         assert device_is_not_a_partition(device=device)
 
+    # one parse of mountinfo/swaps/sysfs covers every device below
+    get_device_usage_index(refresh=True)
+
     if boot_device:
         eprint(
             f"installing gentoo on boot device: {boot_device} {boot_device_partition_table} {boot_filesystem}"
         )
         assert path_is_block_special(boot_device, symlink_ok=True)
-        assert not block_special_path_is_mounted(boot_device)
+        assert device_is_not_in_use(device=boot_device)
 
     if root_devices:
         eprint(
@@ -60,7 +181,19 @@ def safety_check_devices(
         )
         for device in root_devices:
             assert path_is_block_special(device, symlink_ok=True)
-            assert not block_special_path_is_mounted(device)
+            assert device_is_not_in_use(device=device)
+
+    signatures = scan_signatures(tuple(_ for _ in (boot_device, *root_devices) if _))
+    for device, found in signatures.items():
+        for signature in found:
+            eprint("signature found:", device, signature.name, signature.start)
+    # partition tables are expected on reused disks and get rewritten anyway
+    in_use = sorted(
+        device.as_posix()
+        for device, found in signatures.items()
+        if any(_.name not in PARTITION_TABLE_SIGNATURES for _ in found)
+    )
+    assert force or not in_use, f"refusing to use devices with existing signatures: {in_use}"
 
     if boot_device:
         boot_device_size = get_block_device_size(boot_device)
@@ -91,8 +224,50 @@ def safety_check_devices(
             )
 
 
+@traced()
+def safety_check_clone(
+    *,
+    source: Path,
+    target: Path,
+    force: bool,
+    resuming: bool = False,
+) -> None:
+    for device in (source, target):
+        assert device_is_not_a_partition(device=device)
+        assert device_is_block_special_or_image(device=device)
+    assert Path(source).resolve() != Path(target).resolve()
+
+    get_device_usage_index(refresh=True)
+    # a mounted source changes while it is read
+    assert device_is_not_in_use(device=source)
+    assert device_is_not_in_use(device=target)
+
+    source_size = get_device_size(source)
+    target_size = get_device_size(target)
+    eprint("source:", source, source_size)
+    eprint("target:", target, target_size)
+    assert source_size <= target_size
+
+    # a half finished clone carries the source's signatures already
+    if not resuming:
+        found = scan_signatures((Path(target),))[Path(target)]
+        for signature in found:
+            eprint("signature found:", target, signature.name, signature.start)
+        assert force or all(
+            _.name in PARTITION_TABLE_SIGNATURES for _ in found
+        ), f"refusing to clone onto {target}, it has existing signatures"
+
+    if not force:
+        warn(
+            (target,),
+            symlink_ok=True,
+        )
+
+
 def device_is_not_a_partition(*, device: Path) -> bool:
     device = Path(device)
+    if path_is_image_file(device):
+        return True
     if not (device.name.startswith("nvme") or device.name.startswith("mmcblk")):
         assert not device.name[-1].isdigit()
     else:
@@ -100,6 +275,12 @@ def device_is_not_a_partition(*, device: Path) -> bool:
     return True
 
 
+def device_is_not_in_use(*, device: Path, refresh: bool = False) -> bool:
+    users = get_device_usage_index(refresh=refresh).users(device)
+    assert not users, f"{device} is in use: {users}"
+    return True
+
+
 def add_partition_number_to_device(*, device: Path, partition_number: int) -> Path:
     device = Path(device)
     if device.name.startswith("nvme") or device.name.startswith("mmcblk"):
@@ -109,7 +290,7 @@ def add_partition_number_to_device(*, device: Path, partition_number: int) -> Pa
 
 def get_partuuid_for_partition(partition: Path) -> str:
     assert isinstance(partition, Path)
-    blkid_output = str(hs.Command("blkid")(partition.as_posix()))
+    blkid_output = str(TracedCommand(hs.Command("blkid"))(partition.as_posix()))
     ic(blkid_output)
     _partuuid = blkid_output.split("PARTUUID=")[-1].split('"')[1]
     ic(_partuuid)
@@ -117,5 +298,5 @@ def get_partuuid_for_partition(partition: Path) -> str:
 
 
 def get_root_device() -> Path:
-    _result = str(hs.Command("grub-probe")("--target=device", "/")).strip()
+    _result = str(TracedCommand(hs.Command("grub-probe"))("--target=device", "/")).strip()
     return Path(_result)
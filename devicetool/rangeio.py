@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import hashlib
+import itertools
+import os
+import stat
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from pathlib import Path
+
+from .bufferpool import get_buffer_pool
+from .trace import traced
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_QUEUE_DEPTH = 8
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+# block devices only accept logical-block aligned discards
+PUNCH_ALIGNMENT = 4096
+DURABILITY_POLICIES = ("none", "end", "bytes", "chunk")
+DEFAULT_FLUSH_BYTES = 64 * 1024 * 1024
+BLKFLSBUF = 0x1261
+
+_libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+_fallocate = getattr(_libc, "fallocate64", None) or getattr(_libc, "fallocate", None)
+if _fallocate is not None:
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+_memcmp = _libc.memcmp
+_memcmp.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]
+_memcmp.restype = ctypes.c_int
+
+
+def iter_chunks(
+    *,
+    start: int,
+    end: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+) -> Iterator[tuple[int, int]]:
+    assert start >= 0
+    assert start < end
+    assert chunk_size > 0
+    offset = start
+    while offset < end:
+        length = min(chunk_size, end - offset)
+        yield offset, length
+        offset += length
+
+
+def pread_into(fd: int, view: memoryview, offset: int) -> None:
+    done = 0
+    while done < len(view):
+        count = os.preadv(fd, [view[done:]], offset + done)
+        if count == 0:
+            raise EOFError(f"short read at offset {offset + done}")
+        done += count
+
+
+def pwrite_all(fd: int, view: memoryview, offset: int) -> None:
+    done = 0
+    while done < len(view):
+        done += os.pwrite(fd, view[done:], offset + done)
+
+
+def _skip_views(views: list[memoryview], count: int) -> list[memoryview]:
+    # what is left of a vectored request after count bytes went through
+    while views and count >= len(views[0]):
+        count -= len(views[0])
+        views = views[1:]
+    if count:
+        views = [views[0][count:], *views[1:]]
+    return views
+
+
+def preadv_into(fd: int, views: list[memoryview], offset: int) -> None:
+    views = [_ for _ in views if len(_)]
+    while views:
+        count = os.preadv(fd, views, offset)
+        if count == 0:
+            raise EOFError(f"short read at offset {offset}")
+        offset += count
+        views = _skip_views(views, count)
+
+
+def pwritev_all(fd: int, views: list[memoryview], offset: int) -> None:
+    views = [_ for _ in views if len(_)]
+    while views:
+        count = os.pwritev(fd, views, offset)
+        offset += count
+        views = _skip_views(views, count)
+
+
+class Flusher:
+    # "end" issues one fdatasync after the last write, "bytes" one per
+    # flush_bytes written and "chunk" one per write; flush time is kept
+    # apart from write time so the policies can be compared
+    def __init__(
+        self,
+        policy: str = "end",
+        *,
+        flush_bytes: int = DEFAULT_FLUSH_BYTES,
+    ) -> None:
+        assert policy in DURABILITY_POLICIES, f"unknown durability policy: {policy!r}"
+        assert flush_bytes > 0
+        self.policy = policy
+        self.flush_bytes = flush_bytes
+        self.pending = 0
+        self.flushes = 0
+        self.flush_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def _flush(self, fd: int) -> None:
+        started = time.monotonic()
+        os.fdatasync(fd)
+        self.flush_seconds += time.monotonic() - started
+        self.flushes += 1
+        self.pending = 0
+
+    def wrote(self, fd: int, count: int) -> None:
+        if self.policy == "none":
+            return
+        with self.lock:
+            self.pending += count
+            if self.policy == "chunk" or (
+                self.policy == "bytes" and self.pending >= self.flush_bytes
+            ):
+                self._flush(fd)
+
+    def finish(self, fd: int) -> None:
+        if self.policy == "none":
+            return
+        with self.lock:
+            if self.pending or not self.flushes:
+                self._flush(fd)
+            if not stat.S_ISBLK(os.fstat(fd).st_mode):
+                return
+            # drop the now clean buffer cache so later reads come from the device
+            started = time.monotonic()
+            try:
+                fcntl.ioctl(fd, BLKFLSBUF)
+            except OSError as exc:
+                if exc.errno not in (errno.EACCES, errno.EPERM, errno.ENOTTY):
+                    raise
+            self.flush_seconds += time.monotonic() - started
+
+    @property
+    def stats(self) -> dict:
+        return {
+            "policy": self.policy,
+            "flushes": self.flushes,
+            "flush_seconds": round(self.flush_seconds, 6),
+        }
+
+
+def flush_device(device: Path, *, policy: str = "end") -> dict:
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        flusher = Flusher(policy)
+        flusher.finish(fd)
+    finally:
+        os.close(fd)
+    return flusher.stats
+
+
+# errors meaning "this kernel/filesystem pair cannot do it", not real I/O errors
+_KERNEL_COPY_UNSUPPORTED = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ESPIPE,
+    errno.EXDEV,
+}
+_PUNCH_UNSUPPORTED = _KERNEL_COPY_UNSUPPORTED | {errno.ENODEV, errno.ENOTTY}
+
+
+def _copy_file_range(
+    src_fd: int,
+    src_offset: int,
+    dst_fd: int,
+    dst_offset: int,
+    count: int,
+) -> int:
+    return os.copy_file_range(src_fd, dst_fd, count, src_offset, dst_offset)
+
+
+def _sendfile(
+    src_fd: int,
+    src_offset: int,
+    dst_fd: int,
+    dst_offset: int,
+    count: int,
+) -> int:
+    # sendfile writes at the current position of dst_fd
+    os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+    return os.sendfile(dst_fd, src_fd, src_offset, count)
+
+
+@traced()
+def copy_range(
+    *,
+    src_fd: int,
+    src_offset: int,
+    dst_fd: int,
+    dst_offset: int,
+    length: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    kernel_copy: bool = True,
+    flusher: None | Flusher = None,
+) -> str:
+    done = 0
+    methods = []
+    if kernel_copy:
+        if hasattr(os, "copy_file_range"):
+            methods.append(("copy_file_range", _copy_file_range))
+        methods.append(("sendfile", _sendfile))
+    for name, method in methods:
+        try:
+            while done < length:
+                count = method(
+                    src_fd,
+                    src_offset + done,
+                    dst_fd,
+                    dst_offset + done,
+                    min(chunk_size, length - done),
+                )
+                if count == 0:
+                    break
+                done += count
+                if flusher is not None:
+                    flusher.wrote(dst_fd, count)
+        except OSError as exc:
+            if exc.errno not in _KERNEL_COPY_UNSUPPORTED:
+                raise
+        if done == length:
+            return name
+
+    chunk_size = get_buffer_pool().fit(chunk_size)
+    with get_buffer_pool().borrow(min(chunk_size, length - done)) as buf:
+        for offset, count in iter_chunks(start=done, end=length, chunk_size=chunk_size):
+            pread_into(src_fd, buf[:count], src_offset + offset)
+            pwrite_all(dst_fd, buf[:count], dst_offset + offset)
+            if flusher is not None:
+                flusher.wrote(dst_fd, count)
+    return "pread/pwrite"
+
+
+_urandom_fd: None | int = None
+_urandom_lock = threading.Lock()
+
+
+def read_urandom_into(view: memoryview) -> None:
+    # straight into the caller's buffer, os.urandom returns a new bytes
+    # object that then has to be copied
+    global _urandom_fd
+    with _urandom_lock:
+        if _urandom_fd is None:
+            _urandom_fd = os.open("/dev/urandom", os.O_RDONLY | os.O_CLOEXEC)
+    done = 0
+    while done < len(view):
+        done += os.readv(_urandom_fd, [view[done:]])
+
+
+def fill_from_source(view: memoryview, source: str) -> None:
+    if source == "zero":
+        view[:] = zero_bytes(len(view))
+    elif source == "urandom":
+        read_urandom_into(view)
+    else:
+        raise ValueError(f"unknown source: {source}")
+
+
+def merge_extents(extents: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(extents):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+_zero_bytes = b""
+
+
+def zero_bytes(length: int) -> memoryview:
+    # views of one shared, already faulted-in zero buffer; a fresh
+    # bytes(length), or a slice of the shared one, costs a copy or a page
+    # fault per page
+    global _zero_bytes
+    if len(_zero_bytes) < length:
+        _zero_bytes = bytes(length)
+    return memoryview(_zero_bytes)[:length]
+
+
+def _address(view: memoryview) -> int:
+    return ctypes.addressof(ctypes.c_char.from_buffer(view))
+
+
+def is_all_zero(view: memoryview) -> bool:
+    if view.readonly or not len(view):
+        return view.tobytes().count(0) == len(view)
+    zero_bytes(len(view))
+    return _memcmp(_address(view), _zero_bytes, len(view)) == 0
+
+
+def buffers_equal(a: memoryview, b: memoryview) -> bool:
+    # memcmp in place and without the GIL; memoryview == compares item by
+    # item and bytes == needs a copy of both sides
+    if len(a) != len(b):
+        return False
+    if a.readonly or b.readonly or not len(a):
+        return a.tobytes() == b.tobytes()
+    return _memcmp(_address(a), _address(b), len(a)) == 0
+
+
+def punch_hole(fd: int, offset: int, length: int) -> None:
+    if _fallocate is None:
+        raise OSError(errno.ENOSYS, "fallocate is not available")
+    mode = FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE
+    if _fallocate(fd, mode, offset, length) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+@traced()
+def zero_range_sparse(
+    fd: int,
+    *,
+    start: int,
+    end: int,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    flusher: None | Flusher = None,
+    buf: None | memoryview = None,
+) -> dict[str, int]:
+    # punch the aligned middle of the range; whatever cannot be punched is
+    # read first and only written when it is not already zero, so holes
+    # stay holes and a clean range costs a read. A caller already holding
+    # a pool buffer passes it as buf instead of borrowing a second one
+    stats = {"punched": 0, "skipped": 0, "written": 0}
+    remaining = [(start, end)]
+    aligned_start = -(-start // PUNCH_ALIGNMENT) * PUNCH_ALIGNMENT
+    aligned_end = end // PUNCH_ALIGNMENT * PUNCH_ALIGNMENT
+    if aligned_start < aligned_end:
+        try:
+            punch_hole(fd, aligned_start, aligned_end - aligned_start)
+        except OSError as exc:
+            if exc.errno not in _PUNCH_UNSUPPORTED:
+                raise
+        else:
+            stats["punched"] = aligned_end - aligned_start
+            if flusher is not None:
+                flusher.wrote(fd, stats["punched"])
+            remaining = [(start, aligned_start), (aligned_end, end)]
+
+    remaining = [(_start, _end) for _start, _end in remaining if _start < _end]
+    if not remaining:
+        return stats
+    size = min(chunk_size, max(_end - _start for _start, _end in remaining))
+    if buf is None:
+        chunk_size = get_buffer_pool().fit(chunk_size)
+        size = min(size, chunk_size)
+    else:
+        assert len(buf) >= size
+    zeros = zero_bytes(size)
+    with nullcontext(buf) if buf is not None else get_buffer_pool().borrow(size) as buf:
+        for range_start, range_end in remaining:
+            for offset, length in iter_chunks(
+                start=range_start,
+                end=range_end,
+                chunk_size=chunk_size,
+            ):
+                pread_into(fd, buf[:length], offset)
+                if is_all_zero(buf[:length]):
+                    stats["skipped"] += length
+                    continue
+                pwrite_all(fd, zeros[:length], offset)
+                stats["written"] += length
+                if flusher is not None:
+                    flusher.wrote(fd, length)
+    return stats
+
+
+@traced()
+def backup_then_wipe_range(
+    dfd: int,
+    bfd: int,
+    *,
+    start: int,
+    end: int,
+    source: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    sparse: bool = False,
+    flusher: None | Flusher = None,
+) -> dict:
+    # one pass over the range in three stages: the main thread reads chunk
+    # n+2 into a free buffer while the backup thread writes and fdatasyncs
+    # chunk n+1 to the backup and the wipe thread overwrites chunk n on the
+    # device; a chunk's wipe waits for that chunk's backup to be durable
+    assert source in ("zero", "urandom"), f"source must be zero or urandom, not {source!r}"
+    assert start >= 0
+    assert start < end
+    digest = hashlib.sha256()
+    stats = {"punched": 0, "skipped": 0, "written": 0}
+    punch = sparse and source == "zero"
+    failed = threading.Event()
+
+    def _backup(view: memoryview, offset: int) -> bool:
+        # a chunk queued behind a failed one must stay untouched
+        if failed.is_set():
+            return False
+        try:
+            pwrite_all(bfd, view, offset - start)
+            digest.update(view)
+            os.fdatasync(bfd)
+            # the read buffer is reused once this returns, the wipe only
+            # needs to know whether there is anything to zero
+            return source == "zero" and is_all_zero(view)
+        except BaseException:
+            failed.set()
+            raise
+
+    def _wipe(backed_up: Future, offset: int, length: int) -> None:
+        nonlocal punch
+        try:
+            already_zero = backed_up.result()
+            if failed.is_set():
+                return
+            if already_zero:
+                stats["skipped"] += length
+                return
+            if punch and offset % PUNCH_ALIGNMENT == 0 and length % PUNCH_ALIGNMENT == 0:
+                try:
+                    punch_hole(dfd, offset, length)
+                except OSError as exc:
+                    if exc.errno not in _PUNCH_UNSUPPORTED:
+                        raise
+                    punch = False
+                else:
+                    stats["punched"] += length
+                    if flusher is not None:
+                        flusher.wrote(dfd, length)
+                    return
+            if source != "zero":
+                fill_from_source(wipe[:length], source)
+            pwrite_all(dfd, wipe[:length], offset)
+            stats["written"] += length
+            if flusher is not None:
+                flusher.wrote(dfd, length)
+        except BaseException:
+            failed.set()
+            raise
+
+    chunk_size = get_buffer_pool().fit(chunk_size, 3, align=PUNCH_ALIGNMENT)
+    # the first chunk ends on a chunk_size boundary so the rest stay punchable
+    boundary = min(end, (start // chunk_size + 1) * chunk_size)
+    chunks = itertools.chain(
+        [(start, boundary - start)],
+        iter_chunks(start=boundary, end=end, chunk_size=chunk_size) if boundary < end else (),
+    )
+    # two read buffers and the wipe buffer come from the pool together
+    with get_buffer_pool().borrow_many(min(chunk_size, end - start), 3) as (*bufs, wipe):
+        if source == "zero":
+            fill_from_source(wipe, source)
+        with ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="devicetool-pipeline-backup",
+        ) as backup_executor, ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="devicetool-pipeline-wipe",
+        ) as wipe_executor:
+            backups: list[None | Future] = [None, None]
+            wipes: deque[Future] = deque()
+            try:
+                for index, (offset, length) in enumerate(chunks):
+                    slot = index % 2
+                    if backups[slot] is not None:
+                        backups[slot].result()
+                    view = bufs[slot][:length]
+                    pread_into(dfd, view, offset)
+                    backups[slot] = backup_executor.submit(_backup, view, offset)
+                    # one wipe in flight and one queued, the device may lag
+                    # the backup but not without bound
+                    if len(wipes) == 2:
+                        wipes.popleft().result()
+                    wipes.append(wipe_executor.submit(_wipe, backups[slot], offset, length))
+                for future in (*backups, *wipes):
+                    if future is not None:
+                        future.result()
+            except BaseException:
+                failed.set()
+                raise
+    return {"sha256": digest.hexdigest(), **stats}
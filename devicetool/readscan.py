@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .bufferpool import get_buffer_pool
+from .rangeio import DEFAULT_CHUNK_SIZE
+from .rangeio import DEFAULT_QUEUE_DEPTH
+from .trace import traced
+from .tuning import open_direct
+
+SECTOR_SIZE = 512
+DIRECT_ALIGNMENT = 4096
+DEFAULT_REGIONS = 64
+DEFAULT_SLOW_MS = 100.0
+
+
+class _Region:
+    # latencies go into log2 buckets of microseconds: bucket n counts
+    # requests that took less than 2**n us and at least 2**(n-1) us
+    def __init__(self, start: int, end: int) -> None:
+        self.start = start
+        self.end = end
+        self.requests = 0
+        self.bytes = 0
+        self.errors = 0
+        self.max_us = 0
+        self.buckets: dict[int, int] = {}
+
+    def add(self, latency_us: int, count: int) -> None:
+        bucket = latency_us.bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.requests += 1
+        self.bytes += count
+        self.max_us = max(self.max_us, latency_us)
+
+    def as_dict(self) -> dict:
+        return {
+            "start": self.start,
+            "end": self.end,
+            "requests": self.requests,
+            "bytes": self.bytes,
+            "errors": self.errors,
+            "max_ms": round(self.max_us / 1000, 3),
+            "histogram_lt_us": {
+                str(2**bucket): self.buckets[bucket] for bucket in sorted(self.buckets)
+            },
+        }
+
+
+def _retry_blocks(fd: int, view: memoryview, *, offset: int, length: int) -> list[dict]:
+    failed = []
+    for block_offset in range(offset, offset + length, DIRECT_ALIGNMENT):
+        want = min(DIRECT_ALIGNMENT, offset + length - block_offset)
+        try:
+            count = os.preadv(fd, [view[:DIRECT_ALIGNMENT]], block_offset)
+            if count < want:
+                raise OSError(0, f"short read of {count} bytes")
+        except OSError as exc:
+            failed.append(
+                {
+                    "lba": block_offset // SECTOR_SIZE,
+                    "sectors": -(-want // SECTOR_SIZE),
+                    "error": str(exc),
+                }
+            )
+    return failed
+
+
+@traced()
+def read_scan(
+    device: Path,
+    *,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    queue_depth: int = DEFAULT_QUEUE_DEPTH,
+    regions: int = DEFAULT_REGIONS,
+    slow_ms: float = DEFAULT_SLOW_MS,
+    stripe_every: int = 1,
+) -> dict:
+    # with stripe_every > 1 only every stripe_every-th chunk is read, which
+    # samples the whole surface in a fraction of the time
+    device = Path(device)
+    assert chunk_size % DIRECT_ALIGNMENT == 0
+    assert queue_depth > 0
+    assert regions > 0
+    assert stripe_every > 0
+    chunk_size = get_buffer_pool().fit(chunk_size, align=DIRECT_ALIGNMENT)
+    fd, direct = open_direct(device, os.O_RDONLY)
+    try:
+        device_size = os.lseek(fd, 0, os.SEEK_END)
+        assert device_size > 0
+        if not direct:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        region_size = -(-device_size // regions)
+        region_size = -(-region_size // chunk_size) * chunk_size
+        region_stats = [
+            _Region(start, min(start + region_size, device_size))
+            for start in range(0, device_size, region_size)
+        ]
+        pending = iter(range(0, device_size, chunk_size * stripe_every))
+        lock = threading.Lock()
+        slow: list[dict] = []
+        errors: list[dict] = []
+
+        def _worker() -> None:
+            # pool buffers are mmap memory, page aligned as O_DIRECT requires
+            with get_buffer_pool().borrow(chunk_size) as view:
+                while True:
+                    with lock:
+                        offset = next(pending, None)
+                    if offset is None:
+                        return
+                    want = min(chunk_size, device_size - offset)
+                    io_length = -(-want // DIRECT_ALIGNMENT) * DIRECT_ALIGNMENT
+                    region = region_stats[offset // region_size]
+                    started = time.perf_counter_ns()
+                    try:
+                        count = os.preadv(fd, [view[:io_length]], offset)
+                        if count < want:
+                            raise OSError(0, f"short read of {count} bytes")
+                    except OSError:
+                        # narrow the failed request down to the bad blocks
+                        failed = _retry_blocks(fd, view, offset=offset, length=want)
+                        with lock:
+                            region.errors += 1
+                            errors.extend(failed)
+                        continue
+                    latency_us = (time.perf_counter_ns() - started) // 1000
+                    with lock:
+                        region.add(latency_us, want)
+                        if latency_us >= slow_ms * 1000:
+                            slow.append(
+                                {
+                                    "lba": offset // SECTOR_SIZE,
+                                    "sectors": want // SECTOR_SIZE,
+                                    "ms": round(latency_us / 1000, 3),
+                                }
+                            )
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(
+            max_workers=queue_depth,
+            thread_name_prefix="devicetool-read-scan",
+        ) as executor:
+            for future in [executor.submit(_worker) for _ in range(queue_depth)]:
+                future.result()
+        elapsed = time.monotonic() - started
+    finally:
+        os.close(fd)
+    total = sum(_.bytes for _ in region_stats)
+    return {
+        "device": device.as_posix(),
+        "size": device_size,
+        "direct_io": direct,
+        "chunk_size": chunk_size,
+        "queue_depth": queue_depth,
+        "stripe_every": stripe_every,
+        "bytes_read": total,
+        "seconds": round(elapsed, 6),
+        "mb_s": round(total / elapsed / (1024 * 1024), 1),
+        "slow": sorted(slow, key=lambda _: _["lba"]),
+        "errors": sorted(errors, key=lambda _: _["lba"]),
+        "regions": [_.as_dict() for _ in region_stats],
+    }
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+import os
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .bufferpool import get_buffer_pool
+from .devicetool import get_device_size
+from .rangeio import DEFAULT_CHUNK_SIZE
+from .rangeio import is_all_zero
+from .rangeio import pread_into
+from .trace import traced
+
+SCAN_BLOCK_SIZE = 64 * 1024
+BLOCK_CLASSES = ("zero", "high-entropy", "structured")
+# level 1 deflate cannot shrink random or encrypted data, anything it
+# saves more than 5% on has structure
+HIGH_ENTROPY_RATIO = 0.95
+# deflate runs at tens of MB/s, so only ENTROPY_SLICES spread-out slices
+# of ENTROPY_SLICE_SIZE bytes from each block are compressed
+ENTROPY_SLICES = 4
+ENTROPY_SLICE_SIZE = 2048
+
+
+def classify_block(view: memoryview) -> str:
+    if is_all_zero(view):
+        return "zero"
+    if len(view) > ENTROPY_SLICES * ENTROPY_SLICE_SIZE:
+        step = len(view) // ENTROPY_SLICES
+        sample = b"".join(
+            view[_ : _ + ENTROPY_SLICE_SIZE] for _ in range(0, step * ENTROPY_SLICES, step)
+        )
+    else:
+        sample = view
+    # zlib releases the GIL, so worker threads classify in parallel
+    if len(zlib.compress(sample, 1)) >= len(sample) * HIGH_ENTROPY_RATIO:
+        return "high-entropy"
+    return "structured"
+
+
+def _extend_runs(runs: list[list], blocks: list[tuple[int, int, str]]) -> None:
+    for start, end, kind in blocks:
+        if runs and runs[-1][2] == kind and runs[-1][1] == start:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end, kind])
+
+
+@traced()
+def scan_map(
+    device: Path,
+    *,
+    block_size: int = SCAN_BLOCK_SIZE,
+    stride: int = 1,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    max_workers: int = 8,
+) -> dict:
+    # with stride > 1 only the first block of every stride is read and
+    # its class stands for the whole stride
+    device = Path(device)
+    assert block_size > 0
+    assert stride > 0
+    assert chunk_size % block_size == 0
+    device_size = get_device_size(device)
+    span = block_size * stride
+    batch_span = span * (chunk_size // block_size)
+
+    def _scan(batch_start: int) -> list[tuple[int, int, str]]:
+        result = []
+        with get_buffer_pool().borrow(block_size) as buf:
+            for start in range(batch_start, min(batch_start + batch_span, device_size), span):
+                view = buf[: min(block_size, device_size - start)]
+                pread_into(fd, view, start)
+                result.append((start, min(start + span, device_size), classify_block(view)))
+        return result
+
+    runs: list[list] = []
+    sampled = 0
+
+    def _collect(future: Future) -> None:
+        nonlocal sampled
+        blocks = future.result()
+        sampled += sum(min(block_size, end - start) for start, end, _ in blocks)
+        _extend_runs(runs, blocks)
+
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        with ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="devicetool-scan-map",
+        ) as executor:
+            # a bounded window of batches keeps memory flat on large devices
+            pending: deque[Future] = deque()
+            for batch_start in range(0, device_size, batch_span):
+                pending.append(executor.submit(_scan, batch_start))
+                if len(pending) >= max_workers * 2:
+                    _collect(pending.popleft())
+            while pending:
+                _collect(pending.popleft())
+    finally:
+        os.close(fd)
+    totals = dict.fromkeys(BLOCK_CLASSES, 0)
+    for start, end, kind in runs:
+        totals[kind] += end - start
+    return {
+        "device": device.as_posix(),
+        "size": device_size,
+        "block_size": block_size,
+        "stride": stride,
+        "sampled_bytes": sampled,
+        "totals": totals,
+        "runs": runs,
+    }
+
+
+def map_extents(scan: dict, kind: str) -> list[tuple[int, int]]:
+    assert kind in BLOCK_CLASSES, f"kind must be one of {BLOCK_CLASSES}, not {kind!r}"
+    return [(start, end) for start, end, _kind in scan["runs"] if _kind == kind]
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from .rangeio import merge_extents
+from .trace import traced
+
+KiB = 1024
+MiB = 1024 * KiB
+GiB = 1024 * MiB
+
+GPT_ENTRIES_SIZE = 128 * 128
+ZFS_LABEL_SIZE = 256 * KiB
+MD_MAGIC_LE = struct.pack("<I", 0xA92B4EFC)
+MD_MAGIC_BE = struct.pack(">I", 0xA92B4EFC)
+ZFS_UBERBLOCK_MAGIC_LE = struct.pack("<Q", 0x00BAB10C)
+ZFS_UBERBLOCK_MAGIC_BE = struct.pack(">Q", 0x00BAB10C)
+EXT_MAGIC = struct.pack("<H", 0xEF53)
+PARTITION_TABLE_SIGNATURES = ("mbr", "gpt", "gpt-backup")
+
+
+@dataclass(frozen=True)
+class Signature:
+    name: str
+    start: int
+    end: int
+    magic_offset: int
+    magics: tuple[bytes, ...]
+    # some formats (ZFS uberblocks) keep the magic in any slot of a ring
+    magic_stride: int = 0
+    magic_count: int = 1
+
+
+def _ext_backup_groups(group_count: int) -> list[int]:
+    groups = {1}
+    for base in (3, 5, 7):
+        group = base
+        while group < group_count:
+            groups.add(group)
+            group *= base
+    return sorted(_ for _ in groups if _ < group_count)
+
+
+def _ext_signatures(
+    *,
+    device_size: int,
+    block_size: int,
+    blocks_per_group: int,
+    first_data_block: int,
+) -> list[Signature]:
+    signatures = [
+        Signature(
+            name="ext",
+            start=1024,
+            end=2048,
+            magic_offset=1024 + 0x38,
+            magics=(EXT_MAGIC,),
+        )
+    ]
+    group_size = block_size * blocks_per_group
+    group_count = device_size // group_size
+    for group in _ext_backup_groups(group_count):
+        start = (group * blocks_per_group + first_data_block) * block_size
+        if start + 1024 > device_size:
+            break
+        signatures.append(
+            Signature(
+                name="ext-backup",
+                start=start,
+                end=start + 1024,
+                magic_offset=start + 0x38,
+                magics=(EXT_MAGIC,),
+            )
+        )
+    return signatures
+
+
+def candidate_signatures(
+    *,
+    device_size: int,
+    ext_geometry: tuple[int, int, int] = (4096, 32768, 0),
+) -> list[Signature]:
+    assert device_size > 0
+    signatures = [
+        Signature(
+            name="mbr",
+            start=0,
+            end=512,
+            magic_offset=510,
+            magics=(b"\x55\xaa",),
+        ),
+        Signature(
+            name="luks",
+            start=0,
+            end=4096,
+            magic_offset=0,
+            magics=(b"LUKS\xba\xbe",),
+        ),
+        Signature(
+            name="xfs",
+            start=0,
+            end=512,
+            magic_offset=0,
+            magics=(b"XFSB",),
+        ),
+        Signature(
+            name="md-1.1",
+            start=0,
+            end=4096,
+            magic_offset=0,
+            magics=(MD_MAGIC_LE,),
+        ),
+        Signature(
+            name="md-1.2",
+            start=4096,
+            end=8192,
+            magic_offset=4096,
+            magics=(MD_MAGIC_LE,),
+        ),
+    ]
+    for sector_size in (512, 4096):
+        signatures.append(
+            Signature(
+                name="gpt",
+                start=sector_size,
+                end=2 * sector_size + GPT_ENTRIES_SIZE,
+                magic_offset=sector_size,
+                magics=(b"EFI PART",),
+            )
+        )
+        signatures.append(
+            Signature(
+                name="gpt-backup",
+                start=device_size - sector_size - GPT_ENTRIES_SIZE,
+                end=device_size,
+                magic_offset=device_size - sector_size,
+                magics=(b"EFI PART",),
+            )
+        )
+    # luks2 keeps a secondary binary header at one of these offsets
+    for shift in range(9):
+        start = 16 * KiB << shift
+        signatures.append(
+            Signature(
+                name="luks2-secondary",
+                start=start,
+                end=start + 4096,
+                magic_offset=start,
+                magics=(b"SKUL\xba\xbe",),
+            )
+        )
+    for sector in range(4):
+        signatures.append(
+            Signature(
+                name="lvm2-pv",
+                start=sector * 512,
+                end=sector * 512 + 512,
+                magic_offset=sector * 512,
+                magics=(b"LABELONE",),
+            )
+        )
+    md_090_start = (device_size & ~(64 * KiB - 1)) - 64 * KiB
+    md_10_start = (device_size - 8 * KiB) & ~(4 * KiB - 1)
+    signatures.append(
+        Signature(
+            name="md-0.90",
+            start=md_090_start,
+            end=md_090_start + 4096,
+            magic_offset=md_090_start,
+            magics=(MD_MAGIC_LE, MD_MAGIC_BE),
+        )
+    )
+    signatures.append(
+        Signature(
+            name="md-1.0",
+            start=md_10_start,
+            end=md_10_start + 4096,
+            magic_offset=md_10_start,
+            magics=(MD_MAGIC_LE,),
+        )
+    )
+    for start in (64 * KiB, 64 * MiB, 256 * GiB):
+        signatures.append(
+            Signature(
+                name="btrfs",
+                start=start,
+                end=start + 4096,
+                magic_offset=start + 0x40,
+                magics=(b"_BHRfS_M",),
+            )
+        )
+    block_size, blocks_per_group, first_data_block = ext_geometry
+    signatures.extend(
+        _ext_signatures(
+            device_size=device_size,
+            block_size=block_size,
+            blocks_per_group=blocks_per_group,
+            first_data_block=first_data_block,
+        )
+    )
+    zfs_aligned_size = device_size & ~(ZFS_LABEL_SIZE - 1)
+    for start in (
+        0,
+        ZFS_LABEL_SIZE,
+        zfs_aligned_size - 2 * ZFS_LABEL_SIZE,
+        zfs_aligned_size - ZFS_LABEL_SIZE,
+    ):
+        signatures.append(
+            Signature(
+                name="zfs",
+                start=start,
+                end=start + ZFS_LABEL_SIZE,
+                magic_offset=start + 128 * KiB,
+                magics=(ZFS_UBERBLOCK_MAGIC_LE, ZFS_UBERBLOCK_MAGIC_BE),
+                magic_stride=KiB,
+                magic_count=128,
+            )
+        )
+    return [_ for _ in signatures if 0 <= _.start < _.end <= device_size]
+
+
+def _read_ext_geometry(fd: int) -> None | tuple[int, int, int]:
+    superblock = os.pread(fd, 1024, 1024)
+    if superblock[0x38:0x3A] != EXT_MAGIC:
+        return None
+    first_data_block, log_block_size, _, blocks_per_group = struct.unpack_from(
+        "<IIII", superblock, 20
+    )
+    if log_block_size > 6 or not blocks_per_group:
+        return None
+    return 1024 << log_block_size, blocks_per_group, first_data_block
+
+
+def signature_matches(fd: int, signature: Signature) -> bool:
+    magic_length = max(len(_) for _ in signature.magics)
+    window = os.pread(
+        fd,
+        signature.magic_stride * (signature.magic_count - 1) + magic_length,
+        signature.magic_offset,
+    )
+    for slot in range(signature.magic_count):
+        offset = slot * signature.magic_stride
+        for magic in signature.magics:
+            if window[offset : offset + len(magic)] == magic:
+                return True
+    return False
+
+
+def find_signatures(
+    device: Path,
+    *,
+    device_size: None | int = None,
+) -> list[Signature]:
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        if device_size is None:
+            device_size = os.lseek(fd, 0, os.SEEK_END)
+        ext_geometry = _read_ext_geometry(fd)
+        candidates = candidate_signatures(
+            device_size=device_size,
+            ext_geometry=ext_geometry or (4096, 32768, 0),
+        )
+        return [_ for _ in candidates if signature_matches(fd, _)]
+    finally:
+        os.close(fd)
+
+
+def signature_extents(signatures: list[Signature]) -> list[tuple[int, int]]:
+    return merge_extents([(_.start, _.end) for _ in signatures])
+
+
+@traced()
+def scan_signatures(
+    devices: tuple[Path, ...],
+    *,
+    max_workers: int = 16,
+) -> dict[Path, list[Signature]]:
+    devices = tuple(Path(_) for _ in devices)
+    if not devices:
+        return {}
+    with ThreadPoolExecutor(
+        max_workers=min(max_workers, len(devices)),
+        thread_name_prefix="devicetool-scan",
+    ) as executor:
+        found = executor.map(find_signatures, devices)
+        return dict(zip(devices, found))
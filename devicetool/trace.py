@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+import functools
+import json
+import os
+import threading
+import time
+from collections.abc import Callable
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.events: list[dict] = []
+        self.lock = threading.Lock()
+        self.origin_ns = time.perf_counter_ns()
+        self.thread_names: dict[int, str] = {}
+
+    def add(
+        self,
+        *,
+        name: str,
+        category: str,
+        start_ns: int,
+        end_ns: int,
+        args: dict,
+    ) -> None:
+        tid = threading.get_native_id()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start_ns - self.origin_ns) / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": os.getpid(),
+            "tid": tid,
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+            self.thread_names.setdefault(tid, threading.current_thread().name)
+
+    def write(self, path: Path) -> None:
+        with self.lock:
+            events = list(self.events)
+            metadata = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for tid, name in self.thread_names.items()
+            ]
+        with open(path, "w") as fh:
+            json.dump(
+                {"traceEvents": metadata + events, "displayTimeUnit": "ms"},
+                fh,
+                default=str,
+            )
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def enable_tracing() -> None:
+    _tracer.enabled = True
+
+
+def write_trace(path: Path) -> None:
+    _tracer.write(path)
+
+
+@contextmanager
+def phase(name: str, *, category: str = "phase", **args) -> Iterator[None]:
+    if not _tracer.enabled:
+        yield
+        return
+    start_ns = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        _tracer.add(
+            name=name,
+            category=category,
+            start_ns=start_ns,
+            end_ns=time.perf_counter_ns(),
+            args=args,
+        )
+
+
+def traced(
+    name: None | str = None,
+    *,
+    category: str = "phase",
+    record_args: bool = False,
+) -> Callable[[Callable], Callable]:
+    def _decorator(function: Callable) -> Callable:
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def _wrapper(*args, **kwargs):
+            if not _tracer.enabled:
+                return function(*args, **kwargs)
+            recorded = {k: str(v) for k, v in kwargs.items()} if record_args else {}
+            with phase(label, category=category, **recorded):
+                return function(*args, **kwargs)
+
+        return _wrapper
+
+    return _decorator
+
+
+def trace_commands(group) -> None:
+    # ctx.invoke(other_command) calls other_command.callback, so wrapping
+    # the callbacks also times every nested invocation
+    for command in group.commands.values():
+        command.callback = traced(command.name, category="command", record_args=True)(
+            command.callback
+        )
+
+
+class TracedCommand:
+    def __init__(self, command) -> None:
+        self._command = command
+
+    def __call__(self, *args, **kwargs):
+        name = Path(str(self._command).split(" ")[0]).name
+        with phase(
+            f"exec {name}",
+            category="exec",
+            argv=[str(self._command), *(str(_) for _ in args)],
+        ):
+            return self._command(*args, **kwargs)
+
+    def rebake(self, *args, **kwargs) -> "TracedCommand":
+        return TracedCommand(self._command.rebake(*args, **kwargs))
+
+    def __str__(self) -> str:
+        return str(self._command)
+
+    def __repr__(self) -> str:
+        return f"TracedCommand({self._command!r})"
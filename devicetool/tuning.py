@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+import errno
+import json
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from .devicetool import get_block_device_identity
+from .rangeio import DEFAULT_CHUNK_SIZE
+from .rangeio import DEFAULT_QUEUE_DEPTH
+from .rangeio import pread_into
+from .rangeio import pwrite_all
+
+KiB = 1024
+MiB = 1024 * KiB
+
+PROBE_BLOCK_SIZES = (64 * KiB, 256 * KiB, 1 * MiB, 4 * MiB, 8 * MiB)
+PROBE_QUEUE_DEPTHS = (1, 4, 16, 32)
+PROBE_BYTES = 32 * MiB
+
+
+def get_tuning_cache_path() -> Path:
+    if os.environ.get("DEVICETOOL_TUNING_CACHE"):
+        return Path(os.environ["DEVICETOOL_TUNING_CACHE"])
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "devicetool" / "tuning.json"
+
+
+def device_tuning_key(device: Path) -> str:
+    identity = get_block_device_identity(device)
+    model = identity["model"] or "unknown"
+    firmware = identity["firmware"] or "unknown"
+    return f"{model}|{firmware}|{identity['size']}"
+
+
+def _load_tuning_cache() -> dict:
+    # a corrupt cache is a miss, it gets rewritten by the next probe
+    try:
+        cache = json.loads(get_tuning_cache_path().read_text())
+    except (FileNotFoundError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def get_tuned_parameters(device: Path) -> tuple[int, int]:
+    entry = _load_tuning_cache().get(device_tuning_key(device))
+    if not entry:
+        return DEFAULT_CHUNK_SIZE, DEFAULT_QUEUE_DEPTH
+    return entry["chunk_size"], entry["queue_depth"]
+
+
+def store_tuned_parameters(
+    device: Path,
+    *,
+    chunk_size: int,
+    queue_depth: int,
+    **measured,
+) -> None:
+    cache_path = get_tuning_cache_path()
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    cache = _load_tuning_cache()
+    cache[device_tuning_key(device)] = {
+        "chunk_size": chunk_size,
+        "queue_depth": queue_depth,
+        "probed_at": time.time(),
+        **measured,
+    }
+    tmp_path = cache_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(cache, indent=2, sort_keys=True))
+    tmp_path.replace(cache_path)
+
+
+def open_direct(device: Path, flags: int) -> tuple[int, bool]:
+    # tmpfs and some image file hosts refuse O_DIRECT with EINVAL
+    try:
+        return os.open(device, flags | os.O_DIRECT), True
+    except OSError as exc:
+        if exc.errno != errno.EINVAL:
+            raise
+    return os.open(device, flags), False
+
+
+def _run_trial(
+    fd: int,
+    *,
+    offsets: list[int],
+    block_size: int,
+    queue_depth: int,
+    rewrite: bool,
+) -> float:
+    pending = iter(offsets)
+    lock = threading.Lock()
+
+    def _worker() -> None:
+        buf = mmap.mmap(-1, block_size)
+        view = memoryview(buf)
+        try:
+            while True:
+                with lock:
+                    offset = next(pending, None)
+                if offset is None:
+                    return
+                pread_into(fd, view, offset)
+                if rewrite:
+                    pwrite_all(fd, view, offset)
+        finally:
+            view.release()
+            buf.close()
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=queue_depth) as executor:
+        for future in [executor.submit(_worker) for _ in range(queue_depth)]:
+            future.result()
+    if rewrite:
+        os.fdatasync(fd)
+    elapsed = time.monotonic() - started
+    return len(offsets) * block_size / elapsed / MiB
+
+
+def probe_throughput(
+    device: Path,
+    *,
+    block_sizes: tuple[int, ...] = PROBE_BLOCK_SIZES,
+    queue_depths: tuple[int, ...] = PROBE_QUEUE_DEPTHS,
+    probe_bytes: int = PROBE_BYTES,
+    rewrite: bool = False,
+) -> dict:
+    # the rewrite trial writes back the bytes it just read at the same
+    # offset, so it measures write speed without changing the contents;
+    # trials stride sequentially like the backup, wipe and clone paths the
+    # result tunes, each one starting where the last stopped so it does
+    # not read back what the previous trial left in a cache
+    device = Path(device)
+    fd, direct = open_direct(device, os.O_RDWR if rewrite else os.O_RDONLY)
+    try:
+        device_size = os.lseek(fd, 0, os.SEEK_END)
+        trials = []
+        position = 0
+        for block_size in block_sizes:
+            if block_size > device_size:
+                continue
+            slots = device_size // block_size
+            count = max(1, min(slots, probe_bytes // block_size))
+            for queue_depth in queue_depths:
+                first = position // block_size
+                offsets = [(first + _) % slots * block_size for _ in range(count)]
+                position = offsets[-1] + block_size
+                if not direct:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+                trial = {
+                    "block_size": block_size,
+                    "queue_depth": queue_depth,
+                    "read_mb_s": _run_trial(
+                        fd,
+                        offsets=offsets,
+                        block_size=block_size,
+                        queue_depth=queue_depth,
+                        rewrite=False,
+                    ),
+                }
+                if rewrite:
+                    trial["rewrite_mb_s"] = _run_trial(
+                        fd,
+                        offsets=offsets,
+                        block_size=block_size,
+                        queue_depth=queue_depth,
+                        rewrite=True,
+                    )
+                trials.append(trial)
+    finally:
+        os.close(fd)
+    assert trials, f"{device} is smaller than every probe block size"
+    metric = "rewrite_mb_s" if rewrite else "read_mb_s"
+    best = max(trials, key=lambda _: _[metric])
+    return {
+        "device": device.as_posix(),
+        "key": device_tuning_key(device),
+        "direct_io": direct,
+        "trials": trials,
+        "best": best,
+    }
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+
+import os
+import stat
+from collections import defaultdict
+from pathlib import Path
+
+from .trace import traced
+
+
+def _read_dev_t(dev_file: Path) -> None | int:
+    try:
+        major, minor = dev_file.read_text().strip().split(":")
+    except (FileNotFoundError, ValueError):
+        return None
+    return os.makedev(int(major), int(minor))
+
+
+def _path_dev_t(path: str) -> None | int:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not st.st_rdev:
+        return None
+    return st.st_rdev
+
+
+class DeviceUsageIndex:
+    # built from one pass over mountinfo, swaps and sysfs; lookups are a
+    # dict hit on st_rdev, so checking a large batch costs one parse
+    def __init__(
+        self,
+        *,
+        proc: Path = Path("/proc"),
+        sys_block: Path = Path("/sys/block"),
+    ) -> None:
+        direct: dict[int, list[str]] = defaultdict(list)
+        swap_files: dict[tuple[int, int], list[str]] = defaultdict(list)
+        self._parse_mountinfo(proc / "self" / "mountinfo", direct)
+        self._parse_swaps(proc / "swaps", direct, swap_files)
+
+        names: dict[str, int] = {}
+        partitions: dict[str, list[str]] = defaultdict(list)
+        holders: dict[str, list[str]] = defaultdict(list)
+        backing_files: dict[tuple[int, int], list[str]] = defaultdict(list)
+        for disk in sorted(sys_block.iterdir()) if sys_block.is_dir() else ():
+            self._add_sysfs_node(disk, names, holders)
+            backing_file = disk / "loop" / "backing_file"
+            if backing_file.exists():
+                try:
+                    st = os.stat(backing_file.read_text().strip())
+                except OSError:
+                    pass
+                else:
+                    backing_files[(st.st_dev, st.st_ino)].append(disk.name)
+            for entry in sorted(disk.iterdir()):
+                if (entry / "partition").exists():
+                    self._add_sysfs_node(entry, names, holders)
+                    partitions[disk.name].append(entry.name)
+
+        resolved: dict[str, tuple[str, ...]] = {}
+
+        def _resolve(name: str, seen: frozenset[str]) -> tuple[str, ...]:
+            if name in resolved:
+                return resolved[name]
+            reasons = list(direct.get(names.get(name, -1), ()))
+            for holder in holders.get(name, ()):
+                reasons.append(f"{name} held by {holder}")
+                if holder not in seen:
+                    reasons.extend(_resolve(holder, seen | {holder}))
+            for partition in partitions.get(name, ()):
+                reasons.extend(_resolve(partition, seen | {partition}))
+            resolved[name] = tuple(dict.fromkeys(reasons))
+            return resolved[name]
+
+        self._users: dict[int, tuple[str, ...]] = {
+            dev_t: tuple(reasons) for dev_t, reasons in direct.items()
+        }
+        for name, dev_t in names.items():
+            self._users[dev_t] = _resolve(name, frozenset({name}))
+        # image files are in use while a loop device is attached to them
+        self._files: dict[tuple[int, int], tuple[str, ...]] = {
+            key: tuple(reasons) for key, reasons in swap_files.items()
+        }
+        for key, loops in backing_files.items():
+            reasons = list(self._files.get(key, ()))
+            for loop in loops:
+                reasons.append(f"attached to {loop}")
+                reasons.extend(_resolve(loop, frozenset({loop})))
+            self._files[key] = tuple(dict.fromkeys(reasons))
+
+    @staticmethod
+    def _parse_mountinfo(mountinfo: Path, direct: dict[int, list[str]]) -> None:
+        try:
+            lines = mountinfo.read_text().splitlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            fields, _, tail = line.partition(" - ")
+            fields = fields.split()
+            major, minor = fields[2].split(":")
+            mount_point = fields[4].replace("\\040", " ")
+            reason = f"mounted at {mount_point}"
+            direct[os.makedev(int(major), int(minor))].append(reason)
+            # btrfs and friends report an anonymous dev_t, the source names the device
+            source = tail.split()[1] if len(tail.split()) > 1 else ""
+            if source.startswith("/dev/"):
+                dev_t = _path_dev_t(source)
+                if dev_t is not None:
+                    direct[dev_t].append(reason)
+
+    @staticmethod
+    def _parse_swaps(
+        swaps: Path,
+        direct: dict[int, list[str]],
+        swap_files: dict[tuple[int, int], list[str]],
+    ) -> None:
+        try:
+            lines = swaps.read_text().splitlines()[1:]
+        except FileNotFoundError:
+            return
+        for line in lines:
+            swap = line.split()[0].replace("\\040", " ")
+            try:
+                st = os.stat(swap)
+            except OSError:
+                continue
+            if stat.S_ISBLK(st.st_mode):
+                direct[st.st_rdev].append(f"swap {swap}")
+            elif stat.S_ISREG(st.st_mode):
+                # a swap file pins the file and the filesystem it lives on
+                swap_files[(st.st_dev, st.st_ino)].append(f"swap {swap}")
+                direct[st.st_dev].append(f"holds swap file {swap}")
+
+    @staticmethod
+    def _add_sysfs_node(
+        node: Path,
+        names: dict[str, int],
+        holders: dict[str, list[str]],
+    ) -> None:
+        dev_t = _read_dev_t(node / "dev")
+        if dev_t is None:
+            return
+        names[node.name] = dev_t
+        if (node / "holders").is_dir():
+            holders[node.name] = sorted(_.name for _ in (node / "holders").iterdir())
+
+    def users(self, device: Path) -> tuple[str, ...]:
+        # a device that cannot be checked counts as in use, not as free
+        try:
+            st = os.stat(device)
+        except OSError as exc:
+            return (f"cannot stat {device}: {exc.strerror}",)
+        if stat.S_ISBLK(st.st_mode):
+            return self._users.get(st.st_rdev, ())
+        return self._files.get((st.st_dev, st.st_ino), ())
+
+    def in_use(self, device: Path) -> bool:
+        return bool(self.users(device))
+
+
+_device_usage_index: None | DeviceUsageIndex = None
+
+
+@traced()
+def get_device_usage_index(*, refresh: bool = False) -> DeviceUsageIndex:
+    global _device_usage_index
+    if refresh or _device_usage_index is None:
+        _device_usage_index = DeviceUsageIndex()
+    return _device_usage_index
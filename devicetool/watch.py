@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+import asyncio
+import json
+import os
+import socket
+import threading
+import time
+from collections.abc import Callable
+from collections.abc import Iterable
+from collections.abc import Iterator
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from pathlib import Path
+
+import hs
+from eprint import eprint
+
+from . import aio
+from .archive import write_archive
+from .bufferpool import get_buffer_pool
+from .devicetool import device_is_block_special_or_image
+from .devicetool import device_is_not_a_partition
+from .devicetool import device_is_not_in_use
+from .devicetool import get_block_device_facts
+from .rangeio import Flusher
+from .rangeio import pread_into
+from .readscan import read_scan
+from .scanmap import SCAN_BLOCK_SIZE
+from .scanmap import classify_block
+from .scanmap import scan_map
+from .signatures import find_signatures
+from .trace import TracedCommand
+
+NETLINK_KOBJECT_UEVENT = 15
+UEVENT_KERNEL_GROUP = 1
+POLL_INTERVAL = 2.0
+DEVICE_NODE_TIMEOUT = 10.0
+DEFAULT_HEAD_TAIL_SIZE = 1024 * 1024 * 128
+DESTRUCTIVE_STEPS = ("wipe", "layout")
+# stacked and virtual disks report DEVTYPE=disk too
+REFUSED_NAME_PREFIXES = ("dm-", "md", "loop")
+
+
+@dataclass(frozen=True)
+class DeviceEvent:
+    action: str
+    device: Path
+    synthetic: bool = False
+
+
+def parse_uevent(message: bytes) -> None | DeviceEvent:
+    # "add@/devices/...\0ACTION=add\0SUBSYSTEM=block\0DEVNAME=sdb\0..."
+    env = {}
+    for field in message.split(b"\0")[1:]:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            env[key.decode(errors="replace")] = value.decode(errors="replace")
+    if env.get("SUBSYSTEM") != "block" or env.get("DEVTYPE") != "disk":
+        return None
+    if "ACTION" not in env or "DEVNAME" not in env:
+        return None
+    return DeviceEvent(action=env["ACTION"], device=Path("/dev") / env["DEVNAME"])
+
+
+def netlink_events() -> Iterator[DeviceEvent]:
+    # the socket is bound here, not on the first next(), so a kernel or
+    # sandbox without uevent netlink fails early and can fall back to polling
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+    try:
+        sock.bind((0, UEVENT_KERNEL_GROUP))
+    except OSError:
+        sock.close()
+        raise
+
+    def _events() -> Iterator[DeviceEvent]:
+        with sock:
+            while True:
+                event = parse_uevent(sock.recv(65536))
+                if event is not None:
+                    yield event
+
+    return _events()
+
+
+def poll_events(
+    *,
+    interval: float = POLL_INTERVAL,
+    sys_block: Path = Path("/sys/block"),
+) -> Iterator[DeviceEvent]:
+    known = set(os.listdir(sys_block))
+    while True:
+        time.sleep(interval)
+        current = set(os.listdir(sys_block))
+        for name in sorted(current - known):
+            yield DeviceEvent(action="add", device=Path("/dev") / name)
+        for name in sorted(known - current):
+            yield DeviceEvent(action="remove", device=Path("/dev") / name)
+        known = current
+
+
+def open_event_source(
+    *,
+    poll: bool = False,
+    interval: float = POLL_INTERVAL,
+) -> Iterator[DeviceEvent]:
+    if not poll:
+        try:
+            return netlink_events()
+        except OSError as exc:
+            eprint("uevent netlink unavailable, polling /sys/block:", exc)
+    return poll_events(interval=interval)
+
+
+def refused_reason(device: Path) -> None | str:
+    # by kernel name, so the check holds before the device node exists
+    name = Path(device).name
+    if name.startswith(REFUSED_NAME_PREFIXES):
+        return "stacked or virtual device"
+    if name.startswith(("nvme", "mmcblk")):
+        if name.rstrip("0123456789").endswith("p"):
+            return "partition"
+    elif name[-1:].isdigit():
+        return "partition"
+    return None
+
+
+def rule_matches(rule: dict, facts: dict) -> bool:
+    match = rule.get("match", {})
+    if "min_size" in match and facts["size"] < match["min_size"]:
+        return False
+    if "max_size" in match and facts["size"] > match["max_size"]:
+        return False
+    if "model" in match and not fnmatch(facts["model"] or "", match["model"]):
+        return False
+    if "rotational" in match and facts["rotational"] != match["rotational"]:
+        return False
+    if "transport" in match:
+        transports = match["transport"]
+        if isinstance(transports, str):
+            transports = [transports]
+        if facts["transport"] not in transports:
+            return False
+    return True
+
+
+def _head_and_tail(facts: dict, options: dict) -> list[tuple[int, int]]:
+    size = min(options.get("size", DEFAULT_HEAD_TAIL_SIZE), facts["size"] // 2)
+    assert size > 0
+    return [(0, size), (facts["size"] - size, facts["size"])]
+
+
+def _step_identify(device: Path, *, facts: dict, options: dict) -> dict:
+    return facts
+
+
+def _step_scan_signatures(device: Path, *, facts: dict, options: dict) -> list:
+    return [
+        {"name": _.name, "start": _.start, "end": _.end}
+        for _ in find_signatures(device, device_size=facts["size"])
+    ]
+
+
+def _step_scan_map(device: Path, *, facts: dict, options: dict) -> dict:
+    return scan_map(device, stride=options.get("stride", 64))["totals"]
+
+
+def _step_read_scan(device: Path, *, facts: dict, options: dict) -> dict:
+    result = read_scan(device, stripe_every=options.get("stripe_every", 16))
+    if result["errors"]:
+        raise OSError(f"{len(result['errors'])} read errors: {result['errors'][:4]}")
+    return {key: result[key] for key in ("bytes_read", "mb_s", "slow")}
+
+
+def _step_backup(device: Path, *, facts: dict, options: dict) -> str:
+    archive_dir = Path(options.get("archive_dir", "."))
+    archive = archive_dir / f"{device.name}.{facts['serial'] or 'noserial'}.{time.time()}.dta"
+    write_archive(
+        archive,
+        ranges=[(device, start, end) for start, end in _head_and_tail(facts, options)],
+        note=options.get("note"),
+    )
+    return archive.as_posix()
+
+
+def _step_wipe(device: Path, *, facts: dict, options: dict) -> dict:
+    flusher = Flusher(options.get("durability", "end"))
+    for start, end in _head_and_tail(facts, options):
+        asyncio.run(
+            aio.destroy_range(
+                device,
+                start=start,
+                end=end,
+                source=options.get("source", "zero"),
+                no_backup=True,
+                flusher=flusher,
+            )
+        )
+    return flusher.stats
+
+
+def _step_verify(device: Path, *, facts: dict, options: dict) -> str:
+    # a wipe is verified by reading back what it should have left behind
+    expected = "zero" if options.get("source", "zero") == "zero" else "high-entropy"
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        with get_buffer_pool().borrow(SCAN_BLOCK_SIZE) as buf:
+            for start, end in _head_and_tail(facts, options):
+                for offset in range(start, end, SCAN_BLOCK_SIZE):
+                    view = buf[: min(SCAN_BLOCK_SIZE, end - offset)]
+                    pread_into(fd, view, offset)
+                    if classify_block(view) != expected:
+                        raise ValueError(f"{device} block at {offset} is not {expected}")
+    finally:
+        os.close(fd)
+    return expected
+
+
+def _step_layout(device: Path, *, facts: dict, options: dict) -> str:
+    table = options.get("table", "gpt")
+    assert table in ("gpt", "msdos"), f"table must be gpt or msdos, not {table!r}"
+    TracedCommand(hs.Command("parted"))(device.as_posix(), "--script", "--", "mklabel", table)
+    return table
+
+
+STEPS: dict[str, Callable] = {
+    "identify": _step_identify,
+    "scan-signatures": _step_scan_signatures,
+    "scan-map": _step_scan_map,
+    "read-scan": _step_read_scan,
+    "backup": _step_backup,
+    "wipe": _step_wipe,
+    "verify": _step_verify,
+    "layout": _step_layout,
+}
+
+
+def load_rules(rules_file: Path) -> list[dict]:
+    rules = json.loads(Path(rules_file).read_text())
+    assert isinstance(rules, list), f"{rules_file} must hold a list of rules"
+    for rule in rules:
+        unknown = [_ for _ in rule.get("pipeline", ()) if _ not in STEPS]
+        if unknown:
+            raise ValueError(
+                f"rule {rule.get('name')!r} has unknown steps {unknown}, expected {sorted(STEPS)}"
+            )
+    return rules
+
+
+_print_lock = threading.Lock()
+
+
+def _print_event(event: dict) -> None:
+    line = json.dumps(event, default=str)
+    with _print_lock:
+        print(line, flush=True)
+
+
+class Watcher:
+    # each added disk that matches a rule runs its pipeline on one of
+    # max_workers threads; a disk is never queued twice at the same time
+    def __init__(
+        self,
+        *,
+        rules: list[dict],
+        max_workers: int = 4,
+        force: bool = False,
+        emit: Callable[[dict], None] = _print_event,
+    ) -> None:
+        assert max_workers > 0
+        for rule in rules:
+            destructive = [_ for _ in rule.get("pipeline", ()) if _ in DESTRUCTIVE_STEPS]
+            if destructive and not force:
+                raise ValueError(
+                    f"rule {rule.get('name')!r} runs {destructive}, watch cannot prompt, pass force"
+                )
+        self.rules = rules
+        self.emit = emit
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="devicetool-watch",
+        )
+        self.lock = threading.Lock()
+        self.active: set[Path] = set()
+        self.futures: list[Future] = []
+
+    def handle(self, event: DeviceEvent) -> None | Future:
+        if event.action != "add":
+            return None
+        device = event.device
+        reason = refused_reason(device)
+        if reason is not None:
+            self.emit({"event": "refused", "device": device, "reason": reason})
+            return None
+        if not event.synthetic:
+            deadline = time.monotonic() + DEVICE_NODE_TIMEOUT
+            # the kernel event can arrive before udev creates the node
+            while not device.exists() and time.monotonic() < deadline:
+                time.sleep(0.1)
+        with self.lock:
+            if device.resolve() in self.active:
+                return None
+            self.active.add(device.resolve())
+        try:
+            facts = get_block_device_facts(device)
+            rule = next((_ for _ in self.rules if rule_matches(_, facts)), None)
+        except BaseException:
+            self._release(device)
+            raise
+        if rule is None:
+            self._release(device)
+            self.emit({"event": "ignored", "device": device, "facts": facts})
+            return None
+        self.emit({"event": "queued", "device": device, "rule": rule.get("name"), "facts": facts})
+        future = self.executor.submit(self._run, device, rule, facts)
+        future.add_done_callback(lambda _: self._release(device))
+        self.futures.append(future)
+        return future
+
+    def _release(self, device: Path) -> None:
+        with self.lock:
+            self.active.discard(device.resolve())
+
+    def _run(self, device: Path, rule: dict, facts: dict) -> bool:
+        options = rule.get("options", {})
+        try:
+            assert device_is_not_a_partition(device=device)
+            assert device_is_block_special_or_image(device=device)
+            assert device_is_not_in_use(device=device, refresh=True)
+            for step in rule.get("pipeline", ()):
+                self.emit({"event": "step", "device": device, "step": step})
+                started = time.monotonic()
+                result = STEPS[step](device, facts=facts, options=options)
+                self.emit(
+                    {
+                        "event": "step-done",
+                        "device": device,
+                        "step": step,
+                        "seconds": round(time.monotonic() - started, 6),
+                        "result": result,
+                    }
+                )
+        except Exception as exc:
+            self.emit(
+                {
+                    "event": "failed",
+                    "device": device,
+                    "error": f"{type(exc).__name__}: {exc}",
+                }
+            )
+            return False
+        self.emit({"event": "done", "device": device})
+        return True
+
+    def run(self, events: Iterable[DeviceEvent]) -> None:
+        for event in events:
+            try:
+                self.handle(event)
+            except Exception as exc:
+                self.emit(
+                    {
+                        "event": "failed",
+                        "device": event.device,
+                        "error": f"{type(exc).__name__}: {exc}",
+                    }
+                )
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
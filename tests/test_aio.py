@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import stat
+import threading
+import time
+
+import pytest
+
+from devicetool import aio
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "disk.img"
+    path.write_bytes(os.urandom(4 * MiB))
+    return path
+
+
+def test_backup_destroy_compare_round_trip(image, tmp_path):
+    original = image.read_bytes()
+    start, end = 4096, 3 * MiB + 100
+
+    async def _run():
+        backup_file = await aio.destroy_range(
+            image,
+            start=start,
+            end=end,
+            source="urandom",
+            backup_dir=tmp_path,
+            catalog_dir=tmp_path / "catalog",
+            chunk_size=MiB,
+            queue_depth=4,
+        )
+        differing = await aio.compare(
+            image,
+            backup_file=backup_file,
+            start=start,
+            end=end,
+            catalog_dir=tmp_path / "catalog",
+            chunk_size=MiB,
+            queue_depth=4,
+        )
+        return backup_file, differing
+
+    backup_file, differing = asyncio.run(_run())
+    assert backup_file.read_bytes() == original[start:end]
+    assert stat.S_IMODE(backup_file.stat().st_mode) == 0o600
+    wiped = image.read_bytes()
+    assert wiped[:start] == original[:start]
+    assert wiped[end:] == original[end:]
+    assert differing == [(start, end)]
+
+
+def test_failed_backup_leaves_no_partial_file(image, tmp_path):
+    backup_dir = tmp_path / "backups"
+    backup_dir.mkdir()
+    with pytest.raises(EOFError):
+        asyncio.run(
+            aio.backup(
+                image,
+                start=0,
+                end=8 * MiB,
+                backup_dir=backup_dir,
+                no_catalog=True,
+                chunk_size=MiB,
+                queue_depth=2,
+            )
+        )
+    assert list(backup_dir.iterdir()) == []
+
+
+def test_drive_drains_workers_after_a_failure():
+    running = 0
+    started = []
+    lock = threading.Lock()
+
+    def _operation(offset, length):
+        nonlocal running
+        with lock:
+            running += 1
+            started.append(offset)
+        try:
+            if offset == 2:
+                raise OSError(5, "injected")
+            time.sleep(0.2)
+        finally:
+            with lock:
+                running -= 1
+
+    async def _run():
+        with pytest.raises(OSError, match="injected"):
+            await aio._drive(
+                ((_, 1) for _ in range(100)),
+                operation=_operation,
+                queue_depth=4,
+                executor=None,
+            )
+        # every call that was handed out has finished before _drive raised
+        assert running == 0
+
+    asyncio.run(_run())
+    assert len(started) < 100
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import os
+
+import pytest
+
+from devicetool.archive import MEMBER_IOVECS
+from devicetool.archive import extract_member
+from devicetool.archive import find_archive_members
+from devicetool.archive import read_archive_index
+from devicetool.archive import write_archive
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for name in ("a.img", "b.img"):
+        path = tmp_path / name
+        path.write_bytes(os.urandom(2 * MiB))
+        paths.append(path)
+    return paths
+
+
+def test_write_and_extract_round_trip(images, tmp_path):
+    a, b = images
+    archive = tmp_path / "backup.dta"
+    ranges = [(a, 0, 4096), (a, MiB, 2 * MiB), (b, 100, MiB + 100)]
+    write_archive(archive, ranges=ranges, note="test", chunk_size=65536)
+    index = read_archive_index(archive)
+    assert index["note"] == "test"
+    assert len(index["members"]) == 3
+    for device, start, end in ranges:
+        (member,) = find_archive_members(index, device=device, start=start, end=end)
+        output = tmp_path / f"{device.name}.{start}"
+        extract_member(archive, member=member, output=output, chunk_size=65536)
+        assert output.read_bytes() == device.read_bytes()[start:end]
+
+
+def test_corrupt_member_is_rejected(images, tmp_path):
+    a, _ = images
+    archive = tmp_path / "backup.dta"
+    write_archive(archive, ranges=[(a, 0, MiB)])
+    (member,) = read_archive_index(archive)["members"]
+    with open(archive, "r+b") as fh:
+        fh.seek(member["offset"] + 10)
+        byte = fh.read(1)
+        fh.seek(member["offset"] + 10)
+        fh.write(bytes([byte[0] ^ 0xFF]))
+    output = tmp_path / "out"
+    with pytest.raises(ValueError, match="sha256"):
+        extract_member(archive, member=member, output=output)
+    assert not output.exists()
+
+
+def test_unfinished_archive_is_rejected(images, tmp_path):
+    a, _ = images
+    archive = tmp_path / "backup.dta"
+    write_archive(archive, ranges=[(a, 0, 4096)])
+    os.truncate(archive, archive.stat().st_size - 1)
+    with pytest.raises(ValueError):
+        read_archive_index(archive)
+
+
+def test_range_past_the_device_is_refused(images, tmp_path):
+    a, _ = images
+    archive = tmp_path / "backup.dta"
+    with pytest.raises(AssertionError):
+        write_archive(archive, ranges=[(a, 0, 3 * MiB)])
+    assert not archive.exists()
+
+
+def test_members_are_read_vectored(images, tmp_path, monkeypatch):
+    a, _ = images
+    preadv = os.preadv
+    calls = []
+
+    def _preadv(fd, buffers, offset):
+        calls.append(len(buffers))
+        return preadv(fd, buffers, offset)
+
+    monkeypatch.setattr(os, "preadv", _preadv)
+    archive = tmp_path / "backup.dta"
+    write_archive(archive, ranges=[(a, 4096, 2 * MiB)], chunk_size=65536)
+    # 2 MiB - 4 KiB in 64 KiB chunks, MEMBER_IOVECS of them per syscall
+    assert calls[0] == MEMBER_IOVECS
+    assert len(calls) == -(-(2 * MiB - 4096) // (65536 * MEMBER_IOVECS))
+    (member,) = read_archive_index(archive)["members"]
+    output = tmp_path / "a.out"
+    extract_member(archive, member=member, output=output)
+    assert output.read_bytes() == a.read_bytes()[4096:]
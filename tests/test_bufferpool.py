@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+import threading
+import time
+
+import pytest
+
+from devicetool import bufferpool
+from devicetool.bufferpool import MIN_BUFFER_BUDGET
+from devicetool.bufferpool import BufferPool
+from devicetool.bufferpool import get_buffer_pool
+from devicetool.bufferpool import set_buffer_budget
+from devicetool.clone import clone_device
+from devicetool.consistency import compare_devices
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def small_budget(monkeypatch):
+    monkeypatch.setattr(bufferpool, "_buffer_pool", None)
+    return set_buffer_budget(MIN_BUFFER_BUDGET)
+
+
+def test_budget_below_minimum_is_refused():
+    with pytest.raises(AssertionError):
+        BufferPool(budget=MIN_BUFFER_BUDGET - 1)
+
+
+def test_fit_keeps_sizes_within_budget():
+    pool = BufferPool(budget=4 * MiB)
+    assert pool.fit(MiB) == MiB
+    assert pool.fit(8 * MiB) == 4 * MiB
+    assert pool.fit(4 * MiB, 3) == 4 * MiB // 3 // mmap.PAGESIZE * mmap.PAGESIZE
+    assert pool.fit(4 * MiB, 3, align=MiB) == MiB
+    with pytest.raises(AssertionError):
+        pool.fit(4 * MiB, 5, align=MiB)
+
+
+def test_borrow_many_returns_aligned_views():
+    pool = BufferPool(budget=4 * MiB)
+    with pool.borrow_many(5000, 3) as views:
+        assert [len(_) for _ in views] == [5000] * 3
+        views[0][:] = b"\xff" * 5000
+        assert bytes(views[1]) == b"\x00" * 5000
+    stats = pool.stats
+    assert stats["borrows"] == 3
+    assert stats["in_use"] == 0
+    assert stats["allocated"] == 3 * -(-5000 // mmap.PAGESIZE) * mmap.PAGESIZE
+
+
+def test_borrow_reuses_idle_buffers():
+    pool = BufferPool(budget=4 * MiB)
+    for _ in range(3):
+        with pool.borrow(MiB):
+            pass
+    assert pool.stats["allocations"] == 1
+    assert pool.stats["borrows"] == 3
+
+
+def test_borrow_waits_for_budget():
+    pool = BufferPool(budget=2 * MiB)
+    held = threading.Event()
+    order = []
+
+    def hold():
+        with pool.borrow_many(MiB, 2):
+            held.set()
+            time.sleep(0.2)
+            order.append("released")
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    held.wait()
+    with pool.borrow(MiB):
+        order.append("borrowed")
+    thread.join()
+    assert order == ["released", "borrowed"]
+    assert pool.stats["waits"] >= 1
+    assert pool.stats["peak_in_use"] == 2 * MiB
+
+
+def test_idle_buffers_of_other_sizes_are_evicted():
+    pool = BufferPool(budget=2 * MiB)
+    with pool.borrow_many(MiB // 2, 4):
+        pass
+    with pool.borrow(2 * MiB):
+        pass
+    stats = pool.stats
+    assert stats["allocated"] == 2 * MiB
+    assert stats["waits"] == 0
+
+
+def test_get_buffer_pool_is_shared_across_threads(monkeypatch):
+    monkeypatch.setattr(bufferpool, "_buffer_pool", None)
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(get_buffer_pool())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(_) for _ in pools}) == 1
+
+
+def test_compare_devices_under_small_budget(small_budget, tmp_path):
+    data = os.urandom(2 * MiB)
+    images = []
+    for name in ("a.img", "b.img", "c.img"):
+        path = tmp_path / name
+        path.write_bytes(data)
+        images.append(path)
+    result = compare_devices(images, ranges=[(0, 2 * MiB)], chunk_size=MiB)
+    assert result["identical"]
+    assert small_budget.stats["peak_in_use"] <= MIN_BUFFER_BUDGET
+
+
+def test_clone_under_small_budget(small_budget, tmp_path):
+    source = tmp_path / "source.img"
+    target = tmp_path / "target.img"
+    data = os.urandom(3 * MiB)
+    source.write_bytes(data)
+    target.write_bytes(b"\x00" * len(data))
+    clone_device(source, target, chunk_size=4 * MiB, queue_depth=3)
+    assert target.read_bytes() == data
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+import os
+import time
+
+import pytest
+from click.testing import CliRunner
+
+from devicetool.catalog import find_backup
+from devicetool.catalog import latest_backup
+from devicetool.catalog import list_backups
+from devicetool.catalog import record_backup
+from devicetool.cli import cli
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def image(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / "disk.img"
+    path.write_bytes(os.urandom(4 * MiB))
+    return path
+
+
+def _backup(image, *, start, end, catalog_dir, note=None):
+    backup_file = image.parent / f"disk_{start}_{end}_{time.monotonic_ns()}.bak"
+    with open(image, "rb") as fh:
+        fh.seek(start)
+        backup_file.write_bytes(fh.read(end - start))
+    return record_backup(
+        backup_file=backup_file,
+        device=image,
+        start=start,
+        end=end,
+        note=note,
+        catalog_dir=catalog_dir,
+    )
+
+
+def test_record_and_find(image, tmp_path):
+    catalog_dir = tmp_path / "catalog"
+    entry = _backup(image, start=0, end=MiB, catalog_dir=catalog_dir)
+    found = find_backup(backup_file=entry["path"], catalog_dir=catalog_dir)
+    assert found["sha256"] == entry["sha256"]
+    assert found["device_size"] == 4 * MiB
+    assert (found["start"], found["end"]) == (0, MiB)
+
+
+def test_device_path_is_stored_resolved(image, tmp_path, monkeypatch):
+    catalog_dir = tmp_path / "catalog"
+    entry = record_backup(
+        backup_file=_backup(image, start=0, end=4096, catalog_dir=catalog_dir)["path"],
+        device="disk.img",
+        start=0,
+        end=4096,
+        note=None,
+        catalog_dir=catalog_dir,
+    )
+    assert entry["device"] == image.resolve().as_posix()
+    alias = tmp_path / "by-id-alias"
+    alias.symlink_to(image)
+    elsewhere = tmp_path / "elsewhere"
+    elsewhere.mkdir()
+    monkeypatch.chdir(elsewhere)
+    assert latest_backup(device=alias, catalog_dir=catalog_dir)["path"] == entry["path"]
+    assert latest_backup(device="../disk.img", catalog_dir=catalog_dir)["path"] == entry["path"]
+
+
+def test_latest_backup_by_region(image, tmp_path):
+    catalog_dir = tmp_path / "catalog"
+    _backup(image, start=0, end=MiB, catalog_dir=catalog_dir)
+    tail = _backup(image, start=3 * MiB, end=4 * MiB, catalog_dir=catalog_dir)
+    head = _backup(image, start=0, end=MiB, catalog_dir=catalog_dir)
+    assert len(list_backups(device=image, catalog_dir=catalog_dir)) == 3
+    latest_head = latest_backup(device=image, region="head", catalog_dir=catalog_dir)
+    latest_tail = latest_backup(device=image, region="tail", catalog_dir=catalog_dir)
+    assert latest_head["path"] == head["path"]
+    assert latest_tail["path"] == tail["path"]
+    assert latest_backup(device=image, start=MiB, catalog_dir=catalog_dir) is None
+
+
+def _restore(*args):
+    return CliRunner().invoke(cli, ["restore-byte-range", *args])
+
+
+def test_restore_writes_the_latest_backup_back(image, tmp_path):
+    catalog_dir = tmp_path / "catalog"
+    original = image.read_bytes()
+    _backup(image, start=0, end=MiB, catalog_dir=catalog_dir)
+    with open(image, "r+b") as fh:
+        fh.write(bytes(MiB))
+    result = _restore(
+        "--device",
+        image.as_posix(),
+        "--region",
+        "head",
+        "--catalog-dir",
+        catalog_dir.as_posix(),
+        "--force",
+    )
+    assert result.exit_code == 0, result.output
+    assert image.read_bytes() == original
+    # the prerestore copy exists but is not what the catalog picks next
+    assert list(tmp_path.glob("_backup_prerestore_*"))
+    assert len(list_backups(device=image, catalog_dir=catalog_dir)) == 1
+
+
+def test_restore_refuses_a_device_of_another_size(image, tmp_path):
+    catalog_dir = tmp_path / "catalog"
+    entry = _backup(image, start=0, end=MiB, catalog_dir=catalog_dir)
+    os.truncate(image, 8 * MiB)
+    before = image.read_bytes()
+    result = _restore(
+        "--device",
+        image.as_posix(),
+        "--backup-file",
+        entry["path"],
+        "--catalog-dir",
+        catalog_dir.as_posix(),
+        "--force",
+        "--no-backup",
+    )
+    assert isinstance(result.exception, AssertionError)
+    assert image.read_bytes() == before
+
+
+def test_restore_refuses_a_modified_backup(image, tmp_path):
+    catalog_dir = tmp_path / "catalog"
+    entry = _backup(image, start=0, end=MiB, catalog_dir=catalog_dir)
+    with open(entry["path"], "r+b") as fh:
+        fh.write(b"\xff" * 16)
+    with open(image, "r+b") as fh:
+        fh.write(bytes(MiB))
+    before = image.read_bytes()
+    result = _restore(
+        "--device",
+        image.as_posix(),
+        "--backup-file",
+        entry["path"],
+        "--catalog-dir",
+        catalog_dir.as_posix(),
+        "--force",
+        "--no-backup",
+    )
+    assert isinstance(result.exception, AssertionError)
+    assert "sha256" in str(result.exception)
+    assert image.read_bytes() == before
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from devicetool.cli import cli
+
+
+@pytest.mark.parametrize("name", sorted(cli.commands))
+def test_durability_options_come_as_a_set(name):
+    options = {_.name for _ in cli.commands[name].params}
+    assert ("durability" in options) == ("flush_bytes" in options)
+
+
+@pytest.mark.parametrize(
+    "name",
+    ["write-mbr", "write-efi-partition", "write-grub-bios-partition"],
+)
+def test_partition_writers_take_durability_options(name):
+    options = {_.name for _ in cli.commands[name].params}
+    assert {"durability", "flush_bytes"} <= options
+
+
+def test_destroy_block_device_refuses_an_empty_image(tmp_path):
+    image = tmp_path / "empty.img"
+    image.touch()
+    result = CliRunner().invoke(cli, ["destroy-block-device", image.as_posix(), "--force"])
+    assert result.exit_code == 1
+    assert f"{image} is empty" in result.output
+    assert not isinstance(result.exception, AssertionError)
+
+
+def test_destroy_block_device_zeroes_an_image(tmp_path):
+    image = tmp_path / "disk.img"
+    image.write_bytes(os.urandom(1024 * 1024))
+    result = CliRunner().invoke(cli, ["destroy-block-device", image.as_posix(), "--force"])
+    assert result.exit_code == 0, result.output
+    assert image.read_bytes() == bytes(1024 * 1024)
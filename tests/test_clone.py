@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import errno
+import json
+import os
+
+import pytest
+
+from devicetool import clone
+from devicetool.clone import clone_device
+from devicetool.clone import verify_clone
+
+MiB = 1024 * 1024
+
+
+@pytest.fixture
+def images(tmp_path):
+    # data in the first and seventh MiB, holes everywhere else
+    source = tmp_path / "source.img"
+    with open(source, "wb") as fh:
+        fh.truncate(8 * MiB)
+        fh.write(os.urandom(MiB))
+        fh.seek(6 * MiB)
+        fh.write(os.urandom(MiB))
+    target = tmp_path / "target.img"
+    with open(target, "wb") as fh:
+        fh.truncate(8 * MiB)
+    return source, target
+
+
+def _fail_once_at(monkeypatch, failing_offset):
+    pread_into = clone.pread_into
+    failed = []
+
+    def _pread_into(fd, buf, offset):
+        if offset == failing_offset and not failed:
+            failed.append(offset)
+            raise OSError(errno.EIO, os.strerror(errno.EIO))
+        return pread_into(fd, buf, offset)
+
+    monkeypatch.setattr(clone, "pread_into", _pread_into)
+    return failed
+
+
+def test_resume_after_eio(images, tmp_path, monkeypatch):
+    source, target = images
+    checkpoint = tmp_path / "clone.checkpoint"
+    failed = _fail_once_at(monkeypatch, 4 * MiB)
+    with pytest.raises(OSError) as excinfo:
+        clone_device(source, target, chunk_size=MiB, queue_depth=1, checkpoint=checkpoint)
+    assert excinfo.value.errno == errno.EIO
+    assert failed == [4 * MiB]
+    assert json.loads(checkpoint.read_text())["done"] == 4 * MiB
+
+    stats = clone_device(source, target, chunk_size=MiB, queue_depth=1, checkpoint=checkpoint)
+    assert stats["resumed_from"] == 4 * MiB
+    assert stats["copied"] == MiB
+    assert stats["zero"] == 3 * MiB
+    assert target.read_bytes() == source.read_bytes()
+    assert not checkpoint.exists()
+    # the zero chunks were skipped, only the two data MiB are allocated
+    assert target.stat().st_blocks * 512 <= 2 * MiB + 64 * 1024
+
+
+def test_rerun_after_success_copies_again(images, tmp_path):
+    source, target = images
+    checkpoint = tmp_path / "clone.checkpoint"
+    clone_device(source, target, chunk_size=MiB, queue_depth=2, checkpoint=checkpoint)
+    with open(source, "r+b") as fh:
+        fh.seek(3 * MiB)
+        fh.write(b"\xff" * 4096)
+    stats = clone_device(source, target, chunk_size=MiB, queue_depth=2, checkpoint=checkpoint)
+    assert stats["resumed_from"] == 0
+    assert target.read_bytes() == source.read_bytes()
+
+
+def test_checkpoint_of_another_clone_is_refused(images, tmp_path):
+    source, target = images
+    checkpoint = tmp_path / "clone.checkpoint"
+    checkpoint.write_text(json.dumps({"source": "/dev/other", "done": MiB}))
+    with pytest.raises(ValueError, match="different clone"):
+        clone_device(source, target, chunk_size=MiB, queue_depth=1, checkpoint=checkpoint)
+
+
+def test_verify_clone(images):
+    source, target = images
+    clone_device(source, target, chunk_size=MiB, queue_depth=2)
+    result = verify_clone(source, target, length=8 * MiB, chunk_size=MiB)
+    assert result["verified"]
+    assert result["source_sha256"] == result["target_sha256"]
+    with open(target, "r+b") as fh:
+        fh.seek(7 * MiB)
+        fh.write(b"\x01")
+    assert not verify_clone(source, target, length=8 * MiB, chunk_size=MiB)["verified"]
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import os
+
+import pytest
+
+from devicetool import bufferpool
+from devicetool.bufferpool import MIN_BUFFER_BUDGET
+from devicetool.bufferpool import set_buffer_budget
+from devicetool.consistency import _divergent_members
+from devicetool.consistency import compare_devices
+
+MiB = 1024 * 1024
+
+
+def test_divergent_members_all_equal():
+    assert _divergent_members([b"a", b"a", b"a"]) == []
+
+
+def test_divergent_members_majority_wins():
+    assert _divergent_members([b"a", b"b", b"a"]) == [1]
+    assert _divergent_members([b"a", b"b", b"c", b"a", b"a"]) == [1, 2]
+
+
+def test_divergent_members_tie_reports_everyone():
+    assert _divergent_members([b"a", b"b"]) == [0, 1]
+    assert _divergent_members([b"a", b"a", b"b", b"b"]) == [0, 1, 2, 3]
+
+
+def test_compare_devices_finds_the_odd_member(tmp_path):
+    data = os.urandom(2 * MiB)
+    images = []
+    for name in ("a.img", "b.img", "c.img"):
+        path = tmp_path / name
+        path.write_bytes(data)
+        images.append(path)
+    with open(images[1], "r+b") as fh:
+        fh.seek(MiB + 5000)
+        fh.write(b"\xff" * 10)
+    result = compare_devices(images, ranges=[(0, 2 * MiB)], chunk_size=65536)
+    assert not result["identical"]
+    assert result["divergent"] == {images[1].as_posix(): [(MiB + 4096, MiB + 8192)]}
+
+
+def _images(tmp_path, count, data):
+    images = []
+    for index in range(count):
+        path = tmp_path / f"{index}.img"
+        path.write_bytes(data)
+        images.append(path)
+    return images
+
+
+def test_many_devices_shrink_the_chunk_to_the_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(bufferpool, "_buffer_pool", None)
+    pool = set_buffer_budget(MIN_BUFFER_BUDGET)
+    images = _images(tmp_path, 12, os.urandom(MiB))
+    result = compare_devices(images, ranges=[(0, MiB)], chunk_size=MiB)
+    assert result["identical"]
+    assert result["bytes_compared"] == MiB
+    assert pool.stats["peak_in_use"] <= MIN_BUFFER_BUDGET
+
+
+def test_too_many_devices_for_the_budget(tmp_path, monkeypatch):
+    monkeypatch.setattr(bufferpool, "_buffer_pool", None)
+    set_buffer_budget(MIN_BUFFER_BUDGET)
+    images = _images(tmp_path, 20, bytes(MiB))
+    with pytest.raises(ValueError, match="buffer budget"):
+        compare_devices(images, ranges=[(0, MiB)], chunk_size=MiB, block_size=65536)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+import asyncio
+import os
+import threading
+import time
+
+import pytest
+
+from devicetool import aio
+
+from devicetool.daemon import DeviceToolDaemon
+from devicetool.daemon import submit_job
+
+MiB = 1024 * 1024
+
+
+def _run_jobs(
+    daemon: DeviceToolDaemon,
+    jobs: list[dict],
+    *,
+    concurrently: bool = False,
+) -> list[list[dict]]:
+    # the server runs on this thread's loop, the client blocks in a thread
+    async def _main() -> list[list[dict]]:
+        server = asyncio.create_task(daemon.serve_forever())
+        while not daemon.socket_path.exists():
+            await asyncio.sleep(0.01)
+        clients = [
+            asyncio.to_thread(
+                lambda job=job: list(submit_job(job, socket_path=daemon.socket_path))
+            )
+            for job in jobs
+        ]
+        try:
+            if concurrently:
+                return list(await asyncio.gather(*clients))
+            return [await _ for _ in clients]
+        finally:
+            server.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await server
+
+    return asyncio.run(_main())
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    return DeviceToolDaemon(
+        socket_path=tmp_path / "devicetool.sock",
+        queue_depth=4,
+        chunk_size=MiB,
+        backup_dir=tmp_path,
+        catalog_dir=tmp_path / "catalog",
+    )
+
+
+def test_backup_and_wipe_an_image(daemon, tmp_path):
+    image = tmp_path / "disk.img"
+    original = os.urandom(4 * MiB)
+    image.write_bytes(original)
+    backup_events, wipe_events = _run_jobs(
+        daemon,
+        [
+            {"op": "backup", "device": image.as_posix(), "start": 0, "end": MiB},
+            {
+                "op": "destroy-range",
+                "device": image.as_posix(),
+                "start": MiB,
+                "end": 3 * MiB,
+                "source": "zero",
+                "no_backup": True,
+                "force": True,
+            },
+        ],
+    )
+    assert [_["event"] for _ in backup_events][:2] == ["queued", "started"]
+    assert backup_events[-1]["event"] == "done"
+    with open(backup_events[-1]["result"], "rb") as fh:
+        assert fh.read() == original[:MiB]
+    assert wipe_events[-1]["event"] == "done"
+    assert any(_["event"] == "flushed" for _ in wipe_events)
+    wiped = image.read_bytes()
+    assert wiped[:MiB] == original[:MiB]
+    assert wiped[MiB : 3 * MiB] == bytes(2 * MiB)
+    assert wiped[3 * MiB :] == original[3 * MiB :]
+
+
+def test_destructive_job_needs_force(daemon, tmp_path):
+    image = tmp_path / "disk.img"
+    image.write_bytes(os.urandom(MiB))
+    (events,) = _run_jobs(
+        daemon,
+        [{"op": "destroy-full", "device": image.as_posix(), "source": "zero"}],
+    )
+    assert events[-1]["event"] == "error"
+    assert "requires force" in events[-1]["error"]
+    assert image.read_bytes() != bytes(MiB)
+
+
+def test_failed_job_drains_before_another_job_continues(daemon, tmp_path, monkeypatch):
+    failing = tmp_path / "failing.img"
+    failing_data = os.urandom(8 * MiB)
+    failing.write_bytes(failing_data)
+    other = tmp_path / "other.img"
+    other_data = os.urandom(8 * MiB)
+    other.write_bytes(other_data)
+    lock = threading.Lock()
+    calls = 0
+    active = 0
+    drained = []
+    fill_from_source = aio.fill_from_source
+    destroy_range = aio.destroy_range
+
+    def _fill(buf, source):
+        nonlocal calls, active
+        with lock:
+            calls += 1
+            call = calls
+            active += 1
+        try:
+            time.sleep(0.05)
+            if call == 3:
+                raise OSError(5, "injected")
+            fill_from_source(buf, source)
+        finally:
+            with lock:
+                active -= 1
+
+    async def _destroy_range(*args, **kwargs):
+        try:
+            return await destroy_range(*args, **kwargs)
+        finally:
+            drained.append(active)
+
+    monkeypatch.setattr(aio, "fill_from_source", _fill)
+    monkeypatch.setattr(aio, "destroy_range", _destroy_range)
+    failed_events, backup_events = _run_jobs(
+        daemon,
+        [
+            {
+                "op": "destroy-range",
+                "device": failing.as_posix(),
+                "start": 0,
+                "end": 8 * MiB,
+                "source": "urandom",
+                "no_backup": True,
+                "force": True,
+            },
+            {"op": "backup", "device": other.as_posix(), "start": 0, "end": 8 * MiB},
+        ],
+        concurrently=True,
+    )
+    assert failed_events[-1]["event"] == "error"
+    assert "injected" in failed_events[-1]["error"]
+    # no wipe of the failed job was still running when it gave up its fds
+    assert drained == [0]
+    assert calls < 8
+    assert backup_events[-1]["event"] == "done"
+    with open(backup_events[-1]["result"], "rb") as fh:
+        assert fh.read() == other_data
+    assert other.read_bytes() == other_data
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+import errno
+import hashlib
+import os
+import time
+
+import pytest
+
+from devicetool import rangeio
+from devicetool.rangeio import Flusher
+from devicetool.rangeio import backup_then_wipe_range
+from devicetool.rangeio import copy_range
+from devicetool.rangeio import is_all_zero
+from devicetool.rangeio import iter_chunks
+from devicetool.rangeio import merge_extents
+from devicetool.rangeio import preadv_into
+from devicetool.rangeio import pwritev_all
+from devicetool.rangeio import zero_bytes
+from devicetool.rangeio import zero_range_sparse
+
+MiB = 1024 * 1024
+
+
+def test_iter_chunks_covers_range_with_short_tail():
+    assert list(iter_chunks(start=10, end=35, chunk_size=10)) == [(10, 10), (20, 10), (30, 5)]
+
+
+def test_iter_chunks_single_short_chunk():
+    assert list(iter_chunks(start=0, end=3, chunk_size=10)) == [(0, 3)]
+
+
+def test_merge_extents_joins_overlapping_and_touching():
+    assert merge_extents([(20, 30), (0, 10), (10, 15), (25, 40), (50, 60)]) == [
+        (0, 15),
+        (20, 40),
+        (50, 60),
+    ]
+
+
+def test_merge_extents_empty():
+    assert merge_extents([]) == []
+
+
+def test_zero_bytes_shares_one_buffer():
+    assert zero_bytes(8192).obj is zero_bytes(100).obj
+    assert zero_bytes(100).tobytes() == bytes(100)
+
+
+def test_is_all_zero():
+    buf = bytearray(4096)
+    assert is_all_zero(memoryview(buf))
+    buf[-1] = 1
+    assert not is_all_zero(memoryview(buf))
+    assert is_all_zero(memoryview(bytes(10)))
+
+
+def test_zero_range_sparse_keeps_the_edges(tmp_path):
+    image = tmp_path / "disk.img"
+    original = os.urandom(MiB)
+    image.write_bytes(original)
+    start, end = 1000, 700000
+    fd = os.open(image, os.O_RDWR)
+    try:
+        stats = zero_range_sparse(fd, start=start, end=end, chunk_size=65536)
+    finally:
+        os.close(fd)
+    data = image.read_bytes()
+    assert data[:start] == original[:start]
+    assert data[start:end] == bytes(end - start)
+    assert data[end:] == original[end:]
+    assert stats["punched"] + stats["written"] + stats["skipped"] == end - start
+
+
+@pytest.mark.parametrize(
+    "policy, expected",
+    [("none", 0), ("end", 1), ("bytes", 2), ("chunk", 5)],
+)
+def test_flusher_policies(tmp_path, policy, expected):
+    flusher = Flusher(policy, flush_bytes=250)
+    fd = os.open(tmp_path / "out", os.O_WRONLY | os.O_CREAT)
+    try:
+        for _ in range(5):
+            os.write(fd, bytes(100))
+            flusher.wrote(fd, 100)
+        flusher.finish(fd)
+    finally:
+        os.close(fd)
+    # "bytes" flushes at 300 written, then once more for the remaining 200
+    assert flusher.stats["flushes"] == expected
+    assert flusher.stats["policy"] == policy
+
+
+def test_flusher_end_flushes_even_without_writes(tmp_path):
+    flusher = Flusher("end")
+    fd = os.open(tmp_path / "out", os.O_WRONLY | os.O_CREAT)
+    try:
+        flusher.finish(fd)
+    finally:
+        os.close(fd)
+    assert flusher.flushes == 1
+
+
+def test_flusher_rejects_unknown_policy():
+    with pytest.raises(AssertionError):
+        Flusher("sometimes")
+
+
+@pytest.mark.parametrize("source", ["zero", "urandom"])
+def test_backup_then_wipe_range(tmp_path, source):
+    image = tmp_path / "disk.img"
+    original = os.urandom(MiB)
+    image.write_bytes(original)
+    start, end = 5000, 900000
+    dfd = os.open(image, os.O_RDWR)
+    bfd = os.open(tmp_path / "backup", os.O_WRONLY | os.O_CREAT, 0o600)
+    try:
+        result = backup_then_wipe_range(
+            dfd,
+            bfd,
+            start=start,
+            end=end,
+            source=source,
+            chunk_size=65536,
+        )
+    finally:
+        os.close(bfd)
+        os.close(dfd)
+    backup = (tmp_path / "backup").read_bytes()
+    assert backup == original[start:end]
+    assert result["sha256"] == hashlib.sha256(backup).hexdigest()
+    data = image.read_bytes()
+    assert data[:start] == original[:start]
+    assert data[end:] == original[end:]
+    if source == "zero":
+        assert data[start:end] == bytes(end - start)
+    else:
+        assert data[start:end] != original[start:end]
+
+
+def _pipeline(image, monkeypatch, *, fail_backup_sync_at=None):
+    # logs (event, offset, monotonic start, end) for backup writes, backup
+    # syncs and device writes, the device writes are slowed down
+    tmp_path = image.parent
+    dfd = os.open(image, os.O_RDWR)
+    bfd = os.open(tmp_path / "backup", os.O_WRONLY | os.O_CREAT, 0o600)
+    events = []
+    last_backup = []
+    pwrite_all = rangeio.pwrite_all
+    fdatasync = os.fdatasync
+
+    def _pwrite_all(fd, view, offset):
+        started = time.monotonic()
+        if fd == dfd:
+            time.sleep(0.02)
+        pwrite_all(fd, view, offset)
+        if fd == bfd:
+            last_backup[:] = [offset]
+        events.append(("device" if fd == dfd else "backup", offset, started, time.monotonic()))
+
+    def _fdatasync(fd):
+        if fd == bfd:
+            if last_backup == [fail_backup_sync_at]:
+                raise OSError(errno.EIO, os.strerror(errno.EIO))
+            events.append(("synced", last_backup[0], time.monotonic(), time.monotonic()))
+        fdatasync(fd)
+
+    monkeypatch.setattr(rangeio, "pwrite_all", _pwrite_all)
+    monkeypatch.setattr(os, "fdatasync", _fdatasync)
+    try:
+        result = backup_then_wipe_range(
+            dfd,
+            bfd,
+            start=0,
+            end=8 * 65536,
+            source="urandom",
+            chunk_size=65536,
+        )
+    finally:
+        os.close(bfd)
+        os.close(dfd)
+    assert result["written"] == 8 * 65536
+    return events
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "disk.img"
+    path.write_bytes(os.urandom(MiB))
+    return path
+
+
+def test_backup_then_wipe_syncs_each_chunk_before_its_wipe(image, monkeypatch):
+    events = _pipeline(image, monkeypatch)
+    synced = {offset: at for event, offset, at, _ in events if event == "synced"}
+    wiped = [(offset, at) for event, offset, at, _ in events if event == "device"]
+    assert [offset for offset, _ in wiped] == [_ * 65536 for _ in range(8)]
+    for offset, at in wiped:
+        assert synced[offset] <= at
+
+
+def test_backup_then_wipe_overlaps_backup_and_device_writes(image, monkeypatch):
+    events = _pipeline(image, monkeypatch)
+    device = [(started, ended) for event, _, started, ended in events if event == "device"]
+    backup = [started for event, _, started, _ in events if event == "backup"]
+    # later chunks are backed up while earlier ones are being wiped
+    overlapping = [
+        at for at in backup if any(started <= at < ended for started, ended in device)
+    ]
+    assert overlapping
+
+
+def test_backup_then_wipe_leaves_unsynced_chunks_alone(image, monkeypatch):
+    original = image.read_bytes()
+    with pytest.raises(OSError):
+        _pipeline(image, monkeypatch, fail_backup_sync_at=3 * 65536)
+    data = image.read_bytes()
+    # chunks 0-2 were durable in the backup and may be wiped, 3 and later
+    # never reached the device
+    assert data[3 * 65536 :] == original[3 * 65536 :]
+
+
+def test_vectored_io_survives_short_transfers(tmp_path, monkeypatch):
+    # the kernel may stop anywhere, even in the middle of an iovec
+    data = os.urandom(10000)
+    path = tmp_path / "file"
+    path.write_bytes(bytes(20000))
+    preadv, pwritev = os.preadv, os.pwritev
+
+    def _short(call):
+        def _call(fd, buffers, offset):
+            return call(fd, [buffers[0][:777]], offset)
+
+        return _call
+
+    monkeypatch.setattr(os, "preadv", _short(preadv))
+    monkeypatch.setattr(os, "pwritev", _short(pwritev))
+    fd = os.open(path, os.O_RDWR)
+    try:
+        source = memoryview(data)
+        pwritev_all(fd, [source[:3000], source[3000:3000], source[3000:]], 5000)
+        bufs = [memoryview(bytearray(4000)), memoryview(bytearray(6000))]
+        preadv_into(fd, bufs, 5000)
+        with pytest.raises(EOFError):
+            preadv_into(fd, [memoryview(bytearray(100))], 20000)
+    finally:
+        os.close(fd)
+    assert bytes(bufs[0]) + bytes(bufs[1]) == data
+    assert path.read_bytes() == bytes(5000) + data + bytes(5000)
+
+
+def _unsupported(code, *, after=0):
+    # the first `after` calls go through, then the kernel refuses
+    calls = []
+
+    def _raise(real):
+        def _call(*args):
+            calls.append(args)
+            if len(calls) > after:
+                raise OSError(code, os.strerror(code))
+            return real(*args)
+
+        return _call
+
+    return _raise
+
+
+@pytest.mark.parametrize(
+    "copy_file_range_errno, sendfile_errno, copy_file_range_after, expected",
+    [
+        (None, None, 0, "copy_file_range"),
+        (errno.EXDEV, None, 0, "sendfile"),
+        (errno.EXDEV, None, 2, "sendfile"),
+        (errno.EINVAL, errno.EINVAL, 0, "pread/pwrite"),
+        (errno.EINVAL, errno.ENOSYS, 1, "pread/pwrite"),
+    ],
+)
+def test_copy_range_fallbacks(
+    tmp_path,
+    monkeypatch,
+    copy_file_range_errno,
+    sendfile_errno,
+    copy_file_range_after,
+    expected,
+):
+    if copy_file_range_errno:
+        monkeypatch.setattr(
+            os,
+            "copy_file_range",
+            _unsupported(copy_file_range_errno, after=copy_file_range_after)(os.copy_file_range),
+        )
+    if sendfile_errno:
+        monkeypatch.setattr(os, "sendfile", _unsupported(sendfile_errno)(os.sendfile))
+    data = os.urandom(4 * MiB)
+    src = tmp_path / "src"
+    src.write_bytes(data)
+    dst = tmp_path / "dst"
+    dst.write_bytes(bytes(4 * MiB))
+    flusher = Flusher("chunk")
+    with open(src, "rb") as src_fh, open(dst, "r+b") as dst_fh:
+        method = copy_range(
+            src_fd=src_fh.fileno(),
+            src_offset=100,
+            dst_fd=dst_fh.fileno(),
+            dst_offset=4096,
+            length=3 * MiB,
+            chunk_size=MiB,
+            flusher=flusher,
+        )
+    assert method == expected
+    copied = dst.read_bytes()
+    assert copied[4096 : 4096 + 3 * MiB] == data[100 : 100 + 3 * MiB]
+    assert copied[:4096] == bytes(4096)
+    assert copied[4096 + 3 * MiB :] == bytes(MiB - 4096)
+    # every chunk is flushed once, whichever path wrote it
+    assert flusher.stats["flushes"] == 3
+
+
+def test_copy_range_fails_on_real_errors(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "copy_file_range", _unsupported(errno.EIO)(os.copy_file_range))
+    src = tmp_path / "src"
+    src.write_bytes(os.urandom(8192))
+    dst = tmp_path / "dst"
+    dst.touch()
+    with open(src, "rb") as src_fh, open(dst, "r+b") as dst_fh:
+        with pytest.raises(OSError) as excinfo:
+            copy_range(
+                src_fd=src_fh.fileno(),
+                src_offset=0,
+                dst_fd=dst_fh.fileno(),
+                dst_offset=0,
+                length=8192,
+            )
+    assert excinfo.value.errno == errno.EIO
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import errno
+import os
+import time
+
+import pytest
+
+from devicetool.readscan import SECTOR_SIZE
+from devicetool.readscan import read_scan
+
+MiB = 1024 * 1024
+BAD_OFFSET = MiB + 8192
+SLOW_OFFSET = 2 * MiB
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "disk.img"
+    path.write_bytes(os.urandom(4 * MiB))
+    return path
+
+
+@pytest.fixture
+def no_direct(monkeypatch):
+    # what tmpfs and some image file hosts do
+    open_ = os.open
+
+    def _open(path, flags, *args):
+        if flags & os.O_DIRECT:
+            raise OSError(errno.EINVAL, os.strerror(errno.EINVAL))
+        return open_(path, flags, *args)
+
+    monkeypatch.setattr(os, "open", _open)
+
+
+@pytest.fixture
+def faulty(monkeypatch):
+    # one unreadable 4 KiB block and one slow chunk
+    preadv = os.preadv
+
+    def _preadv(fd, buffers, offset):
+        length = sum(len(_) for _ in buffers)
+        if offset <= BAD_OFFSET < offset + length:
+            raise OSError(errno.EIO, os.strerror(errno.EIO))
+        if offset == SLOW_OFFSET:
+            time.sleep(0.05)
+        return preadv(fd, buffers, offset)
+
+    monkeypatch.setattr(os, "preadv", _preadv)
+
+
+def test_clean_scan(image, no_direct):
+    result = read_scan(image, chunk_size=MiB, queue_depth=2, regions=4)
+    assert result["direct_io"] is False
+    assert result["bytes_read"] == 4 * MiB
+    assert result["errors"] == []
+    for region in result["regions"]:
+        assert region["requests"] == 1
+        assert sum(region["histogram_lt_us"].values()) == region["requests"]
+        # bucket n holds requests under 2**n us, so the max sits below the top bucket
+        assert region["max_ms"] * 1000 < max(int(_) for _ in region["histogram_lt_us"])
+
+
+def test_bad_block_is_isolated(image, no_direct, faulty):
+    result = read_scan(image, chunk_size=MiB, queue_depth=2, regions=4, slow_ms=30)
+    assert result["errors"] == [
+        {
+            "lba": BAD_OFFSET // SECTOR_SIZE,
+            "sectors": 4096 // SECTOR_SIZE,
+            "error": f"[Errno {errno.EIO}] {os.strerror(errno.EIO)}",
+        }
+    ]
+    # the failed chunk is not counted as read
+    assert result["bytes_read"] == 3 * MiB
+    assert [_["errors"] for _ in result["regions"]] == [0, 1, 0, 0]
+    assert [_["lba"] for _ in result["slow"]] == [SLOW_OFFSET // SECTOR_SIZE]
+    assert result["slow"][0]["sectors"] == MiB // SECTOR_SIZE
+    assert result["slow"][0]["ms"] >= 30
+
+
+def test_striped_scan_reads_a_fraction(image, no_direct):
+    result = read_scan(image, chunk_size=MiB, queue_depth=1, regions=4, stripe_every=2)
+    assert result["bytes_read"] == 2 * MiB
+    assert [_["requests"] for _ in result["regions"]] == [1, 0, 1, 0]
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import os
+import stat
+
+import pytest
+from click.testing import CliRunner
+
+from devicetool.cli import cli
+from devicetool.scanmap import classify_block
+from devicetool.scanmap import map_extents
+from devicetool.scanmap import scan_map
+
+MiB = 1024 * 1024
+TEXT = b"the quick brown fox jumps over the lazy dog, again and again. " * 20000
+
+
+@pytest.fixture
+def image(tmp_path):
+    # zero, text and random MiBs, in that order
+    path = tmp_path / "disk.img"
+    path.write_bytes(bytes(MiB) + TEXT[:MiB] + os.urandom(MiB))
+    return path
+
+
+@pytest.mark.parametrize(
+    "data, kind",
+    [
+        (bytes(65536), "zero"),
+        (TEXT[:65536], "structured"),
+        (os.urandom(65536), "high-entropy"),
+        (os.urandom(4096), "high-entropy"),
+        (TEXT[:4096], "structured"),
+    ],
+)
+def test_classify_block(data, kind):
+    assert classify_block(memoryview(data)) == kind
+
+
+def test_scan_map_finds_the_regions(image):
+    result = scan_map(image, chunk_size=MiB)
+    assert result["runs"] == [
+        [0, MiB, "zero"],
+        [MiB, 2 * MiB, "structured"],
+        [2 * MiB, 3 * MiB, "high-entropy"],
+    ]
+    assert result["totals"] == {"zero": MiB, "high-entropy": MiB, "structured": MiB}
+    assert result["sampled_bytes"] == 3 * MiB
+    assert map_extents(result, "high-entropy") == [(2 * MiB, 3 * MiB)]
+
+
+def test_scan_map_stride_samples_and_covers(image):
+    result = scan_map(image, stride=4, chunk_size=MiB)
+    assert result["sampled_bytes"] == 3 * MiB // 4
+    assert [_[2] for _ in result["runs"]] == ["zero", "structured", "high-entropy"]
+    assert sum(result["totals"].values()) == 3 * MiB
+
+
+def test_scan_map_expect(image):
+    result = CliRunner().invoke(cli, ["scan-map", image.as_posix(), "--expect", "zero"])
+    assert result.exit_code == 1
+
+
+def test_scan_map_refuses_a_partition(tmp_path):
+    partition = tmp_path / "sdz1"
+    try:
+        os.mknod(partition, stat.S_IFBLK | 0o600, os.makedev(8, 241))
+    except PermissionError:
+        pytest.skip("creating block device nodes needs CAP_MKNOD")
+    result = CliRunner().invoke(cli, ["scan-map", partition.as_posix()])
+    assert isinstance(result.exception, AssertionError)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import struct
+
+from devicetool.signatures import GiB
+from devicetool.signatures import MiB
+from devicetool.signatures import candidate_signatures
+from devicetool.signatures import find_signatures
+from devicetool.signatures import signature_extents
+
+
+def test_candidates_stay_inside_the_device():
+    for device_size in (4096, 1 * MiB, 100 * MiB + 512, 2 * GiB):
+        for signature in candidate_signatures(device_size=device_size):
+            assert 0 <= signature.start < signature.end <= device_size, signature
+
+
+def test_small_device_drops_far_offsets():
+    names = {_.name for _ in candidate_signatures(device_size=1 * MiB)}
+    assert "mbr" in names
+    assert "gpt-backup" in names
+    assert "btrfs" in {_.name for _ in candidate_signatures(device_size=100 * MiB)}
+    starts = [_.start for _ in candidate_signatures(device_size=1 * MiB) if _.name == "btrfs"]
+    assert starts == [64 * 1024]
+
+
+def test_backup_gpt_is_at_the_end():
+    device_size = 10 * MiB
+    backups = [_ for _ in candidate_signatures(device_size=device_size) if _.name == "gpt-backup"]
+    assert {_.end for _ in backups} == {device_size}
+    assert {_.magic_offset for _ in backups} == {device_size - 512, device_size - 4096}
+
+
+def test_ext_backup_superblocks_follow_geometry():
+    # 1 KiB blocks, 8192 blocks per group, first data block 1
+    signatures = candidate_signatures(device_size=64 * MiB, ext_geometry=(1024, 8192, 1))
+    starts = sorted(_.start for _ in signatures if _.name == "ext-backup")
+    assert starts == [(group * 8192 + 1) * 1024 for group in (1, 3, 5, 7)]
+
+
+def test_find_signatures_on_image(tmp_path):
+    image = tmp_path / "disk.img"
+    data = bytearray(4 * MiB)
+    data[510:512] = b"\x55\xaa"
+    data[512:520] = b"EFI PART"
+    data[len(data) - 512 : len(data) - 504] = b"EFI PART"
+    data[1024 + 0x38 : 1024 + 0x3A] = struct.pack("<H", 0xEF53)
+    image.write_bytes(data)
+    found = find_signatures(image)
+    names = sorted({_.name for _ in found})
+    assert names == ["ext", "gpt", "gpt-backup", "mbr"]
+    assert signature_extents(found)[0][0] == 0
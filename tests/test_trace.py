@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+
+from click.testing import CliRunner
+
+from devicetool import cli as cli_module
+from devicetool import trace
+from devicetool.cli import cli
+from devicetool.trace import TracedCommand
+
+
+class _SlowCommand:
+    def __init__(self, name):
+        self.name = name
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append(args)
+        time.sleep(0.02)
+
+    def __str__(self):
+        return f"/usr/bin/{self.name}"
+
+
+def test_traced_command_nesting_and_exec_timing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DEVICETOOL_CATALOG_DIR", (tmp_path / "catalog").as_posix())
+    # tracing is process wide, start from a clean tracer and leave it off
+    monkeypatch.setattr(trace.get_tracer(), "enabled", False)
+    monkeypatch.setattr(trace.get_tracer(), "events", [])
+    vbindiff = _SlowCommand("vbindiff")
+    monkeypatch.setattr(cli_module, "_vbindiff", TracedCommand(vbindiff))
+    image = tmp_path / "disk.img"
+    image.write_bytes(os.urandom(65536))
+    backup = tmp_path / "disk.bak"
+    backup.write_bytes(image.read_bytes()[:4096])
+    trace_file = tmp_path / "trace.json"
+
+    result = CliRunner().invoke(
+        cli,
+        [
+            "--trace",
+            trace_file.as_posix(),
+            "compare-byte-range",
+            "--device",
+            image.as_posix(),
+            "--backup-file",
+            backup.as_posix(),
+            "--start",
+            "0",
+            "--end",
+            "4096",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert len(vbindiff.calls) == 1
+
+    events = json.loads(trace_file.read_text())["traceEvents"]
+    spans = [_ for _ in events if _["ph"] != "M"]
+    assert {_["ph"] for _ in spans} == {"X"}
+    assert all(_["dur"] >= 0 for _ in spans)
+    by_name = {_["name"]: _ for _ in spans}
+    assert {"compare-byte-range", "backup-byte-range", "exec vbindiff"} <= set(by_name)
+    assert by_name["compare-byte-range"]["cat"] == "command"
+    assert by_name["exec vbindiff"]["cat"] == "exec"
+    assert by_name["exec vbindiff"]["args"]["argv"][0] == "/usr/bin/vbindiff"
+    assert by_name["exec vbindiff"]["dur"] >= 20000
+
+    # the nested invocation and the external command sit inside the outer command
+    outer = by_name["compare-byte-range"]
+    for name in ("backup-byte-range", "exec vbindiff"):
+        inner = by_name[name]
+        assert outer["ts"] <= inner["ts"]
+        # ts and dur are float microseconds, allow for their rounding
+        assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"] + 0.001
+    assert any(_["ph"] == "M" and _["name"] == "thread_name" for _ in events)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+import json
+
+import pytest
+
+from devicetool import tuning
+from devicetool.rangeio import DEFAULT_CHUNK_SIZE
+from devicetool.rangeio import DEFAULT_QUEUE_DEPTH
+from devicetool.tuning import device_tuning_key
+from devicetool.tuning import get_tuned_parameters
+from devicetool.tuning import probe_throughput
+from devicetool.tuning import store_tuned_parameters
+
+MiB = 1024 * 1024
+
+IDENTITIES = {
+    "a": {"model": "SSD 870", "firmware": "SVT02B6Q", "size": 500 * 1024**3},
+    "b": {"model": "SSD 870", "firmware": "SVT02B6Q", "size": 500 * 1024**3},
+    "c": {"model": "SSD 870", "firmware": "SVT01B6Q", "size": 500 * 1024**3},
+    "d": {"model": "SSD 870", "firmware": "SVT02B6Q", "size": 1000 * 1024**3},
+    "e": {"model": None, "firmware": None, "size": 4 * MiB},
+}
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    path = tmp_path / "tuning.json"
+    monkeypatch.setenv("DEVICETOOL_TUNING_CACHE", path.as_posix())
+    monkeypatch.setattr(
+        tuning,
+        "get_block_device_identity",
+        lambda device: IDENTITIES[str(device)],
+    )
+    return path
+
+
+def test_tuning_key_is_model_firmware_size(cache):
+    assert device_tuning_key("a") == f"SSD 870|SVT02B6Q|{500 * 1024**3}"
+    assert device_tuning_key("e") == f"unknown|unknown|{4 * MiB}"
+
+
+def test_tuned_parameters_are_shared_by_identical_devices(cache):
+    store_tuned_parameters("a", chunk_size=4 * MiB, queue_depth=16, read_mb_s=500.0)
+    assert get_tuned_parameters("a") == (4 * MiB, 16)
+    assert get_tuned_parameters("b") == (4 * MiB, 16)
+    # another firmware or size is another device as far as tuning goes
+    assert get_tuned_parameters("c") == (DEFAULT_CHUNK_SIZE, DEFAULT_QUEUE_DEPTH)
+    assert get_tuned_parameters("d") == (DEFAULT_CHUNK_SIZE, DEFAULT_QUEUE_DEPTH)
+    assert json.loads(cache.read_text())[device_tuning_key("a")]["read_mb_s"] == 500.0
+
+
+@pytest.mark.parametrize("content", ["{not json", "", "[1, 2]"])
+def test_corrupt_cache_is_a_miss(cache, content):
+    cache.write_text(content)
+    assert get_tuned_parameters("a") == (DEFAULT_CHUNK_SIZE, DEFAULT_QUEUE_DEPTH)
+    store_tuned_parameters("a", chunk_size=MiB, queue_depth=4)
+    assert get_tuned_parameters("a") == (MiB, 4)
+
+
+def test_probe_strides_sequentially(cache, tmp_path, monkeypatch):
+    image = tmp_path / "disk.img"
+    image.write_bytes(bytes(4 * MiB))
+    monkeypatch.setitem(IDENTITIES, image.as_posix(), IDENTITIES["e"])
+    offsets = []
+    pread_into = tuning.pread_into
+
+    def _pread_into(fd, buf, offset):
+        offsets.append(offset)
+        return pread_into(fd, buf, offset)
+
+    monkeypatch.setattr(tuning, "pread_into", _pread_into)
+    result = probe_throughput(
+        image,
+        block_sizes=(MiB,),
+        queue_depths=(1, 1),
+        probe_bytes=3 * MiB,
+    )
+    # the second trial continues where the first stopped and wraps around
+    assert offsets == [0, MiB, 2 * MiB, 3 * MiB, 0, MiB]
+    assert len(result["trials"]) == 2
+    assert result["best"]["block_size"] == MiB
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import os
+import stat
+
+import pytest
+
+from devicetool.usage import DeviceUsageIndex
+
+
+def _node(path, major, minor):
+    try:
+        os.mknod(path, stat.S_IFBLK | 0o600, os.makedev(major, minor))
+    except PermissionError:
+        pytest.skip("creating block device nodes needs CAP_MKNOD")
+    return path
+
+
+def _sysfs(sys_block, name, dev, *, parent=None, holders=(), backing_file=None):
+    node = (sys_block / parent / name) if parent else (sys_block / name)
+    node.mkdir(parents=True)
+    (node / "dev").write_text(f"{dev}\n")
+    if parent:
+        (node / "partition").write_text("1\n")
+    (node / "holders").mkdir()
+    for holder in holders:
+        (node / "holders" / holder).touch()
+    if backing_file:
+        (node / "loop").mkdir()
+        (node / "loop" / "backing_file").write_text(f"{backing_file}\n")
+    return node
+
+
+@pytest.fixture
+def roots(tmp_path):
+    proc = tmp_path / "proc"
+    (proc / "self").mkdir(parents=True)
+    (proc / "self" / "mountinfo").write_text("")
+    (proc / "swaps").write_text("Filename\tType\tSize\tUsed\tPriority\n")
+    sys_block = tmp_path / "sys" / "block"
+    sys_block.mkdir(parents=True)
+    return proc, sys_block
+
+
+def _mount(proc, dev, mount_point):
+    with open(proc / "self" / "mountinfo", "a") as fh:
+        fh.write(f"36 25 {dev} / {mount_point} rw,relatime shared:1 - ext4 none rw\n")
+
+
+def test_unused_disk_is_free(roots, tmp_path):
+    proc, sys_block = roots
+    _sysfs(sys_block, "sda", "8:0")
+    index = DeviceUsageIndex(proc=proc, sys_block=sys_block)
+    assert index.users(_node(tmp_path / "sda", 8, 0)) == ()
+    assert not index.in_use(tmp_path / "sda")
+
+
+def test_mounted_partition_marks_the_disk(roots, tmp_path):
+    proc, sys_block = roots
+    _sysfs(sys_block, "sda", "8:0")
+    _sysfs(sys_block, "sda1", "8:1", parent="sda")
+    _mount(proc, "8:1", "/mnt/data")
+    index = DeviceUsageIndex(proc=proc, sys_block=sys_block)
+    assert index.users(_node(tmp_path / "sda", 8, 0)) == ("mounted at /mnt/data",)
+    assert index.users(_node(tmp_path / "sda1", 8, 1)) == ("mounted at /mnt/data",)
+
+
+def test_dm_holder_chain(roots, tmp_path):
+    proc, sys_block = roots
+    _sysfs(sys_block, "sdb", "8:16", holders=("dm-0",))
+    _sysfs(sys_block, "dm-0", "253:0", holders=("dm-1",))
+    _sysfs(sys_block, "dm-1", "253:1")
+    _mount(proc, "253:1", "/srv")
+    index = DeviceUsageIndex(proc=proc, sys_block=sys_block)
+    assert index.users(_node(tmp_path / "sdb", 8, 16)) == (
+        "sdb held by dm-0",
+        "dm-0 held by dm-1",
+        "mounted at /srv",
+    )
+
+
+def test_swap_device_and_swap_file(roots, tmp_path):
+    proc, sys_block = roots
+    swap_device = _node(tmp_path / "sdc", 8, 32)
+    swap_file = tmp_path / "swapfile"
+    swap_file.write_bytes(bytes(4096))
+    file_dev = swap_file.stat().st_dev
+    _sysfs(sys_block, "sdc", "8:32")
+    _sysfs(sys_block, "vdz", f"{os.major(file_dev)}:{os.minor(file_dev)}")
+    with open(proc / "swaps", "a") as fh:
+        fh.write(f"{swap_device}\tpartition\t1024\t0\t-2\n")
+        fh.write(f"{swap_file}\tfile\t4\t0\t-3\n")
+    index = DeviceUsageIndex(proc=proc, sys_block=sys_block)
+    assert index.users(swap_device) == (f"swap {swap_device}",)
+    assert index.users(swap_file) == (f"swap {swap_file}",)
+    # the disk under the swap file's filesystem is in use too
+    backing = _node(tmp_path / "vdz", os.major(file_dev), os.minor(file_dev))
+    assert index.users(backing) == (f"holds swap file {swap_file}",)
+
+
+def test_loop_backed_image_file(roots, tmp_path):
+    proc, sys_block = roots
+    image = tmp_path / "disk.img"
+    image.write_bytes(bytes(4096))
+    other = tmp_path / "other.img"
+    other.write_bytes(bytes(4096))
+    _sysfs(sys_block, "loop0", "7:0", backing_file=image)
+    _sysfs(sys_block, "loop0p1", "259:0", parent="loop0")
+    _mount(proc, "259:0", "/mnt/image")
+    index = DeviceUsageIndex(proc=proc, sys_block=sys_block)
+    assert index.users(image) == ("attached to loop0", "mounted at /mnt/image")
+    assert index.users(other) == ()
+
+
+def test_unstattable_device_counts_as_in_use(roots, tmp_path):
+    proc, sys_block = roots
+    index = DeviceUsageIndex(proc=proc, sys_block=sys_block)
+    (reason,) = index.users(tmp_path / "missing")
+    assert reason.startswith("cannot stat")
+    assert index.in_use(tmp_path / "missing")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import os
+from pathlib import Path
+
+import pytest
+
+from devicetool.watch import DeviceEvent
+from devicetool.watch import Watcher
+from devicetool.watch import parse_uevent
+from devicetool.watch import refused_reason
+from devicetool.watch import rule_matches
+
+MiB = 1024 * 1024
+
+
+def _uevent(action: str, **env: str) -> bytes:
+    fields = [f"{action}@/devices/virtual/block/x".encode()]
+    fields += [f"{key}={value}".encode() for key, value in {"ACTION": action, **env}.items()]
+    return b"\0".join(fields) + b"\0"
+
+
+def test_parse_uevent_disk():
+    event = parse_uevent(_uevent("add", SUBSYSTEM="block", DEVTYPE="disk", DEVNAME="sdb"))
+    assert event == DeviceEvent(action="add", device=Path("/dev/sdb"))
+
+
+def test_parse_uevent_ignores_partitions_and_other_subsystems():
+    for env in (
+        {"SUBSYSTEM": "block", "DEVTYPE": "partition", "DEVNAME": "sdb1"},
+        {"SUBSYSTEM": "usb", "DEVTYPE": "usb_device", "DEVNAME": "bus/usb/001/002"},
+        {"SUBSYSTEM": "block", "DEVTYPE": "disk"},
+    ):
+        assert parse_uevent(_uevent("add", **env)) is None
+
+
+FACTS = {"size": 8 * 10**12, "model": "WDC WD80EFAX", "rotational": True, "transport": "sata"}
+
+
+@pytest.mark.parametrize(
+    "match, expected",
+    [
+        ({}, True),
+        ({"min_size": 10**12}, True),
+        ({"max_size": 10**12}, False),
+        ({"model": "WDC*"}, True),
+        ({"model": "Samsung*"}, False),
+        ({"rotational": False}, False),
+        ({"transport": "sata"}, True),
+        ({"transport": ["usb", "nvme"]}, False),
+        ({"transport": ["usb", "sata"], "min_size": 10**12}, True),
+    ],
+)
+def test_rule_matches(match, expected):
+    assert rule_matches({"match": match}, FACTS) is expected
+
+
+@pytest.mark.parametrize(
+    "name, reason",
+    [
+        ("sdb", None),
+        ("nvme0n1", None),
+        ("mmcblk0", None),
+        ("disk.img", None),
+        ("sdb1", "partition"),
+        ("nvme0n1p2", "partition"),
+        ("mmcblk0p1", "partition"),
+        ("dm-0", "stacked or virtual device"),
+        ("md127", "stacked or virtual device"),
+        ("loop3", "stacked or virtual device"),
+    ],
+)
+def test_refused_reason(name, reason):
+    assert refused_reason(Path("/dev") / name) == reason
+
+
+def _watch(rules: list[dict], devices: list[Path], *, force: bool = False) -> list[dict]:
+    events: list[dict] = []
+    watcher = Watcher(rules=rules, max_workers=2, force=force, emit=events.append)
+    try:
+        watcher.run(DeviceEvent(action="add", device=_, synthetic=True) for _ in devices)
+    finally:
+        watcher.close()
+    return events
+
+
+def test_watcher_runs_the_pipeline_on_an_image(tmp_path):
+    image = tmp_path / "disk.img"
+    image.write_bytes(os.urandom(4 * MiB))
+    rules = [
+        {
+            "name": "scratch",
+            "match": {"max_size": 8 * MiB},
+            "pipeline": ["identify", "scan-map", "wipe", "verify"],
+            "options": {"size": MiB},
+        }
+    ]
+    events = _watch(rules, [image], force=True)
+    steps = [_["step"] for _ in events if _["event"] == "step-done"]
+    assert steps == ["identify", "scan-map", "wipe", "verify"]
+    assert events[-1] == {"event": "done", "device": image}
+    data = image.read_bytes()
+    assert data[:MiB] == bytes(MiB)
+    assert data[-MiB:] == bytes(MiB)
+    assert data[MiB:-MiB] != bytes(2 * MiB)
+
+
+def test_watcher_ignores_unmatched_images(tmp_path):
+    image = tmp_path / "disk.img"
+    image.write_bytes(bytes(MiB))
+    events = _watch([{"match": {"min_size": 2 * MiB}, "pipeline": ["identify"]}], [image])
+    assert [_["event"] for _ in events] == ["ignored"]
+
+
+def test_watcher_refuses_partitions_and_stacked_devices(tmp_path):
+    data = os.urandom(MiB)
+    devices = []
+    for name in ("sdb1", "nvme0n1p2", "dm-0", "md127", "loop3"):
+        path = tmp_path / name
+        path.write_bytes(data)
+        devices.append(path)
+    events = _watch([{"pipeline": ["identify", "wipe"]}], devices, force=True)
+    assert [_["event"] for _ in events] == ["refused"] * len(devices)
+    assert all(_.read_bytes() == data for _ in devices)
+
+
+def test_destructive_rules_need_force():
+    with pytest.raises(ValueError, match="force"):
+        Watcher(rules=[{"name": "wipe-all", "pipeline": ["wipe"]}])